@@ -0,0 +1,100 @@
+"""
+Email Rendering Microbenchmark for CTF Registration API
+Measures the per-message cost of rendering confirmation emails and
+encoding them as MIME, without sending anything
+"""
+
+import sys
+import timeit
+from dotenv import load_dotenv
+
+# Load environment variables
+load_dotenv()
+
+# Import email functions from main.py
+try:
+    from main import (
+        EMAIL_TEMPLATES,
+        INTERNAL_EMAIL_TEMPLATE,
+        EXTERNAL_EMAIL_TEMPLATE,
+        encode_confirmation_message
+    )
+except ImportError as e:
+    print(f"❌ Error importing from main.py: {e}")
+    print("Make sure you're running this script from the project root directory.")
+    sys.exit(1)
+
+ITERATIONS = 2000
+
+SAMPLE_DATA = {
+    'internal': {
+        'name': 'John Doe',
+        'reg_no': '21ITR001',
+        'division': 'A',
+        'year_of_study': '3',
+        'email': 'john.doe@example.com',
+        'phone_number': '+919876543210',
+        'recipt_no': 'TXN_BENCH_12345'
+    },
+    'external': {
+        'name': 'Jane Smith',
+        'reg_no': 'EXT001',
+        'dept_name': 'Information Technology',
+        'year_of_study': '2',
+        'college_name': 'ABC Engineering College',
+        'email': 'jane.smith@example.com',
+        'phone_number': '+919123456789',
+        'recipt_no': 'TXN_BENCH_67890'
+    }
+}
+
+RAW_TEMPLATES = {
+    'internal': INTERNAL_EMAIL_TEMPLATE,
+    'external': EXTERNAL_EMAIL_TEMPLATE
+}
+
+def per_message_us(func) -> float:
+    """Best-of-5 time per call in microseconds"""
+    best = min(timeit.repeat(func, number=ITERATIONS, repeat=5))
+    return best / ITERATIONS * 1_000_000
+
+def benchmark(sheet_type: str):
+    """Benchmark one template"""
+    data = SAMPLE_DATA[sheet_type]
+    template = EMAIL_TEMPLATES[sheet_type]
+    raw = RAW_TEMPLATES[sheet_type]
+    html_content = template.render_html(data)
+    text_content = template.render_text(data)
+
+    results = {
+        "format() uncompiled template (HTML only)": per_message_us(lambda: raw.format(**data)),
+        "compiled render_html": per_message_us(lambda: template.render_html(data)),
+        "compiled render_text": per_message_us(lambda: template.render_text(data)),
+        "MIME encode (HTML + text)": per_message_us(
+            lambda: encode_confirmation_message(data['email'], template.subject, html_content, text_content)
+        ),
+        "render + MIME encode (full message)": per_message_us(
+            lambda: encode_confirmation_message(
+                data['email'], template.subject, template.render_html(data), template.render_text(data)
+            )
+        )
+    }
+
+    print(f"\n📧 {sheet_type.capitalize()} template ({ITERATIONS} iterations, best of 5)")
+    print("-" * 60)
+    for label, micros in results.items():
+        print(f"{label:<45} {micros:>9.1f} µs")
+
+def main():
+    """Main benchmark function"""
+    print("=" * 60)
+    print("⏱️  Email Rendering Microbenchmark")
+    print("=" * 60)
+
+    for sheet_type in ("internal", "external"):
+        benchmark(sheet_type)
+
+    print("\n" + "=" * 60)
+
+if __name__ == "__main__":
+    main()
@@ -1,26 +1,273 @@
-import gspread
 import json
+import re
+import html
+import html.parser
+import string
 import os
-from google.oauth2.service_account import Credentials
-import traceback
-from fastapi import FastAPI, HTTPException, BackgroundTasks
-from fastapi.responses import JSONResponse
+from fastapi import FastAPI, HTTPException, BackgroundTasks, Header, Request
+from fastapi.responses import JSONResponse, StreamingResponse, Response
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel, Field
+from pydantic import BaseModel, Field, ValidationError
 import uvicorn
 from datetime import datetime
 import asyncio
 from typing import Optional
 import queue
+import collections
 import threading
+import time
+import uuid
+import sqlite3
+import concurrent.futures
+import hashlib
+import codecs
+import random
+import math
 from dotenv import load_dotenv
-import smtplib
-from email.mime.text import MIMEText
-from email.mime.multipart import MIMEMultipart
+import email.header
+import email.utils
+import base64
+import functools
+import importlib
+import importlib.util
+import logging
+import logging.handlers
+import contextvars
+import contextlib
+import bisect
+import sys
+
+try:
+    import fcntl
+except ImportError:  # POSIX only: needed for QUEUE_MODE=shared
+    fcntl = None
+
+class LazyModule:
+    """
+    Stand-in for a module that is only imported when one of its attributes
+    is first used, so importing this app (and cold starts) do not pay for
+    gspread, google-auth, requests and smtplib until they are needed.
+    """
+    
+    def __init__(self, name: str):
+        self._name = name
+        self._module = None
+    
+    def __getattr__(self, attr):
+        module = self._module
+        if module is None:
+            module = self._module = importlib.import_module(self._name)
+        return getattr(module, attr)
+
+gspread = LazyModule("gspread")
+google_service_account = LazyModule("google.oauth2.service_account")
+google_auth_exceptions = LazyModule("google.auth.exceptions")
+google_auth_requests = LazyModule("google.auth.transport.requests")
+requests = LazyModule("requests")
+smtplib = LazyModule("smtplib")
+
+# Optional: only needed for EMAIL_DELIVERY_MODE=asyncio
+aiosmtplib = LazyModule("aiosmtplib") if importlib.util.find_spec("aiosmtplib") else None
 
 # Load environment variables from .env file
 load_dotenv()
 
+# Logging: JSON lines written by a background thread; LOG_SAMPLE_RATE is the
+# fraction of high-volume (per registration / per email) lines that are kept
+LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO').upper()
+LOG_SAMPLE_RATE = float(os.getenv('LOG_SAMPLE_RATE', '1.0'))
+LOG_QUEUE_SIZE = int(os.getenv('LOG_QUEUE_SIZE', '10000'))
+
+# Registration being handled by the current thread / task, added to every log line
+log_registration_id = contextvars.ContextVar("registration_id", default=None)
+
+class JSONLogFormatter(logging.Formatter):
+    """One JSON object per line, with any extra= fields as top-level keys"""
+    
+    RESERVED = set(vars(logging.LogRecord("", 0, "", 0, "", None, None))) | {"message", "sample"}
+    
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "time": datetime.fromtimestamp(record.created).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+            "registration_id": getattr(record, "registration_id", None),
+            "thread": record.threadName
+        }
+        entry.update((key, value) for key, value in vars(record).items() if key not in self.RESERVED)
+        if record.exc_text:
+            entry["exception"] = record.exc_text
+        return json.dumps(entry, default=str, ensure_ascii=False)
+
+class NonBlockingQueueHandler(logging.handlers.QueueHandler):
+    """
+    Hands records to the listener thread without ever blocking the caller:
+    the registration ID is attached, sampled records may be skipped, and
+    records are dropped (and counted) if the log queue is full
+    """
+    
+    def __init__(self, log_queue: queue.Queue, sample_rate: float = LOG_SAMPLE_RATE):
+        super().__init__(log_queue)
+        self.sample_rate = sample_rate
+        self.dropped = 0
+        self.sampled_out = 0
+    
+    def emit(self, record: logging.LogRecord):
+        if getattr(record, "sample", False) and self.sample_rate < 1.0 and random.random() >= self.sample_rate:
+            self.sampled_out += 1
+            return
+        if not hasattr(record, "registration_id"):
+            record.registration_id = log_registration_id.get()
+        super().emit(record)
+    
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # Resolve the message and traceback here; the JSON itself is built on the listener thread
+        record = logging.makeLogRecord(vars(record))
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+    
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+def setup_logging():
+    """Route the app logger through a bounded queue to a stdout writer thread"""
+    log = logging.getLogger("registration_api")
+    log.setLevel(LOG_LEVEL)
+    log.propagate = False
+    stream_handler = logging.StreamHandler(sys.stdout)
+    stream_handler.setFormatter(JSONLogFormatter())
+    queue_handler = NonBlockingQueueHandler(queue.Queue(maxsize=LOG_QUEUE_SIZE))
+    log.addHandler(queue_handler)
+    listener = logging.handlers.QueueListener(queue_handler.queue, stream_handler)
+    listener.start()
+    return log, queue_handler, listener
+
+logger, log_handler, log_listener = setup_logging()
+
+# Histogram buckets (seconds) for per-stage latencies on /metrics
+METRIC_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+class Metrics:
+    """
+    Prometheus-style counters and histograms.
+    Every thread records into its own shard (plain dicts reached through
+    threading.local), so recording takes no lock and never contends; the
+    lock is only taken the first time a thread records anything. /metrics
+    sums the shards when it is scraped.
+    """
+    
+    def __init__(self, buckets: tuple = METRIC_BUCKETS):
+        self.buckets = buckets
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._shards = []
+        self._descriptions = {}
+    
+    def describe(self, name: str, kind: str, help_text: str):
+        self._descriptions[name] = (kind, help_text)
+    
+    def _shard(self) -> tuple:
+        shard = getattr(self._local, "shard", None)
+        if shard is None:
+            shard = self._local.shard = ({}, {})
+            with self._lock:
+                self._shards.append(shard)
+        return shard
+    
+    def inc(self, name: str, amount: float = 1, **labels):
+        counters = self._shard()[0]
+        key = (name, tuple(sorted(labels.items())))
+        counters[key] = counters.get(key, 0) + amount
+    
+    def observe(self, name: str, value: float, **labels):
+        histograms = self._shard()[1]
+        key = (name, tuple(sorted(labels.items())))
+        histogram = histograms.get(key)
+        if histogram is None:
+            # Per-bucket counts (last one is +Inf), then the running sum
+            histogram = histograms[key] = [0] * (len(self.buckets) + 1) + [0.0]
+        histogram[bisect.bisect_left(self.buckets, value)] += 1
+        histogram[-1] += value
+    
+    @contextlib.contextmanager
+    def timer(self, name: str, **labels):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - started, **labels)
+    
+    @staticmethod
+    def _value(value) -> str:
+        """Sample value without exponent notation, so large counters keep every digit"""
+        value = float(value)
+        return str(int(value)) if value.is_integer() else repr(value)
+    
+    @staticmethod
+    def _labels(labels) -> str:
+        if not labels:
+            return ""
+        escaped = (
+            key + '="' + str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") + '"'
+            for key, value in labels
+        )
+        return "{" + ",".join(escaped) + "}"
+    
+    def render(self, gauges: list) -> str:
+        """
+        Prometheus text exposition of every counter and histogram plus
+        gauges given as (name, help, value) or (name, help, [(labels, value)])
+        """
+        counters = collections.defaultdict(float)
+        histograms = {}
+        with self._lock:
+            shards = list(self._shards)
+        for shard_counters, shard_histograms in shards:
+            for key, value in list(shard_counters.items()):
+                counters[key] += value
+            for key, histogram in list(shard_histograms.items()):
+                total = histograms.setdefault(key, [0] * len(histogram[:-1]) + [0.0])
+                for index, value in enumerate(list(histogram)):
+                    total[index] += value
+        
+        families = collections.defaultdict(list)
+        for (name, labels), value in sorted(counters.items()):
+            families[name].append(f"{name}{self._labels(labels)} {self._value(value)}")
+        for (name, labels), histogram in sorted(histograms.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + ("+Inf",), histogram[:-1]):
+                cumulative += count
+                families[name].append(f"{name}_bucket{self._labels(labels + (('le', bound),))} {cumulative}")
+            families[name].append(f"{name}_sum{self._labels(labels)} {histogram[-1]:.6f}")
+            families[name].append(f"{name}_count{self._labels(labels)} {cumulative}")
+        
+        lines = []
+        for name in sorted(families):
+            kind, help_text = self._descriptions.get(name, ("untyped", ""))
+            lines += [f"# HELP {name} {help_text}", f"# TYPE {name} {kind}", *families[name]]
+        for name, help_text, samples in gauges:
+            lines += [f"# HELP {name} {help_text}", f"# TYPE {name} gauge"]
+            if not isinstance(samples, list):
+                samples = [((), samples)]
+            lines += [f"{name}{self._labels(labels)} {self._value(value)}" for labels, value in samples]
+        return "\n".join(lines) + "\n"
+
+metrics = Metrics()
+metrics.describe("registrations_received_total", "counter", "Registration requests by type and outcome")
+metrics.describe("registrations_processed_total", "counter", "Queued registrations mirrored to Google Sheets by type and outcome")
+metrics.describe("confirmation_emails_total", "counter", "Confirmation email attempts by outcome")
+metrics.describe("registration_stage_duration_seconds", "histogram", "Latency of each registration processing stage")
+metrics.describe("sheets_errors_total", "counter", "Failed Google Sheets API calls by error class")
+metrics.describe("smtp_errors_total", "counter", "Failed confirmation email sends by error class")
+
 # Email configuration
 SMTP_SERVER = os.getenv('SMTP_SERVER', 'smtp.gmail.com')
 SMTP_PORT = int(os.getenv('SMTP_PORT', '587'))
@@ -28,10 +275,72 @@ SMTP_USERNAME = os.getenv('SMTP_USERNAME', '')
 SMTP_PASSWORD = os.getenv('SMTP_PASSWORD', '')
 SMTP_FROM_EMAIL = os.getenv('SMTP_FROM_EMAIL', SMTP_USERNAME)
 SMTP_FROM_NAME = os.getenv('SMTP_FROM_NAME', 'Battle of Binaries 1.0 Registration Team')
+# SMTP connection pool: connections kept open, messages sent per connection
+# before it is recycled, and idle time after which a connection is checked with NOOP
+SMTP_POOL_SIZE = int(os.getenv('SMTP_POOL_SIZE', '3'))
+SMTP_MAX_MESSAGES_PER_CONNECTION = int(os.getenv('SMTP_MAX_MESSAGES_PER_CONNECTION', '100'))
+SMTP_NOOP_AFTER_IDLE = float(os.getenv('SMTP_NOOP_AFTER_IDLE', '10'))
+SMTP_TIMEOUT = float(os.getenv('SMTP_TIMEOUT', '30'))
 
 # Thread-safe queue for handling registrations
 registration_queue = queue.Queue()
 
+# Queue batching: write at most QUEUE_BATCH_SIZE registrations per append,
+# waiting up to QUEUE_FLUSH_WINDOW seconds for a batch to fill
+QUEUE_BATCH_SIZE = int(os.getenv('QUEUE_BATCH_SIZE', '50'))
+QUEUE_FLUSH_WINDOW = float(os.getenv('QUEUE_FLUSH_WINDOW', '0.5'))
+# Backpressure: max registrations waiting to reach Google Sheets before new
+# ones get 429 (0 = unbounded) and the bounds of the Retry-After hint (seconds)
+QUEUE_CAPACITY = int(os.getenv('QUEUE_CAPACITY', '2000'))
+QUEUE_RETRY_AFTER_MIN = int(os.getenv('QUEUE_RETRY_AFTER_MIN', '1'))
+QUEUE_RETRY_AFTER_MAX = int(os.getenv('QUEUE_RETRY_AFTER_MAX', '300'))
+# On shutdown, how long to keep writing queued registrations and sending
+# confirmation emails before deferring the rest to the next start (seconds)
+SHUTDOWN_DRAIN_TIMEOUT = float(os.getenv('SHUTDOWN_DRAIN_TIMEOUT', '25'))
+# Concurrent confirmation email sends (separate from the Sheets writers)
+EMAIL_WORKERS = int(os.getenv('EMAIL_WORKERS', os.getenv('SMTP_POOL_SIZE', '3')))
+# 'thread' (smtplib worker threads) or 'asyncio' (aiosmtplib on a dedicated event loop)
+EMAIL_DELIVERY_MODE = os.getenv('EMAIL_DELIVERY_MODE', 'thread').lower()
+EMAIL_ASYNC_CONCURRENCY = int(os.getenv('EMAIL_ASYNC_CONCURRENCY', '100'))
+EMAIL_SEND_TIMEOUT = float(os.getenv('EMAIL_SEND_TIMEOUT', '60'))
+# Email outbox: attempts before dead-lettering, retry backoff and poll interval (seconds)
+EMAIL_MAX_ATTEMPTS = int(os.getenv('EMAIL_MAX_ATTEMPTS', '5'))
+EMAIL_RETRY_BACKOFF_BASE = float(os.getenv('EMAIL_RETRY_BACKOFF_BASE', '30'))
+EMAIL_RETRY_BACKOFF_MAX = float(os.getenv('EMAIL_RETRY_BACKOFF_MAX', '1800'))
+EMAIL_RETRY_POLL_INTERVAL = float(os.getenv('EMAIL_RETRY_POLL_INTERVAL', '5'))
+
+# Optional token required in the X-Admin-Token header for /admin endpoints
+ADMIN_TOKEN = os.getenv('ADMIN_TOKEN', '')
+
+# Local SQLite store (system of record) mirrored to Google Sheets
+REGISTRATION_DB_PATH = os.getenv('REGISTRATION_DB_PATH', 'registrations.db')
+# Group-commit window for store writes (seconds)
+STORE_COMMIT_INTERVAL = float(os.getenv('STORE_COMMIT_INTERVAL', '0.005'))
+# How often rows left unsynced by a non-retryable failure are queued again (seconds)
+UNSYNCED_RETRY_INTERVAL = float(os.getenv('UNSYNCED_RETRY_INTERVAL', '300'))
+# Queue sharing for `uvicorn --workers N`: 'local' (each process drains its
+# own in-memory queue) or 'shared' (every process enqueues into the store and
+# the process holding QUEUE_LEADER_LOCK_PATH is the only one that drains it,
+# polling for new rows every QUEUE_SHARED_POLL_INTERVAL seconds)
+QUEUE_MODE = os.getenv('QUEUE_MODE', 'local').lower()
+QUEUE_LEADER_LOCK_PATH = os.getenv('QUEUE_LEADER_LOCK_PATH', REGISTRATION_DB_PATH + '.leader')
+QUEUE_SHARED_POLL_INTERVAL = float(os.getenv('QUEUE_SHARED_POLL_INTERVAL', '0.25'))
+# In-memory registration results for GET /registrations/{id}: max entries,
+# time to live and the longest a lookup may long-poll (seconds)
+RESULT_STORE_MAX_ENTRIES = int(os.getenv('RESULT_STORE_MAX_ENTRIES', '10000'))
+RESULT_STORE_TTL = float(os.getenv('RESULT_STORE_TTL', '3600'))
+RESULT_LONG_POLL_MAX = float(os.getenv('RESULT_LONG_POLL_MAX', '30'))
+# Bulk uploads: max records per request and max size of a single record (bytes)
+BATCH_MAX_RECORDS = int(os.getenv('BATCH_MAX_RECORDS', '5000'))
+BATCH_MAX_RECORD_BYTES = int(os.getenv('BATCH_MAX_RECORD_BYTES', '65536'))
+# Idempotency-Key support: how long first responses are replayed (seconds),
+# how many are kept and the longest accepted key
+IDEMPOTENCY_TTL = float(os.getenv('IDEMPOTENCY_TTL', '86400'))
+IDEMPOTENCY_MAX_ENTRIES = int(os.getenv('IDEMPOTENCY_MAX_ENTRIES', '10000'))
+IDEMPOTENCY_KEY_MAX_LENGTH = 255
+# Keepalive comment interval for /registrations/{id}/events streams (seconds)
+SSE_KEEPALIVE_INTERVAL = float(os.getenv('SSE_KEEPALIVE_INTERVAL', '15'))
+
 # Pydantic models for registration
 class InternalRegistration(BaseModel):
     name: str = Field(..., description="Student name")
@@ -52,9 +361,9 @@ class ExternalRegistration(BaseModel):
     phone_number: str = Field(..., description="Phone number")
     recipt_no: str = Field(..., description="recipt_no")
 
-def create_email_template_internal(data: dict) -> str:
-    """Create HTML email template for internal students"""
-    return f"""
+# Email templates: str.format-style sources with one {field} slot per
+# registration field. They are compiled once at import (see CompiledEmailTemplate).
+INTERNAL_EMAIL_TEMPLATE = """
     <!DOCTYPE html>
     <html>
     <head>
@@ -130,38 +439,38 @@ def create_email_template_internal(data: dict) -> str:
         </div>
         
         <div class="content">
-            <h2>Dear {data['name']},</h2>
+            <h2>Dear {name},</h2>
             <p>Congratulations! Your registration for the Battle of Binaries 1.0  Competition has been successfully confirmed.</p>
             
             <div class="details">
                 <h3 style="color: #667eea; margin-top: 0;">📋 Registration Details</h3>
                 <div class="detail-row">
                     <span class="detail-label">Name:</span>
-                    <span class="detail-value">{data['name']}</span>
+                    <span class="detail-value">{name}</span>
                 </div>
                 <div class="detail-row">
                     <span class="detail-label">Registration Number:</span>
-                    <span class="detail-value">{data['reg_no']}</span>
+                    <span class="detail-value">{reg_no}</span>
                 </div>
                 <div class="detail-row">
                     <span class="detail-label">Division:</span>
-                    <span class="detail-value">{data['division']}</span>
+                    <span class="detail-value">{division}</span>
                 </div>
                 <div class="detail-row">
                     <span class="detail-label">Year of Study:</span>
-                    <span class="detail-value">{data['year_of_study']}</span>
+                    <span class="detail-value">{year_of_study}</span>
                 </div>
                 <div class="detail-row">
                     <span class="detail-label">Email:</span>
-                    <span class="detail-value">{data['email']}</span>
+                    <span class="detail-value">{email}</span>
                 </div>
                 <div class="detail-row">
                     <span class="detail-label">Phone Number:</span>
-                    <span class="detail-value">{data['phone_number']}</span>
+                    <span class="detail-value">{phone_number}</span>
                 </div>
                 <div class="detail-row" style="border-bottom: none;">
                     <span class="detail-label">Receipt Number:</span>
-                    <span class="detail-value">{data['recipt_no']}</span>
+                    <span class="detail-value">{recipt_no}</span>
                 </div>
             </div>
             
@@ -196,7 +505,7 @@ def create_email_template_internal(data: dict) -> str:
                 <li>Mark the competition date on your calendar</li>
             </ul>
             
-            <p><strong>Important:</strong> Please save this email for your records. Your receipt number <strong>{data['recipt_no']}</strong> is your proof of registration.</p>
+            <p><strong>Important:</strong> Please save this email for your records. Your receipt number <strong>{recipt_no}</strong> is your proof of registration.</p>
             
             <p>If you have any questions or concerns, feel free to reach out to our support team.</p>
             
@@ -214,9 +523,7 @@ def create_email_template_internal(data: dict) -> str:
     </html>
     """
 
-def create_email_template_external(data: dict) -> str:
-    """Create HTML email template for external students"""
-    return f"""
+EXTERNAL_EMAIL_TEMPLATE = """
     <!DOCTYPE html>
     <html>
     <head>
@@ -283,42 +590,42 @@ def create_email_template_external(data: dict) -> str:
         </div>
         
         <div class="content">
-            <h2>Dear {data['name']},</h2>
-            <p>Congratulations! Your registration for the Battle of Binaries 1.0  Competition has been successfully confirmed. We're excited to have you participate from <strong>{data['college_name']}</strong>!</p>
+            <h2>Dear {name},</h2>
+            <p>Congratulations! Your registration for the Battle of Binaries 1.0  Competition has been successfully confirmed. We're excited to have you participate from <strong>{college_name}</strong>!</p>
             
             <div class="details">
                 <h3 style="color: #f5576c; margin-top: 0;">📋 Registration Details</h3>
                 <div class="detail-row">
                     <span class="detail-label">Name:</span>
-                    <span class="detail-value">{data['name']}</span>
+                    <span class="detail-value">{name}</span>
                 </div>
                 <div class="detail-row">
                     <span class="detail-label">Registration Number:</span>
-                    <span class="detail-value">{data['reg_no']}</span>
+                    <span class="detail-value">{reg_no}</span>
                 </div>
                 <div class="detail-row">
                     <span class="detail-label">Department:</span>
-                    <span class="detail-value">{data['dept_name']}</span>
+                    <span class="detail-value">{dept_name}</span>
                 </div>
                 <div class="detail-row">
                     <span class="detail-label">Year of Study:</span>
-                    <span class="detail-value">{data['year_of_study']}</span>
+                    <span class="detail-value">{year_of_study}</span>
                 </div>
                 <div class="detail-row">
                     <span class="detail-label">College:</span>
-                    <span class="detail-value">{data['college_name']}</span>
+                    <span class="detail-value">{college_name}</span>
                 </div>
                 <div class="detail-row">
                     <span class="detail-label">Email:</span>
-                    <span class="detail-value">{data['email']}</span>
+                    <span class="detail-value">{email}</span>
                 </div>
                 <div class="detail-row">
                     <span class="detail-label">Phone Number:</span>
-                    <span class="detail-value">{data['phone_number']}</span>
+                    <span class="detail-value">{phone_number}</span>
                 </div>
                 <div class="detail-row" style="border-bottom: none;">
                     <span class="detail-label">Receipt Number:</span>
-                    <span class="detail-value">{data['recipt_no']}</span>
+                    <span class="detail-value">{recipt_no}</span>
                 </div>
             </div>
             
@@ -354,7 +661,7 @@ def create_email_template_external(data: dict) -> str:
                 <li>Connect with other participants from different colleges</li>
             </ul>
             
-            <p><strong>Important:</strong> Please save this email for your records. Your receipt number <strong>{data['recipt_no']}</strong> is your proof of registration.</p>
+            <p><strong>Important:</strong> Please save this email for your records. Your receipt number <strong>{recipt_no}</strong> is your proof of registration.</p>
             
             <p>If you have any questions or concerns, feel free to reach out to our support team.</p>
             
@@ -372,299 +679,3243 @@ def create_email_template_external(data: dict) -> str:
     </html>
     """
 
-def send_confirmation_email(to_email: str, subject: str, html_content: str, student_name: str) -> dict:
+class _HTMLToText(html.parser.HTMLParser):
+    """Convert a template's HTML into its plain-text alternative"""
+    
+    BLOCK_TAGS = {"p", "div", "h1", "h2", "h3", "ul", "li", "br"}
+    SKIP_TAGS = {"head", "style", "title"}
+    
+    def __init__(self):
+        super().__init__()
+        self.lines = [""]
+        self._skip_depth = 0
+        self._space = False
+    
+    def _newline(self):
+        self._space = False
+        if self.lines[-1].strip():
+            self.lines.append("")
+    
+    def handle_starttag(self, tag, attrs):
+        if tag in self.SKIP_TAGS:
+            self._skip_depth += 1
+        elif tag in self.BLOCK_TAGS:
+            self._newline()
+            if tag in ("h1", "h2", "h3", "p"):
+                # Blank line before headings and paragraphs
+                self.lines.append("")
+            if tag == "li":
+                self.lines[-1] = "- "
+    
+    def handle_endtag(self, tag):
+        if tag in self.SKIP_TAGS:
+            self._skip_depth -= 1
+        elif tag in self.BLOCK_TAGS:
+            self._newline()
+    
+    def handle_data(self, data):
+        if self._skip_depth:
+            return
+        text = " ".join(data.split())
+        if not text:
+            self._space = self._space or bool(data)
+            return
+        # Keep a single space only where the HTML had whitespace
+        if (self._space or data[0].isspace()) and self.lines[-1] and not self.lines[-1].endswith(" "):
+            self.lines[-1] += " "
+        self.lines[-1] += text
+        self._space = data[-1].isspace()
+    
+    @classmethod
+    def convert(cls, source: str) -> str:
+        parser = cls()
+        parser.feed(source)
+        parser.close()
+        text = "\n".join(line.rstrip() for line in parser.lines)
+        # Collapse runs of blank lines
+        return re.sub(r"\n{3,}", "\n\n", text).strip() + "\n"
+
+class CompiledEmailTemplate:
+    """
+    Email template compiled once into static segments and field slots.
+    The head, CSS and footer are rendered a single time; each message only
+    joins the pre-rendered segments with the (HTML-escaped) student fields.
+    A plain-text alternative is derived from the same template.
+    """
+    
+    def __init__(self, subject: str, source: str):
+        self.subject = subject
+        self.html_segments, self.html_fields = self._compile(source)
+        # Field slots survive the HTML-to-text conversion as literal {field} text
+        self.text_segments, self.text_fields = self._compile(_HTMLToText.convert(source.replace("{{", "").replace("}}", "")))
+    
+    @staticmethod
+    def _compile(source: str) -> tuple:
+        segments = [""]
+        fields = []
+        for literal, field, _, _ in string.Formatter().parse(source):
+            segments[-1] += literal
+            if field is not None:
+                fields.append(field)
+                segments.append("")
+        return segments, fields
+    
+    @staticmethod
+    def _join(segments: list, values: list) -> str:
+        parts = [segments[0]]
+        for value, segment in zip(values, segments[1:]):
+            parts.append(value)
+            parts.append(segment)
+        return "".join(parts)
+    
+    def render_html(self, data: dict) -> str:
+        return self._join(self.html_segments, [html.escape(str(data[field])) for field in self.html_fields])
+    
+    def render_text(self, data: dict) -> str:
+        return self._join(self.text_segments, [str(data[field]) for field in self.text_fields])
+
+EMAIL_TEMPLATES = {
+    "internal": CompiledEmailTemplate(
+        "✅ Battle of Binaries 1.0 Registration Confirmed - Internal Participant",
+        INTERNAL_EMAIL_TEMPLATE
+    ),
+    "external": CompiledEmailTemplate(
+        "✅ Battle of Binaries 1.0 Registration Confirmed - External Participant",
+        EXTERNAL_EMAIL_TEMPLATE
+    )
+}
+
+def create_email_template_internal(data: dict) -> str:
+    """Create HTML email template for internal students"""
+    return EMAIL_TEMPLATES["internal"].render_html(data)
+
+def create_email_template_external(data: dict) -> str:
+    """Create HTML email template for external students"""
+    return EMAIL_TEMPLATES["external"].render_html(data)
+
+
+class PooledSMTPConnection:
+    """An authenticated SMTP session plus its usage counters"""
+    
+    def __init__(self):
+        self.server = smtplib.SMTP(SMTP_SERVER, SMTP_PORT, timeout=SMTP_TIMEOUT)
+        try:
+            self.server.starttls()  # Enable TLS encryption
+            self.server.login(SMTP_USERNAME, SMTP_PASSWORD)
+        except Exception:
+            self.server.close()
+            raise
+        self.messages_sent = 0
+        self.last_used = time.monotonic()
+    
+    def is_alive(self) -> bool:
+        """Check the session with NOOP if it has been idle long enough to be dropped"""
+        if time.monotonic() - self.last_used < SMTP_NOOP_AFTER_IDLE:
+            return True
+        try:
+            return self.server.noop()[0] == 250
+        except Exception:
+            return False
+    
+    def close(self):
+        try:
+            self.server.quit()
+        except Exception:
+            try:
+                self.server.close()
+            except Exception:
+                pass
+
+class SMTPConnectionPool:
+    """
+    Small pool of authenticated SMTP connections reused across messages.
+    Idle connections are checked with NOOP, connections dropped by the
+    server are replaced transparently, and each connection is retired after
+    SMTP_MAX_MESSAGES_PER_CONNECTION messages.
+    """
+    
+    def __init__(self, size: int = SMTP_POOL_SIZE, max_messages: int = SMTP_MAX_MESSAGES_PER_CONNECTION):
+        self.size = max(size, 1)
+        self.max_messages = max_messages
+        self._lock = threading.Lock()
+        self._available = threading.Condition(self._lock)
+        self._idle = []
+        self._open = 0
+        self.connections_created = 0
+        self.reconnects = 0
+        self.messages_sent = 0
+    
+    def _acquire(self) -> PooledSMTPConnection:
+        while True:
+            with self._lock:
+                while not self._idle and self._open >= self.size:
+                    self._available.wait()
+                if not self._idle:
+                    # Reserve a slot for a new connection
+                    self._open += 1
+                    break
+                conn = self._idle.pop()
+            
+            # NOOP / QUIT are network round trips, so they run without the pool lock
+            if conn.is_alive():
+                return conn
+            # Server closed the idle session; replace it
+            conn.close()
+            with self._lock:
+                self._open -= 1
+                self.reconnects += 1
+                self._available.notify()
+        
+        try:
+            conn = PooledSMTPConnection()
+        except Exception:
+            with self._lock:
+                self._open -= 1
+                self._available.notify()
+            raise
+        with self._lock:
+            self.connections_created += 1
+        return conn
+    
+    def _release(self, conn: PooledSMTPConnection, healthy: bool):
+        retire = not healthy or conn.messages_sent >= self.max_messages
+        if retire:
+            conn.close()
+        with self._lock:
+            if retire:
+                self._open -= 1
+            else:
+                conn.last_used = time.monotonic()
+                self._idle.append(conn)
+            self._available.notify()
+    
+    def send_message(self, to_email: str, message: bytes):
+        """Send an encoded message on a pooled connection, reconnecting once if the session was dropped"""
+        for attempt in range(2):
+            conn = self._acquire()
+            try:
+                conn.server.sendmail(SMTP_FROM_EMAIL, [to_email], message)
+            except (smtplib.SMTPServerDisconnected, smtplib.SMTPConnectError, ConnectionError) as e:
+                self._release(conn, healthy=False)
+                if attempt:
+                    raise
+                with self._lock:
+                    self.reconnects += 1
+                logger.warning(f"SMTP connection dropped ({e}); reconnecting")
+                continue
+            except Exception:
+                self._release(conn, healthy=False)
+                raise
+            conn.messages_sent += 1
+            with self._lock:
+                self.messages_sent += 1
+            self._release(conn, healthy=True)
+            return
+    
+    def close(self):
+        """Close every idle connection"""
+        with self._lock:
+            idle, self._idle = self._idle, []
+            self._open -= len(idle)
+        for conn in idle:
+            conn.close()
+    
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "size": self.size,
+                "open": self._open,
+                "idle": len(self._idle),
+                "connections_created": self.connections_created,
+                "reconnects": self.reconnects,
+                "messages_sent": self.messages_sent,
+                "max_messages_per_connection": self.max_messages
+            }
+
+smtp_pool = SMTPConnectionPool()
+
+# Static MIME pieces, encoded once
+SMTP_FROM_HEADER = email.utils.formataddr((SMTP_FROM_NAME, SMTP_FROM_EMAIL), charset='utf-8')
+MIME_PART_HEADERS = {
+    subtype: (
+        f'Content-Type: text/{subtype}; charset="utf-8"\r\n'
+        'MIME-Version: 1.0\r\n'
+        'Content-Transfer-Encoding: base64\r\n\r\n'
+    ).encode('ascii')
+    for subtype in ("plain", "html")
+}
+
+@functools.lru_cache(maxsize=32)
+def encode_subject(subject: str) -> str:
+    """RFC 2047-encode a subject line (cached; subjects come from the templates)"""
+    return email.header.Header(subject, 'utf-8').encode(linesep='\r\n')
+
+def encode_confirmation_message(to_email: str, subject: str, html_content: str,
+                                text_content: Optional[str] = None) -> bytes:
+    """
+    Encode a confirmation email as a ready-to-send multipart/alternative
+    message. Only the recipient, boundary and bodies vary per message; the
+    sender, subject and part headers are encoded once.
+    """
+    if "\r" in to_email or "\n" in to_email or not to_email.isascii():
+        raise ValueError(f"Invalid recipient address: {to_email!r}")
+    
+    boundary = f"==============={uuid.uuid4().hex}=="
+    parts = [(
+        f'Content-Type: multipart/alternative; boundary="{boundary}"\r\n'
+        'MIME-Version: 1.0\r\n'
+        f'From: {SMTP_FROM_HEADER}\r\n'
+        f'To: {to_email}\r\n'
+        f'Subject: {encode_subject(subject)}\r\n\r\n'
+    ).encode('ascii')]
+    
+    # Plain-text alternative first, so clients prefer the HTML part
+    for subtype, content in (("plain", text_content), ("html", html_content)):
+        if not content:
+            continue
+        parts.append(f"--{boundary}\r\n".encode('ascii'))
+        parts.append(MIME_PART_HEADERS[subtype])
+        parts.append(base64.encodebytes(content.encode('utf-8')).replace(b"\n", b"\r\n"))
+    parts.append(f"--{boundary}--\r\n".encode('ascii'))
+    return b"".join(parts)
+
+def send_confirmation_email(to_email: str, subject: str, html_content: str, student_name: str,
+                            text_content: Optional[str] = None) -> dict:
     """Send confirmation email using SMTP"""
     try:
         # Check if SMTP is configured
         if not SMTP_USERNAME or not SMTP_PASSWORD:
-            print("⚠️  SMTP credentials not configured. Email not sent.")
+            logger.warning("SMTP credentials not configured. Email not sent.")
             return {
                 "success": False,
+                "permanent": True,
                 "message": "SMTP not configured"
             }
         
-        # Create message
-        msg = MIMEMultipart('alternative')
-        msg['From'] = f"{SMTP_FROM_NAME} <{SMTP_FROM_EMAIL}>"
-        msg['To'] = to_email
-        msg['Subject'] = subject
-        
-        # Attach HTML content
-        html_part = MIMEText(html_content, 'html')
-        msg.attach(html_part)
+        try:
+            message = encode_confirmation_message(to_email, subject, html_content, text_content)
+        except ValueError as e:
+            logger.error("Cannot encode confirmation email", extra={"to_email": to_email, "error": str(e)})
+            return {
+                "success": False,
+                "permanent": True,
+                "message": str(e)
+            }
         
         # Connect to SMTP server and send email
-        print(f"📧 Sending confirmation email to {to_email}...")
+        logger.info("Sending confirmation email", extra={"sample": True, "to_email": to_email})
         
-        with smtplib.SMTP(SMTP_SERVER, SMTP_PORT) as server:
-            server.starttls()  # Enable TLS encryption
-            server.login(SMTP_USERNAME, SMTP_PASSWORD)
-            server.send_message(msg)
+        with metrics.timer("registration_stage_duration_seconds", stage="smtp_send"):
+            smtp_pool.send_message(to_email, message)
         
-        print(f"✅ Email sent successfully to {student_name} ({to_email})")
+        logger.info("Confirmation email sent", extra={"sample": True, "to_email": to_email})
         return {
             "success": True,
             "message": f"Email sent to {to_email}"
         }
     
     except Exception as e:
-        print(f"❌ Error sending email to {to_email}: {e}")
-        traceback.print_exc()
+        metrics.inc("smtp_errors_total", error_class=type(e).__name__)
+        logger.exception("Error sending confirmation email", extra={"to_email": to_email})
         return {
             "success": False,
             "message": f"Failed to send email: {str(e)}"
         }
 
-def get_google_credentials():
-    """Load Google credentials from environment variables or file"""
-    try:
-        # Check if environment variables are set
-        if os.getenv('GOOGLE_PROJECT_ID'):
-            # Use environment variables (recommended for production)
-            private_key = os.getenv('GOOGLE_PRIVATE_KEY', '')
-            
-            # Handle newline characters in private key
-            if '\\n' in private_key:
-                private_key = private_key.replace('\\n', '\n')
-            
-            creds_info = {
-                "type": os.getenv('GOOGLE_CREDENTIALS_TYPE', 'service_account'),
-                "project_id": os.getenv('GOOGLE_PROJECT_ID'),
-                "private_key_id": os.getenv('GOOGLE_PRIVATE_KEY_ID'),
-                "private_key": private_key,
-                "client_email": os.getenv('GOOGLE_CLIENT_EMAIL'),
-                "client_id": os.getenv('GOOGLE_CLIENT_ID'),
-                "auth_uri": os.getenv('GOOGLE_AUTH_URI', 'https://accounts.google.com/o/oauth2/auth'),
-                "token_uri": os.getenv('GOOGLE_TOKEN_URI', 'https://oauth2.googleapis.com/token'),
-                "auth_provider_x509_cert_url": os.getenv('GOOGLE_AUTH_PROVIDER_X509_CERT_URL', 'https://www.googleapis.com/oauth2/v1/certs'),
-                "client_x509_cert_url": os.getenv('GOOGLE_CLIENT_X509_CERT_URL'),
-                "universe_domain": os.getenv('GOOGLE_UNIVERSE_DOMAIN', 'googleapis.com')
-            }
-            
-            env_name = os.getenv('ENVIRONMENT', 'production')
-            print(f"✓ Using environment variables for credentials ({env_name})")
-            
-        elif os.path.exists('credentials.json'):
-            # Fallback to local JSON file (for local development only)
-            with open('credentials.json', 'r') as f:
-                creds_info = json.load(f)
-            print("⚠️  Using local credentials.json file (development only)")
-            print("⚠️  For production, use environment variables!")
+# Google OAuth configuration
+GOOGLE_SCOPES = [
+    'https://www.googleapis.com/auth/spreadsheets',
+    'https://www.googleapis.com/auth/drive'
+]
+# Sheets API quota budgets and retry policy
+SHEETS_READ_QUOTA_PER_MINUTE = int(os.getenv('SHEETS_READ_QUOTA_PER_MINUTE', '60'))
+SHEETS_WRITE_QUOTA_PER_MINUTE = int(os.getenv('SHEETS_WRITE_QUOTA_PER_MINUTE', '60'))
+SHEETS_MAX_RETRIES = int(os.getenv('SHEETS_MAX_RETRIES', '5'))
+SHEETS_BACKOFF_BASE = float(os.getenv('SHEETS_BACKOFF_BASE', '1.0'))
+SHEETS_BACKOFF_MAX = float(os.getenv('SHEETS_BACKOFF_MAX', '60.0'))
+# Refresh the access token this many seconds before it actually expires
+GOOGLE_TOKEN_REFRESH_MARGIN = int(os.getenv('GOOGLE_TOKEN_REFRESH_MARGIN', '300'))
+
+def load_google_credentials():
+    """Load Google service account credentials from environment variables or file"""
+    # Check if environment variables are set
+    if os.getenv('GOOGLE_PROJECT_ID'):
+        # Use environment variables (recommended for production)
+        private_key = os.getenv('GOOGLE_PRIVATE_KEY', '')
         
-        else:
-            raise FileNotFoundError(
-                "No credentials found! Please either:\n"
-                "1. Set environment variables (recommended for production)\n"
-                "2. Place credentials.json file in the project root (development only)"
-            )
+        # Handle newline characters in private key
+        if '\\n' in private_key:
+            private_key = private_key.replace('\\n', '\n')
         
-        # Define required scopes for Google Sheets and Drive
-        scope = [
-            'https://www.googleapis.com/auth/spreadsheets',
-            'https://www.googleapis.com/auth/drive'
-        ]
+        creds_info = {
+            "type": os.getenv('GOOGLE_CREDENTIALS_TYPE', 'service_account'),
+            "project_id": os.getenv('GOOGLE_PROJECT_ID'),
+            "private_key_id": os.getenv('GOOGLE_PRIVATE_KEY_ID'),
+            "private_key": private_key,
+            "client_email": os.getenv('GOOGLE_CLIENT_EMAIL'),
+            "client_id": os.getenv('GOOGLE_CLIENT_ID'),
+            "auth_uri": os.getenv('GOOGLE_AUTH_URI', 'https://accounts.google.com/o/oauth2/auth'),
+            "token_uri": os.getenv('GOOGLE_TOKEN_URI', 'https://oauth2.googleapis.com/token'),
+            "auth_provider_x509_cert_url": os.getenv('GOOGLE_AUTH_PROVIDER_X509_CERT_URL', 'https://www.googleapis.com/oauth2/v1/certs'),
+            "client_x509_cert_url": os.getenv('GOOGLE_CLIENT_X509_CERT_URL'),
+            "universe_domain": os.getenv('GOOGLE_UNIVERSE_DOMAIN', 'googleapis.com')
+        }
         
-        # Create credentials and authorize client
-        creds = Credentials.from_service_account_info(creds_info, scopes=scope)
-        client = gspread.authorize(creds)
+        env_name = os.getenv('ENVIRONMENT', 'production')
+        logger.info(f"Using environment variables for credentials ({env_name})")
         
-        return client
+    elif os.path.exists('credentials.json'):
+        # Fallback to local JSON file (for local development only)
+        with open('credentials.json', 'r') as f:
+            creds_info = json.load(f)
+        logger.warning("Using local credentials.json file (development only)")
+        logger.warning("For production, use environment variables!")
     
-    except FileNotFoundError as e:
-        print(f"❌ Credentials Error: {e}")
-        return None
-    except Exception as e:
-        print(f"❌ Error loading credentials: {e}")
-        traceback.print_exc()
+    else:
+        raise FileNotFoundError(
+            "No credentials found! Please either:\n"
+            "1. Set environment variables (recommended for production)\n"
+            "2. Place credentials.json file in the project root (development only)"
+        )
+    
+    return google_service_account.Credentials.from_service_account_info(creds_info, scopes=GOOGLE_SCOPES)
+
+def api_error_status(error: Exception):
+    """HTTP status code of a gspread APIError, or None for other exceptions"""
+    if not isinstance(error, gspread.exceptions.APIError):
         return None
+    response = getattr(error, 'response', None)
+    return getattr(response, 'status_code', None) or getattr(error, 'code', None)
+
+def is_auth_error(error: Exception) -> bool:
+    """Check whether an exception means our Google credentials were rejected"""
+    if isinstance(error, google_auth_exceptions.RefreshError):
+        return True
+    return api_error_status(error) == 401
+
+def is_missing_or_forbidden_error(error: Exception) -> bool:
+    """Check whether an exception means a spreadsheet or worksheet is gone or inaccessible"""
+    if isinstance(error, (gspread.exceptions.SpreadsheetNotFound, gspread.exceptions.WorksheetNotFound)):
+        return True
+    return api_error_status(error) in (403, 404)
+
+def is_transient_error(error: Exception) -> bool:
+    """Check whether a Sheets call failed for a reason worth retrying (quota, 5xx, network)"""
+    if isinstance(error, (requests.exceptions.ConnectionError, requests.exceptions.Timeout)):
+        return True
+    return api_error_status(error) in (429, 500, 502, 503, 504)
+
+def is_ambiguous_write_error(error: Exception) -> bool:
+    """Check whether a failed write may still have been applied (5xx or network error, unlike a 429)"""
+    return is_transient_error(error) and api_error_status(error) != 429
 
-def save_to_google_sheet(data: dict, sheet_type: str):
+class TokenBucket:
+    """Thread-safe token bucket refilled continuously at a per-minute rate"""
+    
+    def __init__(self, per_minute: int):
+        self.capacity = max(per_minute, 1)
+        self.rate = self.capacity / 60.0
+        self.tokens = float(self.capacity)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+    
+    def _refill_locked(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self._updated) * self.rate)
+        self._updated = now
+    
+    def acquire(self) -> float:
+        """Take one token, waiting for the bucket to refill if needed; returns seconds waited"""
+        waited = 0.0
+        while True:
+            with self._lock:
+                self._refill_locked()
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return waited
+                delay = (1 - self.tokens) / self.rate
+            time.sleep(delay)
+            waited += delay
+    
+    def drain(self):
+        """Empty the bucket, e.g. after Google reported the quota as exhausted"""
+        with self._lock:
+            self._refill_locked()
+            self.tokens = 0.0
+    
+    def available(self) -> float:
+        with self._lock:
+            self._refill_locked()
+            return self.tokens
+
+class SheetsScheduler:
     """
-    Save registration data to Google Sheets
-    sheet_type: 'internal' or 'external'
+    Front door for every gspread call. Paces reads and writes with token
+    buckets sized to the Sheets per-minute quotas and retries transient
+    failures (429, 5xx, network errors) with jittered exponential backoff.
+    Writes are not idempotent, so they are only retried here on 429; other
+    failures are left to the caller, which checks the sheet first.
+    When the budget is exhausted calls wait for tokens instead of failing.
     """
-    try:
-        client = get_google_credentials()
-        if not client:
-            return {"error": "Failed to authenticate with Google Sheets"}
-        
-        # Get Spreadsheet ID from environment or use default
-        spreadsheet_id = os.getenv('SPREADSHEET_ID', '1NXwX5RkuPMPxOonmD7cJDjCK5sxhUnvytwj7O3FMyuQ')
-        
-        # Open the spreadsheet
-        spreadsheet = client.open_by_key(spreadsheet_id)
-        
-        # Determine which worksheet to use based on sheet_type
-        if sheet_type == "internal":
-            # gid=0 is the first/default sheet
-            try:
-                worksheet = spreadsheet.get_worksheet(0)  # Get first worksheet
-                print(f"Opened internal worksheet: {worksheet.title}")
-            except Exception as e:
-                print(f"Error opening internal worksheet: {e}")
-                return {"error": "Failed to open internal worksheet"}
-        
-        elif sheet_type == "external":
-            # gid=1179914067 - need to find this specific worksheet
+    
+    def __init__(self, read_per_minute: int = SHEETS_READ_QUOTA_PER_MINUTE,
+                 write_per_minute: int = SHEETS_WRITE_QUOTA_PER_MINUTE,
+                 max_retries: int = SHEETS_MAX_RETRIES):
+        self.buckets = {
+            "read": TokenBucket(read_per_minute),
+            "write": TokenBucket(write_per_minute)
+        }
+        self.max_retries = max_retries
+        self._lock = threading.Lock()
+        self._backoff_until = 0.0
+        self._item_retries = {}
+        self.calls = {"read": 0, "write": 0}
+        self.retries = 0
+        self.throttled_seconds = 0.0
+    
+    @staticmethod
+    def backoff_delay(attempt: int) -> float:
+        """Full-jitter exponential backoff for the given attempt number"""
+        ceiling = min(SHEETS_BACKOFF_MAX, SHEETS_BACKOFF_BASE * (2 ** attempt))
+        return random.uniform(0, ceiling)
+    
+    def _wait_for_backoff(self):
+        with self._lock:
+            remaining = self._backoff_until - time.monotonic()
+        if remaining > 0:
+            time.sleep(remaining)
+    
+    def back_off(self, attempt: int) -> float:
+        """Start a shared backoff window so every caller pauses together"""
+        delay = self.backoff_delay(attempt)
+        with self._lock:
+            self._backoff_until = max(self._backoff_until, time.monotonic() + delay)
+        return delay
+    
+    def call(self, kind: str, func, *args, **kwargs):
+        """Run a gspread call under the read or write budget, retrying transient failures"""
+        attempt = 0
+        while True:
+            self._wait_for_backoff()
+            waited = self.buckets[kind].acquire()
+            with self._lock:
+                self.calls[kind] += 1
+                self.throttled_seconds += waited
             try:
-                worksheets = spreadsheet.worksheets()
-                worksheet = None
-                for ws in worksheets:
-                    if str(ws.id) == "1179914067":
-                        worksheet = ws
-                        break
-                
-                if not worksheet:
-                    # If not found by gid, try by index (usually second sheet)
-                    worksheet = spreadsheet.get_worksheet(1)
-                
-                print(f"Opened external worksheet: {worksheet.title}")
+                return func(*args, **kwargs)
             except Exception as e:
-                print(f"Error opening external worksheet: {e}")
-                return {"error": "Failed to open external worksheet"}
-        else:
-            return {"error": "Invalid sheet_type"}
+                metrics.inc("sheets_errors_total", error_class=type(e).__name__, status=api_error_status(e) or "")
+                if not is_transient_error(e) or attempt >= self.max_retries:
+                    raise
+                if kind == "write" and is_ambiguous_write_error(e):
+                    raise
+                if api_error_status(e) == 429:
+                    self.buckets[kind].drain()
+                delay = self.back_off(attempt)
+                attempt += 1
+                with self._lock:
+                    self.retries += 1
+                logger.warning(f"Sheets {kind} failed ({e}); retry {attempt}/{self.max_retries} in {delay:.2f}s")
+    
+    def record_item_retry(self, registration_id: str) -> int:
+        """Count a held-back registration; returns how often it has been retried"""
+        with self._lock:
+            count = self._item_retries.get(registration_id, 0) + 1
+            self._item_retries[registration_id] = count
+            return count
+    
+    def clear_item(self, registration_id: str):
+        with self._lock:
+            self._item_retries.pop(registration_id, None)
+    
+    def stats(self) -> dict:
+        with self._lock:
+            backoff_remaining = max(self._backoff_until - time.monotonic(), 0.0)
+            item_retries = dict(self._item_retries)
+            calls = dict(self.calls)
+            retries = self.retries
+            throttled = self.throttled_seconds
+        return {
+            "tokens_left": {kind: round(bucket.available(), 2) for kind, bucket in self.buckets.items()},
+            "quota_per_minute": {kind: bucket.capacity for kind, bucket in self.buckets.items()},
+            "backoff_in_progress": backoff_remaining > 0,
+            "backoff_remaining_seconds": round(backoff_remaining, 3),
+            "calls": calls,
+            "retries": retries,
+            "throttled_seconds": round(throttled, 3),
+            "held_back_items": len(item_retries),
+            "retries_per_item": item_retries
+        }
+
+sheets_scheduler = SheetsScheduler()
+
+def sheets_read(func, *args, **kwargs):
+    """Run a gspread read call through the quota scheduler"""
+    return sheets_scheduler.call("read", func, *args, **kwargs)
+
+def sheets_write(func, *args, **kwargs):
+    """Run a gspread write call through the quota scheduler"""
+    return sheets_scheduler.call("write", func, *args, **kwargs)
+
+class GoogleClientHolder:
+    """
+    Long-lived, thread-safe holder for the authorized gspread client.
+    Authorizes once, refreshes the access token shortly before it expires
+    and only rebuilds the client after an authentication failure. Token
+    exchanges run under a separate lock, one at a time, so readers and
+    stats() never wait on the network.
+    """
+    
+    def __init__(self, refresh_margin: int = GOOGLE_TOKEN_REFRESH_MARGIN):
+        self.refresh_margin = refresh_margin
+        self._lock = threading.Lock()
+        self._auth_lock = threading.Lock()
+        self._client = None
+        self._credentials = None
+        self.auth_count = 0
+        self.refresh_count = 0
+        self.failure_count = 0
+        self.last_auth_seconds = None
+        self.last_refresh_seconds = None
+        self.authorized_at = None
+    
+    def _authorize(self):
+        """Build credentials, fetch the first token and authorize a new client"""
+        started = time.perf_counter()
+        creds = load_google_credentials()
+        creds.refresh(google_auth_requests.Request())
+        client = gspread.authorize(creds)
         
-        # Get current timestamp
-        timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        with self._lock:
+            self._credentials = creds
+            self._client = client
+            self.auth_count += 1
+            self.last_auth_seconds = time.perf_counter() - started
+            self.authorized_at = datetime.now()
+        logger.info(f"Authorized Google Sheets client in {self.last_auth_seconds:.3f}s")
+    
+    def _needs_refresh(self) -> bool:
+        """Check whether the current token is missing or about to expire"""
+        creds = self._credentials
+        if not creds.token or creds.expiry is None:
+            return True
+        # google-auth stores expiry as a naive UTC datetime
+        remaining = (creds.expiry - datetime.utcnow()).total_seconds()
+        return remaining <= self.refresh_margin
+    
+    def _refresh(self, creds):
+        """Refresh the access token in place, keeping the same client"""
+        started = time.perf_counter()
+        creds.refresh(google_auth_requests.Request())
+        with self._lock:
+            self.refresh_count += 1
+            self.last_refresh_seconds = time.perf_counter() - started
+        logger.info(f"Refreshed Google access token in {self.last_refresh_seconds:.3f}s")
+    
+    def get_client(self):
+        """Return the shared client, authorizing or refreshing only when needed"""
+        with self._lock:
+            if self._client is not None and not self._needs_refresh():
+                return self._client
         
-        # Check if headers exist, if not create them
-        try:
-            headers = worksheet.row_values(1)
-            if not headers or len(headers) == 0:
-                if sheet_type == "internal":
-                    worksheet.append_row(["Name", "Registration Number", "Division", "Year of Study", "Email", "Phone Number", "recipt_no", "Timestamp"])
+        with self._auth_lock:
+            with self._lock:
+                # Another thread may have authorized or refreshed while this one waited
+                client, creds = self._client, self._credentials
+                if client is not None and not self._needs_refresh():
+                    return client
+            try:
+                if client is None:
+                    self._authorize()
                 else:
-                    worksheet.append_row(["Name", "Registration Number", "Department", "Year of Study", "College Name", "Email", "Phone Number", "recipt_no", "Timestamp"])
-                print(f"Created headers for {sheet_type} sheet")
-        except Exception as e:
-            print(f"Error checking headers: {e}")
-        
-        # Prepare row data
-        if sheet_type == "internal":
-            row_data = [
-                data['name'],
-                data['reg_no'],
-                data['division'],
-                data['year_of_study'],
-                data['email'],
-                data['phone_number'],
-                data['recipt_no'],
-                timestamp
-            ]
-        else:  # external
-            row_data = [
-                data['name'],
-                data['reg_no'],
-                data['dept_name'],
-                data['year_of_study'],
-                data['college_name'],
-                data['email'],
-                data['phone_number'],
-                data['recipt_no'],
-                timestamp
-            ]
-        
-        # Check for duplicate registration (based on reg_no and recipt_no)
-        try:
-            all_records = worksheet.get_all_records()
-            for record in all_records:
-                existing_reg = str(record.get('Registration Number', '')).strip()
-                existing_txn = str(record.get('recipt_no', '')).strip()
-                
-                if (existing_reg == data['reg_no'].strip() and 
-                    existing_txn == data['recipt_no'].strip()):
-                    return {
-                        "error": "Duplicate registration",
-                        "message": f"Registration with reg_no {data['reg_no']} and recipt_no {data['recipt_no']} already exists"
-                    }
-        except Exception as e:
-            print(f"Error checking duplicates: {e}")
-        
-        # Append the new row
-        worksheet.append_row(row_data)
-        print(f"Successfully saved {sheet_type} registration: {data['name']} ({data['reg_no']})")
-        
-        # Send confirmation email after successful registration
-        email_result = {"success": False, "message": "Email not sent"}
-        try:
-            if sheet_type == "internal":
-                html_content = create_email_template_internal(data)
-                subject = "✅ Battle of Binaries 1.0 Registration Confirmed - Internal Participant"
-            else:
-                html_content = create_email_template_external(data)
-                subject = "✅ Battle of Binaries 1.0 Registration Confirmed - External Participant"
+                    self._refresh(creds)
+                with self._lock:
+                    return self._client
             
-            email_result = send_confirmation_email(
-                to_email=data['email'],
-                subject=subject,
-                html_content=html_content,
-                student_name=data['name']
-            )
-        except Exception as email_error:
-            print(f"⚠️  Email sending failed but registration successful: {email_error}")
-        
-        return {
-            "success": True,
-            "message": f"{sheet_type.capitalize()} registration saved successfully",
-            "email_sent": email_result.get('success', False),
-            "data": {
-                **data,
-                "timestamp": timestamp,
-                "sheet_type": sheet_type
-            }
-        }
+            except FileNotFoundError as e:
+                logger.error(f"Credentials Error: {e}")
+                with self._lock:
+                    self.failure_count += 1
+                return None
+            except Exception as e:
+                logger.exception(f"Error loading credentials: {e}")
+                with self._lock:
+                    self.failure_count += 1
+                    self._client = None
+                    self._credentials = None
+                return None
     
-    except Exception as e:
-        print(f"Error saving to Google Sheets: {e}")
-        traceback.print_exc()
-        return {"error": f"Failed to save registration: {str(e)}"}
+    def invalidate(self):
+        """Drop the cached client so the next call re-authorizes from scratch"""
+        with self._lock:
+            self._client = None
+            self._credentials = None
+        logger.warning("Google Sheets client invalidated after authentication failure")
+    
+    def stats(self) -> dict:
+        """Authentication statistics for status reporting"""
+        with self._lock:
+            expiry = self._credentials.expiry if self._credentials else None
+            return {
+                "authorized": self._client is not None,
+                "auth_count": self.auth_count,
+                "refresh_count": self.refresh_count,
+                "failure_count": self.failure_count,
+                "last_auth_seconds": self.last_auth_seconds,
+                "last_refresh_seconds": self.last_refresh_seconds,
+                "authorized_at": self.authorized_at.strftime("%Y-%m-%d %H:%M:%S") if self.authorized_at else None,
+                "token_expiry_utc": expiry.strftime("%Y-%m-%d %H:%M:%S") if expiry else None
+            }
 
-def process_registration_queue():
-    """Background worker to process registrations from queue"""
-    print("Started registration queue processor")
-    while True:
+# Shared Google Sheets client used by every registration
+google_client = GoogleClientHolder()
+
+def get_google_credentials():
+    """Return the shared, authorized Google Sheets client (None on failure)"""
+    return google_client.get_client()
+
+def open_spreadsheet(client):
+    """Open the registration spreadsheet"""
+    # Get Spreadsheet ID from environment or use default
+    spreadsheet_id = os.getenv('SPREADSHEET_ID', '1NXwX5RkuPMPxOonmD7cJDjCK5sxhUnvytwj7O3FMyuQ')
+    return sheets_read(client.open_by_key, spreadsheet_id)
+
+def find_worksheet(spreadsheet, sheet_type: str):
+    """
+    Find the worksheet for a registration type inside the spreadsheet
+    sheet_type: 'internal' or 'external'
+    """
+    # Determine which worksheet to use based on sheet_type
+    if sheet_type == "internal":
+        # gid=0 is the first/default sheet
         try:
-            # Get registration from queue (blocking call)
-            registration_data, sheet_type, result_callback = registration_queue.get()
-            
-            print(f"Processing {sheet_type} registration from queue: {registration_data.get('name')}")
+            worksheet = sheets_read(spreadsheet.get_worksheet, 0)  # Get first worksheet
+            logger.info(f"Opened internal worksheet: {worksheet.title}")
+            return worksheet
+        except Exception as e:
+            logger.error(f"Error opening internal worksheet: {e}")
+            if is_transient_error(e):
+                raise
+            return None
+    
+    elif sheet_type == "external":
+        # gid=1179914067 - need to find this specific worksheet
+        try:
+            worksheets = sheets_read(spreadsheet.worksheets)
+            worksheet = None
+            for ws in worksheets:
+                if str(ws.id) == "1179914067":
+                    worksheet = ws
+                    break
             
-            # Save to Google Sheets
-            result = save_to_google_sheet(registration_data, sheet_type)
+            if not worksheet:
+                # If not found by gid, try by index (usually second sheet)
+                worksheet = sheets_read(spreadsheet.get_worksheet, 1)
             
-            # Call callback with result if provided
-            if result_callback:
-                result_callback(result)
+            logger.info(f"Opened external worksheet: {worksheet.title}")
+            return worksheet
+        except Exception as e:
+            logger.error(f"Error opening external worksheet: {e}")
+            if is_transient_error(e):
+                raise
+            return None
+    
+    return None
+
+class WorksheetCache:
+    """
+    Cache of the spreadsheet handle, worksheet handles and "headers verified"
+    flags per sheet type. Entries are only dropped when a Sheets call fails
+    with a not-found or permission error, or when the client is rebuilt.
+    Opening happens outside the cache lock, under a per-sheet-type lock, so
+    a slow open neither blocks the other sheet's lane nor stats().
+    """
+    
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._open_locks = {"internal": threading.Lock(), "external": threading.Lock()}
+        self._client = None
+        self._spreadsheet = None
+        self._worksheets = {}
+        self._headers_verified = set()
+        # Bumped whenever cached handles are dropped, so a slow open cannot cache a stale handle
+        self._generation = 0
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+    
+    def _lookup(self, client, sheet_type: str):
+        """Cached worksheet or None; call with self._lock held"""
+        if client is not self._client:
+            # A rebuilt client must not reuse handles bound to the old session
+            self._client = client
+            self._spreadsheet = None
+            self._worksheets.clear()
+            self._headers_verified.clear()
+            self._generation += 1
+        worksheet = self._worksheets.get(sheet_type)
+        if worksheet is not None:
+            self.hits += 1
+        return worksheet
+    
+    def get(self, client, sheet_type: str):
+        """Return the cached worksheet for sheet_type, opening it on a miss"""
+        with self._lock:
+            worksheet = self._lookup(client, sheet_type)
+        if worksheet is not None:
+            return worksheet
+        
+        with self._open_locks.setdefault(sheet_type, threading.Lock()):
+            with self._lock:
+                # Another thread may have opened it while this one waited
+                worksheet = self._lookup(client, sheet_type)
+                if worksheet is not None:
+                    return worksheet
+                self.misses += 1
+                spreadsheet = self._spreadsheet
+                generation = self._generation
             
-            # Mark task as done
-            registration_queue.task_done()
+            if spreadsheet is None:
+                spreadsheet = open_spreadsheet(client)
+            worksheet = find_worksheet(spreadsheet, sheet_type)
             
-        except Exception as e:
-            print(f"Error in queue processor: {e}")
-            traceback.print_exc()
-            registration_queue.task_done()
+            with self._lock:
+                if generation == self._generation:
+                    if self._spreadsheet is None:
+                        self._spreadsheet = spreadsheet
+                    if worksheet is not None:
+                        self._worksheets[sheet_type] = worksheet
+            return worksheet
+    
+    def headers_verified(self, sheet_type: str) -> bool:
+        with self._lock:
+            return sheet_type in self._headers_verified
+    
+    def mark_headers_verified(self, sheet_type: str):
+        with self._lock:
+            self._headers_verified.add(sheet_type)
+    
+    def invalidate(self, sheet_type: str):
+        """Forget the handles and header state for a sheet type"""
+        with self._lock:
+            self._spreadsheet = None
+            self._worksheets.pop(sheet_type, None)
+            self._headers_verified.discard(sheet_type)
+            self._generation += 1
+            self.invalidations += 1
+        logger.warning(f"Cached {sheet_type} worksheet invalidated")
+    
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "cached_worksheets": sorted(self._worksheets),
+                "headers_verified": sorted(self._headers_verified),
+                "hits": self.hits,
+                "misses": self.misses,
+                "invalidations": self.invalidations
+            }
 
-# Start background worker thread
-worker_thread = threading.Thread(target=process_registration_queue, daemon=True)
-worker_thread.start()
+worksheet_cache = WorksheetCache()
 
-# Create FastAPI app
-app = FastAPI(
-    title="Battle of Binaries 1.0 Registration API",
-    description="Asynchronous API for handling internal and external student registrations",
-    version="1.0.0"
-)
+def open_worksheet(client, sheet_type: str):
+    """
+    Open the worksheet for a registration type (cached)
+    sheet_type: 'internal' or 'external'
+    """
+    return worksheet_cache.get(client, sheet_type)
 
-# Configure CORS based on environment
-allowed_origins_env = os.getenv('ALLOWED_ORIGINS', '*')
-if allowed_origins_env == '*':
-    allowed_origins = ["*"]
-else:
-    # Split comma-separated origins
-    allowed_origins = [origin.strip() for origin in allowed_origins_env.split(',')]
+def handle_sheets_error(error: Exception, sheet_type: str):
+    """Drop cached state that a failed Sheets call has shown to be stale"""
+    if is_auth_error(error):
+        google_client.invalidate()
+    elif is_missing_or_forbidden_error(error):
+        worksheet_cache.invalidate(sheet_type)
 
-# Add CORS middleware
+# How often the duplicate index is re-synced from the sheets (seconds)
+DUPLICATE_INDEX_SYNC_INTERVAL = int(os.getenv('DUPLICATE_INDEX_SYNC_INTERVAL', '300'))
+# How long to wait before retrying a failed startup warm-up (seconds)
+WARMUP_RETRY_INTERVAL = float(os.getenv('WARMUP_RETRY_INTERVAL', '30'))
+
+def registration_key(reg_no, recipt_no) -> tuple:
+    """Normalized (Registration Number, recipt_no) key used for duplicate detection"""
+    return (str(reg_no).strip(), str(recipt_no).strip())
+
+class DuplicateIndex:
+    """
+    In-memory index of (Registration Number, recipt_no) keys per worksheet.
+    Loaded once, updated after every successful append and periodically
+    re-synced from the sheets so duplicate checks never need an API call.
+    """
+    
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._keys = {}
+        self._added_since_sync = {}
+        self._stale = set()
+        self.last_synced = {}
+        self.sync_count = 0
+    
+    def is_loaded(self, sheet_type: str) -> bool:
+        with self._lock:
+            return sheet_type in self._keys
+    
+    def mark_stale(self, sheet_type: str):
+        """Record that an append may have been applied without the index knowing"""
+        with self._lock:
+            self._stale.add(sheet_type)
+    
+    def is_stale(self, sheet_type: str) -> bool:
+        with self._lock:
+            return sheet_type in self._stale
+    
+    def load(self, sheet_type: str, worksheet) -> int:
+        """(Re)load every key of a worksheet; returns the number of keys indexed"""
+        with self._lock:
+            # Remember appends that happen while the sheet is being downloaded
+            self._added_since_sync[sheet_type] = set()
+        
+        with self._lock:
+            # An append that failed ambiguously before this download is covered by it
+            was_stale = sheet_type in self._stale
+            self._stale.discard(sheet_type)
+        
+        try:
+            records = sheets_read(worksheet.get_all_records)
+        except Exception:
+            if was_stale:
+                self.mark_stale(sheet_type)
+            raise
+        keys = {
+            registration_key(record.get('Registration Number', ''), record.get('recipt_no', ''))
+            for record in records
+        }
+        
+        with self._lock:
+            keys |= self._added_since_sync.pop(sheet_type, set())
+            self._keys[sheet_type] = keys
+            self.last_synced[sheet_type] = datetime.now()
+            self.sync_count += 1
+        logger.info(f"Duplicate index loaded for {sheet_type} sheet ({len(keys)} registrations)")
+        return len(keys)
+    
+    def contains(self, sheet_type: str, reg_no, recipt_no, worksheet=None) -> bool:
+        """O(1) duplicate lookup; loads the index on first use if a worksheet is given"""
+        if worksheet is not None and not self.is_loaded(sheet_type):
+            try:
+                self.load(sheet_type, worksheet)
+            except Exception as e:
+                logger.error(f"Error checking duplicates: {e}")
+        
+        with self._lock:
+            return registration_key(reg_no, recipt_no) in self._keys.get(sheet_type, ())
+    
+    def add(self, sheet_type: str, reg_no, recipt_no):
+        """Record a key after its row has been appended"""
+        key = registration_key(reg_no, recipt_no)
+        with self._lock:
+            self._keys.setdefault(sheet_type, set()).add(key)
+            if sheet_type in self._added_since_sync:
+                self._added_since_sync[sheet_type].add(key)
+    
+    def sync_all(self):
+        """Re-sync every worksheet from Google Sheets"""
+        client = get_google_credentials()
+        if not client:
+            return
+        for sheet_type in ("internal", "external"):
+            try:
+                worksheet = open_worksheet(client, sheet_type)
+                if worksheet is not None:
+                    self.load(sheet_type, worksheet)
+            except Exception as e:
+                logger.error(f"Error syncing duplicate index for {sheet_type} sheet: {e}")
+                handle_sheets_error(e, sheet_type)
+    
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "sync_interval_seconds": DUPLICATE_INDEX_SYNC_INTERVAL,
+                "sync_count": self.sync_count,
+                "sheets": {
+                    sheet_type: {
+                        "keys": len(keys),
+                        "last_synced": self.last_synced[sheet_type].strftime("%Y-%m-%d %H:%M:%S")
+                    }
+                    for sheet_type, keys in self._keys.items()
+                }
+            }
+
+duplicate_index = DuplicateIndex()
+
+def sync_duplicate_index_periodically():
+    """Background loop that keeps the duplicate index in step with the sheets"""
+    while True:
+        time.sleep(DUPLICATE_INDEX_SYNC_INTERVAL)
+        if shared_queue.role == "follower":
+            # Sheets quota is per project; only the leader reads the sheets
+            continue
+        try:
+            duplicate_index.sync_all()
+        except Exception as e:
+            logger.exception(f"Error in duplicate index sync: {e}")
+
+# Worksheet column layout for each registration type
+SHEET_HEADERS = {
+    "internal": ["Name", "Registration Number", "Division", "Year of Study", "Email", "Phone Number", "recipt_no", "Timestamp"],
+    "external": ["Name", "Registration Number", "Department", "Year of Study", "College Name", "Email", "Phone Number", "recipt_no", "Timestamp"]
+}
+
+def ensure_headers(worksheet, sheet_type: str):
+    """Check if headers exist, if not create them (once per cached worksheet)"""
+    if worksheet_cache.headers_verified(sheet_type):
+        return
+    try:
+        headers = sheets_read(worksheet.row_values, 1)
+        if not headers or len(headers) == 0:
+            sheets_write(worksheet.append_row, SHEET_HEADERS[sheet_type])
+            logger.info(f"Created headers for {sheet_type} sheet")
+        worksheet_cache.mark_headers_verified(sheet_type)
+    except Exception as e:
+        logger.error(f"Error checking headers: {e}")
+        handle_sheets_error(e, sheet_type)
+
+def build_row(data: dict, sheet_type: str, timestamp: str) -> list:
+    """Prepare the worksheet row for a registration"""
+    if sheet_type == "internal":
+        return [
+            data['name'],
+            data['reg_no'],
+            data['division'],
+            data['year_of_study'],
+            data['email'],
+            data['phone_number'],
+            data['recipt_no'],
+            timestamp
+        ]
+    # external
+    return [
+        data['name'],
+        data['reg_no'],
+        data['dept_name'],
+        data['year_of_study'],
+        data['college_name'],
+        data['email'],
+        data['phone_number'],
+        data['recipt_no'],
+        timestamp
+    ]
+
+def duplicate_result(data: dict) -> dict:
+    """Result returned for a registration that already exists"""
+    return {
+        "error": "Duplicate registration",
+        "message": f"Registration with reg_no {data['reg_no']} and recipt_no {data['recipt_no']} already exists"
+    }
+
+def render_registration_email(data: dict, sheet_type: str) -> tuple:
+    """Return the (subject, html_content, text_content) of a registration's confirmation email"""
+    template = EMAIL_TEMPLATES[sheet_type]
+    with metrics.timer("registration_stage_duration_seconds", stage="template_render"):
+        return template.subject, template.render_html(data), template.render_text(data)
+
+def send_registration_email(data: dict, sheet_type: str) -> dict:
+    """Send confirmation email after successful registration"""
+    log_registration_id.set(registration_results.registration_id_for(sheet_type, data))
+    email_result = {"success": False, "message": "Email not sent"}
+    try:
+        subject, html_content, text_content = render_registration_email(data, sheet_type)
+        email_result = send_confirmation_email(
+            to_email=data['email'],
+            subject=subject,
+            html_content=html_content,
+            student_name=data['name'],
+            text_content=text_content
+        )
+    except Exception as email_error:
+        logger.warning("Email sending failed but registration successful",
+                       extra={"to_email": data.get('email'), "error": str(email_error)})
+    return email_result
+
+def mirrored_result(data: dict, sheet_type: str, timestamp: str, already_mirrored: bool = False) -> dict:
+    """Result of a stored registration that is now in its worksheet"""
+    return {
+        "success": True,
+        "message": f"{sheet_type.capitalize()} registration saved successfully",
+        "already_mirrored": already_mirrored,
+        "email_sent": False,
+        "email_status": "queued",
+        "data": {
+            **data,
+            "timestamp": timestamp,
+            "sheet_type": sheet_type
+        }
+    }
+
+def save_batch_to_google_sheet(batch: list, sheet_type: str) -> list:
+    """
+    Save several registrations of one type with a single append_rows call
+    sheet_type: 'internal' or 'external'
+    Returns one result dict per registration, in order
+    """
+    try:
+        if sheet_type not in ("internal", "external"):
+            return [{"error": "Invalid sheet_type"} for _ in batch]
+        
+        with metrics.timer("registration_stage_duration_seconds", stage="auth"):
+            client = get_google_credentials()
+        if not client:
+            return [{"error": "Failed to authenticate with Google Sheets", "retryable": True} for _ in batch]
+        
+        with metrics.timer("registration_stage_duration_seconds", stage="worksheet_open"):
+            worksheet = open_worksheet(client, sheet_type)
+        if worksheet is None:
+            return [{"error": f"Failed to open {sheet_type} worksheet"} for _ in batch]
+        
+        # Get current timestamp
+        timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        
+        ensure_headers(worksheet, sheet_type)
+        
+        if duplicate_index.is_stale(sheet_type):
+            # An earlier append failed ambiguously; see which rows reached the sheet before appending again
+            duplicate_index.load(sheet_type, worksheet)
+        
+        # Every row here was already accepted and stored. A row whose key is
+        # already in the sheet was either appended by an earlier attempt (e.g.
+        # the process stopped before marking it synced), or is a duplicate the
+        # request-time check could not see, such as a row that was in the sheet
+        # before the store existed or while the duplicate index was loading
+        results = [None] * len(batch)
+        rows = []
+        accepted = []
+        found = []
+        seen = set()
+        with metrics.timer("registration_stage_duration_seconds", stage="duplicate_check"):
+            for position, data in enumerate(batch):
+                key = registration_key(data['reg_no'], data['recipt_no'])
+                if key in seen:
+                    # The same stored row queued twice; it is appended once
+                    results[position] = mirrored_result(data, sheet_type, timestamp, already_mirrored=True)
+                    continue
+                seen.add(key)
+                if duplicate_index.contains(sheet_type, data['reg_no'], data['recipt_no'], worksheet):
+                    found.append(position)
+                    continue
+                rows.append(build_row(data, sheet_type, timestamp))
+                accepted.append(position)
+            if found:
+                attempted = registration_store.attempted(sheet_type, [batch[position] for position in found])
+                for position in found:
+                    data = batch[position]
+                    if registration_key(data['reg_no'], data['recipt_no']) in attempted:
+                        results[position] = mirrored_result(data, sheet_type, timestamp, already_mirrored=True)
+                    else:
+                        results[position] = duplicate_result(data)
+        
+        if not rows:
+            return results
+        
+        # Record the attempt before appending, so the rows are recognised if the outcome is lost
+        try:
+            registration_store.mark_attempted(sheet_type, [batch[position] for position in accepted])
+        except Exception as e:
+            logger.warning(f"Could not record the {sheet_type} append attempt, holding the batch back: {e}")
+            for position in accepted:
+                results[position] = {"error": f"Failed to save registration: {e}", "retryable": True}
+            return results
+        
+        # Append all new rows in one request
+        try:
+            with metrics.timer("registration_stage_duration_seconds", stage="append_rows"):
+                sheets_write(worksheet.append_rows, rows)
+        except Exception as e:
+            if is_ambiguous_write_error(e):
+                duplicate_index.mark_stale(sheet_type)
+            raise
+        logger.info("Saved registrations to Google Sheets", extra={"sheet_type": sheet_type, "count": len(rows)})
+        
+        for position in accepted:
+            data = batch[position]
+            duplicate_index.add(sheet_type, data['reg_no'], data['recipt_no'])
+            results[position] = mirrored_result(data, sheet_type, timestamp)
+        
+        return results
+    
+    except Exception as e:
+        logger.exception("Error saving to Google Sheets", extra={"sheet_type": sheet_type, "count": len(batch)})
+        handle_sheets_error(e, sheet_type)
+        retryable = is_transient_error(e) or is_auth_error(e)
+        return [{"error": f"Failed to save registration: {str(e)}", "retryable": retryable} for _ in batch]
+
+class DuplicateRegistrationError(Exception):
+    """Raised when a (reg_no, recipt_no) pair is already stored for a sheet type"""
+
+class RegistrationStore:
+    """
+    Local SQLite system of record for registrations.
+    Accepting a registration is a local transaction; rows are then mirrored
+    to Google Sheets by the worker pool and marked synced, with a per-sheet
+    watermark of the highest contiguously synced row. All writes go through
+    one writer thread that group-commits everything submitted within
+    STORE_COMMIT_INTERVAL in a single transaction, so concurrent requests
+    share the fsync.
+    """
+    
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS registrations (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            registration_id TEXT NOT NULL UNIQUE,
+            sheet_type TEXT NOT NULL,
+            reg_no TEXT NOT NULL,
+            recipt_no TEXT NOT NULL,
+            email TEXT NOT NULL,
+            data TEXT NOT NULL,
+            created_at TEXT NOT NULL,
+            attempted_at TEXT,
+            synced_at TEXT,
+            sync_status TEXT
+        );
+        CREATE UNIQUE INDEX IF NOT EXISTS idx_registrations_key ON registrations (sheet_type, reg_no, recipt_no);
+        CREATE INDEX IF NOT EXISTS idx_registrations_reg_no ON registrations (reg_no);
+        CREATE INDEX IF NOT EXISTS idx_registrations_recipt_no ON registrations (recipt_no);
+        CREATE INDEX IF NOT EXISTS idx_registrations_email ON registrations (email);
+        CREATE INDEX IF NOT EXISTS idx_registrations_unsynced ON registrations (sheet_type, id) WHERE synced_at IS NULL;
+        CREATE TABLE IF NOT EXISTS email_outbox (
+            reg_no TEXT NOT NULL,
+            recipt_no TEXT NOT NULL,
+            sheet_type TEXT NOT NULL,
+            email TEXT NOT NULL,
+            data TEXT NOT NULL,
+            status TEXT NOT NULL,
+            attempts INTEGER NOT NULL DEFAULT 0,
+            next_attempt_at REAL,
+            last_error TEXT,
+            created_at TEXT NOT NULL,
+            updated_at TEXT NOT NULL,
+            sent_at TEXT,
+            PRIMARY KEY (sheet_type, reg_no, recipt_no)
+        );
+        CREATE INDEX IF NOT EXISTS idx_email_outbox_status ON email_outbox (status, next_attempt_at);
+        CREATE TABLE IF NOT EXISTS sync_state (
+            sheet_type TEXT PRIMARY KEY,
+            watermark INTEGER NOT NULL DEFAULT 0,
+            updated_at TEXT
+        );
+    """
+    
+    def __init__(self, path: str = REGISTRATION_DB_PATH, commit_interval: float = STORE_COMMIT_INTERVAL):
+        self.path = path
+        self.commit_interval = commit_interval
+        self._lock = threading.Lock()
+        self._cond = threading.Condition(self._lock)
+        self._ops = []
+        self._conn = None
+        self._writer = None
+        self._closed = False
+        self.transactions = 0
+        self.rows_inserted = 0
+        self.rows_synced = 0
+    
+    def open(self) -> list:
+        """
+        Open (or create) the database and start the writer thread.
+        Returns the rows that still have to be mirrored to Google Sheets.
+        """
+        with self._lock:
+            if self._conn is not None:
+                return []
+            conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=FULL")
+            self._migrate(conn)
+            conn.executescript(self.SCHEMA)
+            self._conn = conn
+            self._closed = False
+        
+        self._writer = threading.Thread(target=self._writer_loop, name="store-writer", daemon=True)
+        self._writer.start()
+        
+        unsynced = self.unsynced()
+        logger.info(f"Registration store opened at {self.path} ({len(unsynced)} row(s) awaiting sync)")
+        return unsynced
+    
+    def _migrate(self, conn):
+        """Bring a database created by an earlier version up to SCHEMA"""
+        columns = [row[1] for row in conn.execute("PRAGMA table_info(registrations)")]
+        for column in ("attempted_at", "sync_status"):
+            if columns and column not in columns:
+                conn.execute(f"ALTER TABLE registrations ADD COLUMN {column} TEXT")
+        outbox_key = [row[1] for row in conn.execute("PRAGMA table_info(email_outbox)") if row[5]]
+        if outbox_key and "sheet_type" not in outbox_key:
+            # The outbox used to be keyed by (reg_no, recipt_no) alone, colliding across worksheets
+            columns = ("reg_no, recipt_no, sheet_type, email, data, status, attempts, next_attempt_at, "
+                       "last_error, created_at, updated_at, sent_at")
+            conn.executescript(
+                "BEGIN IMMEDIATE;"
+                "ALTER TABLE email_outbox RENAME TO email_outbox_old;"
+                "DROP INDEX IF EXISTS idx_email_outbox_status;"
+                f"{self.SCHEMA};"
+                f"INSERT INTO email_outbox ({columns}) SELECT {columns} FROM email_outbox_old;"
+                "DROP TABLE email_outbox_old;"
+                "COMMIT;"
+            )
+            logger.info("Migrated the email outbox to per-worksheet keys")
+    
+    def _submit(self, kind: str, *args) -> concurrent.futures.Future:
+        future = concurrent.futures.Future()
+        with self._lock:
+            if self._conn is None or self._closed:
+                future.set_exception(RuntimeError("Registration store is not open"))
+                return future
+            self._ops.append((kind, args, future))
+            self._cond.notify_all()
+        return future
+    
+    def insert(self, registration_id: str, sheet_type: str, data: dict):
+        """Commit a registration; blocks until durable, raises DuplicateRegistrationError"""
+        self._submit("insert", registration_id, sheet_type, data).result()
+    
+    def insert_many(self, rows: list) -> list:
+        """
+        Submit (registration_id, sheet_type, data) rows so they land in the
+        same group commit; returns one future per row, which raises
+        DuplicateRegistrationError for a duplicate
+        """
+        futures = [concurrent.futures.Future() for _ in rows]
+        with self._lock:
+            if self._conn is None or self._closed:
+                for future in futures:
+                    future.set_exception(RuntimeError("Registration store is not open"))
+                return futures
+            self._ops.extend(("insert", row, future) for row, future in zip(rows, futures))
+            self._cond.notify_all()
+        return futures
+    
+    def mark_synced(self, registration_ids: list, then=None, status: str = "synced") -> concurrent.futures.Future:
+        """
+        Record that rows no longer need mirroring (not waited on): they reached
+        their worksheet, or status says why not ('duplicate', 'failed').
+        then(connection), if given, runs in the same transaction and its
+        result is the future's
+        """
+        return self._submit("synced", list(registration_ids), then, status)
+    
+    def mark_attempted(self, sheet_type: str, entries: list):
+        """
+        Durably record that rows are about to be appended to their worksheet,
+        so a row later found there is known to be this one and not a
+        registration that was in the sheet already
+        """
+        def mark(conn):
+            conn.executemany(
+                "UPDATE registrations SET attempted_at = ? "
+                "WHERE sheet_type = ? AND reg_no = ? AND recipt_no = ? AND attempted_at IS NULL",
+                [(datetime.now().strftime("%Y-%m-%d %H:%M:%S"), sheet_type,
+                  *registration_key(data['reg_no'], data['recipt_no'])) for data in entries]
+            )
+        
+        self.execute(mark).result()
+    
+    def attempted(self, sheet_type: str, entries: list) -> set:
+        """Keys of the given rows whose append to the worksheet was attempted before"""
+        keys = {registration_key(data['reg_no'], data['recipt_no']) for data in entries}
+        reg_nos = sorted({reg_no for reg_no, _ in keys})
+        found = set()
+        for start in range(0, len(reg_nos), 500):
+            chunk = reg_nos[start:start + 500]
+            rows = self._read(
+                "SELECT reg_no, recipt_no FROM registrations WHERE sheet_type = ? AND attempted_at IS NOT NULL "
+                f"AND reg_no IN ({','.join('?' * len(chunk))})",
+                (sheet_type, *chunk)
+            )
+            found.update(key for key in rows if key in keys)
+        return found
+    
+    def execute(self, func) -> concurrent.futures.Future:
+        """Run func(connection) inside the next group-commit transaction"""
+        return self._submit("call", func)
+    
+    def _writer_loop(self):
+        """Apply every submitted write in one transaction per group"""
+        while True:
+            with self._lock:
+                while not self._ops and not self._closed:
+                    self._cond.wait()
+                if not self._ops and self._closed:
+                    return
+            
+            # Let concurrent writers join this transaction
+            time.sleep(self.commit_interval)
+            
+            with self._lock:
+                ops, self._ops = self._ops, []
+            self._apply(ops)
+    
+    def _apply(self, ops: list):
+        outcomes = []
+        synced_sheets = set()
+        inserted = 0
+        synced = 0
+        conn = self._conn
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            for kind, args, future in ops:
+                if kind == "insert":
+                    registration_id, sheet_type, data = args
+                    try:
+                        conn.execute(
+                            "INSERT INTO registrations (registration_id, sheet_type, reg_no, recipt_no, email, data, created_at) "
+                            "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                            (registration_id, sheet_type, *registration_key(data['reg_no'], data['recipt_no']),
+                             data['email'], json.dumps(data), datetime.now().strftime("%Y-%m-%d %H:%M:%S"))
+                        )
+                        outcomes.append((future, None, True))
+                        inserted += 1
+                    except sqlite3.IntegrityError:
+                        outcomes.append((future, DuplicateRegistrationError(data['reg_no'], data['recipt_no']), None))
+                elif kind == "call":
+                    # Arbitrary statements from other components sharing this transaction
+                    outcomes.append((future, None, args[0](conn)))
+                else:
+                    registration_ids, then, status = args
+                    synced_at = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+                    conn.executemany(
+                        "UPDATE registrations SET synced_at = ?, sync_status = ? "
+                        "WHERE registration_id = ? AND synced_at IS NULL",
+                        [(synced_at, status, registration_id) for registration_id in registration_ids]
+                    )
+                    synced += len(registration_ids)
+                    for registration_id in registration_ids:
+                        row = conn.execute(
+                            "SELECT sheet_type FROM registrations WHERE registration_id = ?", (registration_id,)
+                        ).fetchone()
+                        if row:
+                            synced_sheets.add(row[0])
+                    outcomes.append((future, None, then(conn) if then else True))
+            
+            for sheet_type in synced_sheets:
+                self._advance_watermark(sheet_type)
+            conn.execute("COMMIT")
+        except Exception as e:
+            logger.exception(f"Error committing to registration store: {e}")
+            try:
+                conn.execute("ROLLBACK")
+            except Exception:
+                pass
+            for _, _, future in ops:
+                future.set_exception(e)
+            return
+        
+        self.transactions += 1
+        for future, error, value in outcomes:
+            if error is None:
+                future.set_result(value)
+            else:
+                future.set_exception(error)
+        self.rows_inserted += inserted
+        self.rows_synced += synced
+    
+    def _advance_watermark(self, sheet_type: str):
+        """Move the watermark to just below the oldest unsynced row"""
+        conn = self._conn
+        oldest_unsynced = conn.execute(
+            "SELECT MIN(id) FROM registrations WHERE sheet_type = ? AND synced_at IS NULL", (sheet_type,)
+        ).fetchone()[0]
+        if oldest_unsynced is None:
+            watermark = conn.execute(
+                "SELECT COALESCE(MAX(id), 0) FROM registrations WHERE sheet_type = ?", (sheet_type,)
+            ).fetchone()[0]
+        else:
+            watermark = oldest_unsynced - 1
+        conn.execute(
+            "INSERT INTO sync_state (sheet_type, watermark, updated_at) VALUES (?, ?, ?) "
+            "ON CONFLICT(sheet_type) DO UPDATE SET watermark = excluded.watermark, updated_at = excluded.updated_at",
+            (sheet_type, watermark, datetime.now().strftime("%Y-%m-%d %H:%M:%S"))
+        )
+    
+    def _read(self, sql: str, params=()) -> list:
+        """Run a read-only query on a short-lived connection"""
+        conn = sqlite3.connect(self.path)
+        try:
+            return conn.execute(sql, params).fetchall()
+        finally:
+            conn.close()
+    
+    def unsynced(self, after_id: int = 0) -> list:
+        """Rows not yet mirrored to Google Sheets, oldest first, optionally only those after a row id"""
+        rows = self._read(
+            "SELECT id, registration_id, sheet_type, data FROM registrations "
+            "WHERE synced_at IS NULL AND id > ? ORDER BY id",
+            (after_id,)
+        )
+        return [
+            {"id": row_id, "registration_id": registration_id, "sheet_type": sheet_type, "data": json.loads(data)}
+            for row_id, registration_id, sheet_type, data in rows
+        ]
+    
+    def sync_states(self, registration_ids: list) -> dict:
+        """
+        registration_id -> (synced_at, sync status, confirmation email outbox
+        status) for the given registrations
+        """
+        states = {}
+        for start in range(0, len(registration_ids), 500):
+            chunk = registration_ids[start:start + 500]
+            rows = self._read(
+                "SELECT r.registration_id, r.synced_at, r.sync_status, o.status FROM registrations r "
+                "LEFT JOIN email_outbox o "
+                "ON o.sheet_type = r.sheet_type AND o.reg_no = r.reg_no AND o.recipt_no = r.recipt_no "
+                f"WHERE r.registration_id IN ({','.join('?' * len(chunk))})",
+                tuple(chunk)
+            )
+            states.update((registration_id, tuple(state)) for registration_id, *state in rows)
+        return states
+    
+    def depth(self) -> tuple:
+        """(rows awaiting sync, highest row id) across every process sharing the database"""
+        return self._read(
+            "SELECT (SELECT COUNT(*) FROM registrations WHERE synced_at IS NULL), "
+            "(SELECT COALESCE(MAX(id), 0) FROM registrations)"
+        )[0]
+    
+    def keys(self) -> list:
+        """Every stored (sheet_type, reg_no, recipt_no) key"""
+        return self._read("SELECT sheet_type, reg_no, recipt_no FROM registrations")
+    
+    def lookup(self, registration_id: str):
+        """Sheet type and sync state of one registration, or None if unknown"""
+        rows = self._read(
+            "SELECT sheet_type, created_at, synced_at, sync_status FROM registrations WHERE registration_id = ?",
+            (registration_id,)
+        )
+        if not rows:
+            return None
+        sheet_type, created_at, synced_at, sync_status = rows[0]
+        return {"sheet_type": sheet_type, "created_at": created_at, "synced_at": synced_at,
+                "sync_status": sync_status}
+    
+    def close(self):
+        """Commit anything pending and stop the writer"""
+        with self._lock:
+            if self._conn is None:
+                return
+            self._closed = True
+            self._cond.notify_all()
+        if self._writer is not None:
+            self._writer.join(timeout=5)
+        with self._lock:
+            self._conn.close()
+            self._conn = None
+    
+    def stats(self) -> dict:
+        if self._conn is None:
+            return {"path": self.path, "open": False}
+        counts = self._read(
+            "SELECT sheet_type, COUNT(*), SUM(synced_at IS NULL) FROM registrations GROUP BY sheet_type"
+        )
+        watermarks = dict(self._read("SELECT sheet_type, watermark FROM sync_state"))
+        return {
+            "path": self.path,
+            "open": True,
+            "transactions": self.transactions,
+            "rows_inserted": self.rows_inserted,
+            "rows_synced": self.rows_synced,
+            "sheets": {
+                sheet_type: {
+                    "rows": total,
+                    "unsynced": unsynced or 0,
+                    "watermark": watermarks.get(sheet_type, 0)
+                }
+                for sheet_type, total, unsynced in counts
+            }
+        }
+
+registration_store = RegistrationStore()
+
+class RegistrationKeys:
+    """
+    In-process set of (reg_no, recipt_no) keys per sheet type: every key
+    committed to the local store, plus keys reserved by requests that are
+    being committed right now. The endpoints consult it on the event loop to
+    reject duplicates with 409 before using an executor thread, a store
+    transaction or a queue slot; reserve() is the atomic check-and-claim
+    that closes the race between concurrent submissions.
+    """
+    
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._known = {"internal": set(), "external": set()}
+        self._in_flight = {"internal": set(), "external": set()}
+        self.rejected = 0
+    
+    def load(self, rows: list) -> int:
+        """Add (sheet_type, reg_no, recipt_no) rows from the store"""
+        with self._lock:
+            for sheet_type, reg_no, recipt_no in rows:
+                self._known.setdefault(sheet_type, set()).add(registration_key(reg_no, recipt_no))
+        return len(rows)
+    
+    def contains(self, sheet_type: str, data: dict) -> bool:
+        """O(1): whether the key is stored or being stored"""
+        key = registration_key(data['reg_no'], data['recipt_no'])
+        with self._lock:
+            found = key in self._known.get(sheet_type, ()) or key in self._in_flight.get(sheet_type, ())
+            if found:
+                self.rejected += 1
+            return found
+    
+    def reserve(self, sheet_type: str, data: dict) -> bool:
+        """Claim a key before committing it; False if it is already known or in flight"""
+        key = registration_key(data['reg_no'], data['recipt_no'])
+        with self._lock:
+            in_flight = self._in_flight.setdefault(sheet_type, set())
+            if key in self._known.get(sheet_type, ()) or key in in_flight:
+                self.rejected += 1
+                return False
+            in_flight.add(key)
+            return True
+    
+    def confirm(self, sheet_type: str, data: dict):
+        """The key is now in the store"""
+        key = registration_key(data['reg_no'], data['recipt_no'])
+        with self._lock:
+            self._in_flight.get(sheet_type, set()).discard(key)
+            self._known.setdefault(sheet_type, set()).add(key)
+    
+    def release(self, sheet_type: str, data: dict):
+        """Drop a reservation whose commit failed"""
+        key = registration_key(data['reg_no'], data['recipt_no'])
+        with self._lock:
+            self._in_flight.get(sheet_type, set()).discard(key)
+    
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "known": {sheet_type: len(keys) for sheet_type, keys in self._known.items()},
+                "in_flight": sum(len(keys) for keys in self._in_flight.values()),
+                "rejected": self.rejected
+            }
+
+registration_keys = RegistrationKeys()
+
+class RegistrationResults:
+    """
+    Bounded in-memory record of what happened to each queued registration,
+    keyed by registration ID. Entries expire RESULT_STORE_TTL seconds after
+    their last update and the least recently used entry is evicted once
+    RESULT_STORE_MAX_ENTRIES is reached.
+    Every stage change (queued, writing, synced / duplicate / failed, then
+    email_sent / email_retrying / email_failed) is published to long-poll
+    waiters and SSE subscribers. Worker threads only hand an update to the
+    event loop (one call_soon_threadsafe) when someone is listening for that
+    registration, and idle subscribers cost one asyncio queue each plus a
+    shared keepalive tick.
+    """
+    
+    FINAL_STATUSES = ("synced", "duplicate", "failed")
+    # Outbox status -> (event, email_status)
+    EMAIL_EVENTS = {
+        "sent": ("email_sent", "sent"),
+        "pending": ("email_retrying", "retrying"),
+        "dead": ("email_failed", "failed")
+    }
+    
+    def __init__(self, max_entries: int = RESULT_STORE_MAX_ENTRIES, ttl: float = RESULT_STORE_TTL):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._entries = collections.OrderedDict()
+        self._keys = {}
+        self._waiters = {}
+        self._subscribers = {}
+        self._loop = None
+        self._heartbeat = None
+        self.evictions = 0
+        self.expirations = 0
+        self.events_published = 0
+    
+    @staticmethod
+    def status_of(result: dict) -> str:
+        """Map a mirror result onto a tracking status"""
+        if result.get("success"):
+            return "synced"
+        if result.get("error") == "Duplicate registration":
+            return "duplicate"
+        return "failed"
+    
+    @classmethod
+    def is_closed(cls, entry: dict) -> bool:
+        """Whether no further events are expected for this registration"""
+        if entry["status"] == "synced":
+            return entry["email_status"] in ("sent", "failed")
+        return entry["status"] in cls.FINAL_STATUSES
+    
+    @staticmethod
+    def key_of(sheet_type: str, data: dict) -> tuple:
+        """Tracking key; the same (reg_no, recipt_no) on both worksheets is two registrations"""
+        return (sheet_type, *registration_key(data['reg_no'], data['recipt_no']))
+    
+    @staticmethod
+    def public(entry: dict) -> dict:
+        return {key: value for key, value in entry.items() if not key.startswith("_")}
+    
+    def _drop(self, registration_id: str):
+        entry = self._entries.pop(registration_id)
+        self._keys.pop(entry["_key"], None)
+    
+    def _expire(self, now: float):
+        # Least recently used entries are at the front; stop at the first live one
+        while self._entries:
+            registration_id, entry = next(iter(self._entries.items()))
+            if now - entry["_updated"] < self.ttl:
+                break
+            self._drop(registration_id)
+            self.expirations += 1
+    
+    def _publish(self, updates: list):
+        """
+        Apply (registration_id, sheet_type, key, event, fields) updates and
+        deliver them to anyone listening, in one hop to the event loop
+        """
+        now = time.monotonic()
+        updated_at = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        deliveries = []
+        with self._lock:
+            self._expire(now)
+            for registration_id, sheet_type, key, event, fields in updates:
+                entry = self._entries.get(registration_id)
+                if entry is None:
+                    entry = {"registration_id": registration_id, "sheet_type": sheet_type, "status": "queued",
+                             "result": None, "email_status": None, "_key": key}
+                    self._entries[registration_id] = entry
+                    self._keys[key] = registration_id
+                entry.update(fields)
+                entry["updated_at"] = updated_at
+                entry["_updated"] = now
+                self._entries.move_to_end(registration_id)
+                self.events_published += 1
+                
+                subscribers = self._subscribers.get(registration_id)
+                waiters = self._waiters.pop(registration_id, []) if entry["status"] in self.FINAL_STATUSES else []
+                if subscribers or waiters:
+                    deliveries.append((waiters, list(subscribers or ()), dict(self.public(entry), event=event)))
+            
+            while len(self._entries) > self.max_entries:
+                self._drop(next(iter(self._entries)))
+                self.evictions += 1
+        
+        if deliveries:
+            self._loop.call_soon_threadsafe(self._deliver, deliveries)
+    
+    @staticmethod
+    def _deliver(deliveries: list):
+        for waiters, subscribers, payload in deliveries:
+            for waiter in waiters:
+                if not waiter.done():
+                    waiter.set_result(None)
+            for subscriber in subscribers:
+                subscriber.put_nowait(payload)
+    
+    def track(self, registration_id: str, sheet_type: str, data: dict):
+        """Record a newly queued registration"""
+        self._publish([(registration_id, sheet_type, self.key_of(sheet_type, data), "queued", {"status": "queued"})])
+    
+    def mark_writing(self, items: list):
+        """Record that (registration_id, sheet_type, data) items are being written to their sheet"""
+        self._publish([
+            (registration_id, sheet_type, self.key_of(sheet_type, data), "writing", {"status": "writing"})
+            for registration_id, sheet_type, data in items
+        ])
+    
+    def record(self, registration_id: str, sheet_type: str, data: dict, result: dict):
+        """Record the mirror result of a registration"""
+        status = self.status_of(result)
+        fields = {"status": status, "result": result}
+        if status == "synced":
+            fields["email_status"] = "queued"
+        self._publish([(registration_id, sheet_type, self.key_of(sheet_type, data), status, fields)])
+    
+    def record_email(self, sheet_type: str, data: dict, outbox_status: str):
+        """Record a confirmation email outcome ('sent', 'pending' or 'dead' in the outbox)"""
+        key = self.key_of(sheet_type, data)
+        with self._lock:
+            registration_id = self._keys.get(key)
+            entry = self._entries.get(registration_id) if registration_id else None
+            if entry is None:
+                return
+        event, email_status = self.EMAIL_EVENTS[outbox_status]
+        self._publish([(registration_id, sheet_type, key, event, {"email_status": email_status})])
+    
+    def watched(self) -> list:
+        """IDs of unfinished registrations that a long-poll or SSE client is waiting on"""
+        with self._lock:
+            return [
+                registration_id for registration_id in set(self._subscribers) | set(self._waiters)
+                if registration_id in self._entries and not self.is_closed(self._entries[registration_id])
+            ]
+    
+    def apply_store_states(self, states: dict):
+        """
+        Publish progress made by another process, as read from the shared
+        store: registration_id -> (synced_at, sync status, email outbox status)
+        """
+        updates = []
+        with self._lock:
+            for registration_id, (synced_at, sync_status, outbox_status) in states.items():
+                entry = self._entries.get(registration_id)
+                if entry is None or not synced_at:
+                    continue
+                registration = (registration_id, entry["sheet_type"], entry["_key"])
+                if sync_status not in (None, "synced"):
+                    if entry["status"] not in self.FINAL_STATUSES:
+                        updates.append((*registration, sync_status, {"status": sync_status}))
+                    continue
+                if entry["status"] not in self.FINAL_STATUSES:
+                    updates.append((*registration, "synced", {"status": "synced", "email_status": "queued"}))
+                event, email_status = self.EMAIL_EVENTS.get(outbox_status, (None, None))
+                if event and entry["email_status"] != email_status:
+                    updates.append((*registration, event, {"email_status": email_status}))
+        if updates:
+            self._publish(updates)
+    
+    def registration_id_for(self, sheet_type: str, data: dict):
+        """Registration ID of a tracked (reg_no, recipt_no) on a worksheet, or None"""
+        with self._lock:
+            return self._keys.get(self.key_of(sheet_type, data))
+    
+    def callback(self, registration_id: str, sheet_type: str, data: dict):
+        """Result callback for save_to_google_sheet that records into this store"""
+        return lambda result: self.record(registration_id, sheet_type, data, result)
+    
+    def get(self, registration_id: str):
+        """Return a copy of the entry (refreshing its LRU position) or None"""
+        now = time.monotonic()
+        with self._lock:
+            self._expire(now)
+            entry = self._entries.get(registration_id)
+            if entry is None:
+                return None
+            if now - entry["_updated"] >= self.ttl:
+                self._drop(registration_id)
+                self.expirations += 1
+                return None
+            self._entries.move_to_end(registration_id)
+            return self.public(entry)
+    
+    async def wait(self, registration_id: str, timeout: float):
+        """
+        Return the entry once it reaches a final status or timeout seconds
+        have passed, whichever comes first. Must run on the event loop.
+        """
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            self._loop = loop
+            entry = self._entries.get(registration_id)
+            if entry is None or entry["status"] in self.FINAL_STATUSES or timeout <= 0:
+                waiter = None
+            else:
+                waiter = loop.create_future()
+                self._waiters.setdefault(registration_id, []).append(waiter)
+        
+        if waiter is not None:
+            try:
+                await asyncio.wait_for(waiter, timeout)
+            except asyncio.TimeoutError:
+                with self._lock:
+                    pending = self._waiters.get(registration_id, [])
+                    if waiter in pending:
+                        pending.remove(waiter)
+                    if not pending:
+                        self._waiters.pop(registration_id, None)
+        return self.get(registration_id)
+    
+    def subscribe(self, registration_id: str):
+        """
+        Register an SSE subscriber; returns (queue, current entry or None).
+        The queue receives event payloads, and None as a keepalive tick.
+        Must run on the event loop.
+        """
+        loop = asyncio.get_running_loop()
+        subscriber = asyncio.Queue()
+        with self._lock:
+            self._loop = loop
+            self._subscribers.setdefault(registration_id, []).append(subscriber)
+            entry = self._entries.get(registration_id)
+            snapshot = self.public(entry) if entry is not None else None
+        if self._heartbeat is None or self._heartbeat.done():
+            self._heartbeat = loop.create_task(self._keepalive())
+        return subscriber, snapshot
+    
+    def unsubscribe(self, registration_id: str, subscriber):
+        with self._lock:
+            subscribers = self._subscribers.get(registration_id, [])
+            if subscriber in subscribers:
+                subscribers.remove(subscriber)
+            if not subscribers:
+                self._subscribers.pop(registration_id, None)
+    
+    async def _keepalive(self):
+        """One shared tick for every open stream, so proxies keep idle connections open"""
+        while True:
+            await asyncio.sleep(SSE_KEEPALIVE_INTERVAL)
+            with self._lock:
+                if not self._subscribers:
+                    return
+                subscribers = [subscriber for group in self._subscribers.values() for subscriber in group]
+            for subscriber in subscribers:
+                subscriber.put_nowait(None)
+    
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "ttl_seconds": self.ttl,
+                "waiters": sum(len(waiters) for waiters in self._waiters.values()),
+                "subscribers": sum(len(subscribers) for subscribers in self._subscribers.values()),
+                "events_published": self.events_published,
+                "evictions": self.evictions,
+                "expirations": self.expirations
+            }
+
+registration_results = RegistrationResults()
+
+def save_registrations(records: list) -> list:
+    """
+    Commit (data, sheet_type, result_callback) records to the local store in
+    one group commit, then queue them for mirroring to Google Sheets
+    Returns one result per record, in order
+    """
+    results = [None] * len(records)
+    pending = []
+    for index, (data, sheet_type, result_callback) in enumerate(records):
+        if sheet_type not in ("internal", "external"):
+            results[index] = {"error": "Invalid sheet_type"}
+        elif (duplicate_index.contains(sheet_type, data['reg_no'], data['recipt_no'])
+              or not registration_keys.reserve(sheet_type, data)):
+            # Already in the sheet, the local store or being committed by another request
+            results[index] = duplicate_result(data)
+        else:
+            pending.append((index, uuid.uuid4().hex, data, sheet_type, result_callback))
+    
+    futures = registration_store.insert_many(
+        [(registration_id, sheet_type, data) for _, registration_id, data, sheet_type, _ in pending]
+    )
+    for (index, registration_id, data, sheet_type, result_callback), future in zip(pending, futures):
+        try:
+            future.result()
+        except DuplicateRegistrationError:
+            registration_keys.confirm(sheet_type, data)
+            results[index] = duplicate_result(data)
+            continue
+        except Exception:
+            for _, _, pending_data, pending_sheet_type, _ in pending:
+                registration_keys.release(pending_sheet_type, pending_data)
+            raise
+        registration_keys.confirm(sheet_type, data)
+        
+        registration_results.track(registration_id, sheet_type, data)
+        callback = registration_results.callback(registration_id, sheet_type, data)
+        if result_callback:
+            def callback(result, record_result=callback, result_callback=result_callback):
+                record_result(result)
+                result_callback(result)
+        
+        if not shared_queue.enabled:
+            # With a shared queue the leader process picks the row up from the store
+            queue_clock.enqueued(registration_id)
+            registration_queue.put((data, sheet_type, callback, registration_id))
+        results[index] = {
+            "success": True,
+            "message": f"{sheet_type.capitalize()} registration saved successfully",
+            "registration_id": registration_id,
+            "synced": False
+        }
+    return results
+
+def save_to_google_sheet(data: dict, sheet_type: str, result_callback=None):
+    """
+    Save registration data: commit it to the local store, then queue it
+    for mirroring to Google Sheets
+    sheet_type: 'internal' or 'external'
+    """
+    return save_registrations([(data, sheet_type, result_callback)])[0]
+
+def enqueue_stored_registration(row: dict):
+    """Queue a row read back from the store for mirroring to Google Sheets"""
+    registration_id, sheet_type, data = row['registration_id'], row['sheet_type'], row['data']
+    registration_results.track(registration_id, sheet_type, data)
+    queue_clock.enqueued(registration_id)
+    registration_queue.put((data, sheet_type,
+                            registration_results.callback(registration_id, sheet_type, data), registration_id))
+
+def retry_unsynced_periodically():
+    """
+    Background loop that queues stored rows again when a non-retryable
+    failure (e.g. a worksheet that could not be opened) left them unsynced.
+    Only rows that already existed at the previous pass and are not in
+    flight are queued, so newly accepted rows are never queued twice.
+    """
+    previous_last_id = None
+    while True:
+        time.sleep(UNSYNCED_RETRY_INTERVAL)
+        try:
+            if shared_queue.role == "follower" or shutting_down.is_set():
+                # Only the process that drains the queue retries
+                previous_last_id = None
+                continue
+            _, last_id = registration_store.depth()
+            if previous_last_id is not None:
+                stale = [row for row in registration_store.unsynced()
+                         if row['id'] <= previous_last_id and row['registration_id'] not in queue_clock]
+                for row in stale:
+                    enqueue_stored_registration(row)
+                if stale:
+                    logger.warning(f"Queued {len(stale)} unsynced registration(s) again after earlier failures")
+            previous_last_id = last_id
+        except Exception as e:
+            logger.exception(f"Error retrying unsynced registrations: {e}")
+
+def resume_unsynced_registrations() -> int:
+    """
+    Open the store and queue every row that never reached Google Sheets.
+    With a shared queue only the elected leader drains the store, so
+    nothing is queued here.
+    """
+    unsynced = registration_store.open()
+    registration_keys.load(registration_store.keys())
+    if shared_queue.start():
+        return 0
+    for row in unsynced:
+        enqueue_stored_registration(row)
+    if unsynced:
+        logger.info(f"Resumed mirroring of {len(unsynced)} unsynced registration(s)")
+    return len(unsynced)
+
+class EmailOutbox:
+    """
+    Durable outbox for confirmation emails, stored next to the registrations.
+    Each message is keyed by (sheet_type, reg_no, recipt_no) and claimed
+    before it is sent, so it goes out at most once. Failed sends are retried with
+    exponential backoff and moved to the dead-letter list after
+    EMAIL_MAX_ATTEMPTS. Permanent failures (SMTP not configured, a message
+    that cannot be encoded) are dead-lettered at once. Dead letters can be
+    re-driven in bulk.
+    """
+    
+    def __init__(self, store: RegistrationStore, max_attempts: int = EMAIL_MAX_ATTEMPTS):
+        self.store = store
+        self.max_attempts = max_attempts
+        self._poller = None
+        self._stopped = threading.Event()
+    
+    @staticmethod
+    def retry_delay(attempts: int) -> float:
+        return min(EMAIL_RETRY_BACKOFF_MAX, EMAIL_RETRY_BACKOFF_BASE * (2 ** max(attempts - 1, 0)))
+    
+    def add(self, entries: list, synced: list = ()) -> list:
+        """
+        Record (data, sheet_type) entries as being sent, in the same
+        transaction that marks the synced registration IDs as mirrored;
+        returns only the entries that were not already in the outbox. If the
+        store is unavailable nothing is recorded or sent: the rows stay
+        unsynced and are mirrored (and their emails recorded) again later.
+        """
+        def insert(conn):
+            now = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+            added = []
+            for data, sheet_type in entries:
+                cursor = conn.execute(
+                    "INSERT OR IGNORE INTO email_outbox "
+                    "(reg_no, recipt_no, sheet_type, email, data, status, attempts, created_at, updated_at) "
+                    "VALUES (?, ?, ?, ?, ?, 'sending', 0, ?, ?)",
+                    (*registration_key(data['reg_no'], data['recipt_no']), sheet_type, data['email'],
+                     json.dumps(data), now, now)
+                )
+                if cursor.rowcount == 1:
+                    added.append((data, sheet_type))
+            return added
+        
+        try:
+            return self.store.mark_synced(synced, insert).result()
+        except Exception as e:
+            logger.warning(f"Email outbox unavailable, leaving {len(entries)} email(s) for a later pass: {e}")
+            return []
+    
+    def record_result(self, data: dict, sheet_type: str, result: dict):
+        """Mark a message sent, or schedule its retry / dead-letter it (not waited on)"""
+        key = (sheet_type, *registration_key(data['reg_no'], data['recipt_no']))
+        success = bool(result.get('success'))
+        permanent = not success and bool(result.get('permanent'))
+        error = None if success else result.get('message', 'Unknown error')
+        metrics.inc("confirmation_emails_total", outcome="sent" if success else "failed")
+        
+        def update(conn):
+            now = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+            if success:
+                conn.execute(
+                    "UPDATE email_outbox SET status = 'sent', sent_at = ?, updated_at = ?, last_error = NULL "
+                    "WHERE sheet_type = ? AND reg_no = ? AND recipt_no = ?",
+                    (now, now, *key)
+                )
+                return 'sent'
+            row = conn.execute(
+                "SELECT attempts FROM email_outbox WHERE sheet_type = ? AND reg_no = ? AND recipt_no = ?", key
+            ).fetchone()
+            if row is None:
+                return None
+            attempts = row[0] + 1
+            # Retrying cannot fix a permanent failure, so it skips the backoff schedule
+            status = 'dead' if permanent or attempts >= self.max_attempts else 'pending'
+            conn.execute(
+                "UPDATE email_outbox SET status = ?, attempts = ?, next_attempt_at = ?, last_error = ?, updated_at = ? "
+                "WHERE sheet_type = ? AND reg_no = ? AND recipt_no = ?",
+                (status, attempts, time.time() + self.retry_delay(attempts), error, now, *key)
+            )
+            if status == 'dead':
+                logger.error("Confirmation email moved to the dead-letter list",
+                             extra={"to_email": data['email'], "attempts": attempts,
+                                    "registration_id": registration_results.registration_id_for(sheet_type, data)})
+            return status
+        
+        def publish(done):
+            if done.exception() is None and done.result():
+                registration_results.record_email(sheet_type, data, done.result())
+        
+        self.store.execute(update).add_done_callback(publish)
+    
+    def claim_due(self, limit: int = 100) -> list:
+        """Claim pending messages whose retry time has come; returns (data, sheet_type) entries"""
+        def claim(conn):
+            rows = conn.execute(
+                "SELECT reg_no, recipt_no, sheet_type, data FROM email_outbox "
+                "WHERE status = 'pending' AND COALESCE(next_attempt_at, 0) <= ? ORDER BY next_attempt_at LIMIT ?",
+                (time.time(), limit)
+            ).fetchall()
+            conn.executemany(
+                "UPDATE email_outbox SET status = 'sending', updated_at = ? "
+                "WHERE sheet_type = ? AND reg_no = ? AND recipt_no = ?",
+                [(datetime.now().strftime("%Y-%m-%d %H:%M:%S"), sheet_type, reg_no, recipt_no)
+                 for reg_no, recipt_no, sheet_type, _ in rows]
+            )
+            return [(json.loads(data), sheet_type) for _, _, sheet_type, data in rows]
+        
+        return self.store.execute(claim).result()
+    
+    def recover_interrupted(self) -> int:
+        """
+        Dead-letter messages that were mid-send when the process stopped;
+        they may already have been delivered, so they are not resent automatically
+        """
+        def recover(conn):
+            return conn.execute(
+                "UPDATE email_outbox SET status = 'dead', last_error = 'Interrupted while sending', updated_at = ? "
+                "WHERE status = 'sending'",
+                (datetime.now().strftime("%Y-%m-%d %H:%M:%S"),)
+            ).rowcount
+        
+        return self.store.execute(recover).result()
+    
+    def redrive_dead_letters(self) -> int:
+        """Move every dead letter back to pending with a fresh attempt budget"""
+        def redrive(conn):
+            return conn.execute(
+                "UPDATE email_outbox SET status = 'pending', attempts = 0, next_attempt_at = 0, updated_at = ? "
+                "WHERE status = 'dead'",
+                (datetime.now().strftime("%Y-%m-%d %H:%M:%S"),)
+            ).rowcount
+        
+        return self.store.execute(redrive).result()
+    
+    def dead_letters(self, limit: int = 100) -> list:
+        rows = self.store._read(
+            "SELECT reg_no, recipt_no, sheet_type, email, attempts, last_error, updated_at FROM email_outbox "
+            "WHERE status = 'dead' ORDER BY updated_at LIMIT ?",
+            (limit,)
+        )
+        return [
+            {
+                "reg_no": reg_no,
+                "recipt_no": recipt_no,
+                "sheet_type": sheet_type,
+                "email": email,
+                "attempts": attempts,
+                "last_error": last_error,
+                "updated_at": updated_at
+            }
+            for reg_no, recipt_no, sheet_type, email, attempts, last_error, updated_at in rows
+        ]
+    
+    def start(self):
+        """Recover interrupted sends and start the retry poller"""
+        interrupted = self.recover_interrupted()
+        if interrupted:
+            logger.warning(f"{interrupted} email(s) were interrupted mid-send and moved to the dead-letter list")
+        self._poller = threading.Thread(target=self._poll_loop, name="email-outbox-poller", daemon=True)
+        self._poller.start()
+    
+    def stop(self):
+        """Stop claiming due retries (used on shutdown)"""
+        self._stopped.set()
+    
+    def release(self, entries: list) -> int:
+        """
+        Return (data, sheet_type) messages that were queued but never sent
+        to pending, so the next start sends them
+        """
+        keys = [(sheet_type, *registration_key(data['reg_no'], data['recipt_no'])) for data, sheet_type in entries]
+        
+        def release(conn):
+            now = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+            return sum(
+                conn.execute(
+                    "UPDATE email_outbox SET status = 'pending', next_attempt_at = 0, updated_at = ? "
+                    "WHERE sheet_type = ? AND reg_no = ? AND recipt_no = ? AND status = 'sending'",
+                    (now, *key)
+                ).rowcount
+                for key in keys
+            )
+        
+        return self.store.execute(release).result()
+    
+    def _poll_loop(self):
+        while not self._stopped.wait(EMAIL_RETRY_POLL_INTERVAL):
+            try:
+                for data, sheet_type in self.claim_due():
+                    email_dispatcher.enqueue(data, sheet_type)
+            except Exception as e:
+                logger.exception(f"Error in email outbox poller: {e}")
+    
+    def stats(self) -> dict:
+        if self.store._conn is None:
+            return {"open": False}
+        counts = dict(self.store._read("SELECT status, COUNT(*) FROM email_outbox GROUP BY status"))
+        return {
+            "open": True,
+            "max_attempts": self.max_attempts,
+            **{status: counts.get(status, 0) for status in ("pending", "sending", "sent", "dead")}
+        }
+
+email_outbox = EmailOutbox(registration_store)
+
+class SharedQueue:
+    """
+    One registration queue shared by several uvicorn worker processes
+    (QUEUE_MODE=shared). The local store is the queue: every process commits
+    registrations to it, and only the process holding an exclusive lock on
+    QUEUE_LEADER_LOCK_PATH drains it, feeding rows it has not seen yet into
+    its worker pool, running the email outbox and making every Sheets read.
+    Followers relay sync and email progress from the store to their own
+    long-poll and SSE clients. The OS releases the lock
+    when the leader exits and followers keep trying to take it, so another
+    process resumes from the unsynced rows within a poll interval.
+    Duplicates across processes are caught by the store's unique index.
+    """
+    
+    def __init__(self, mode: str = QUEUE_MODE, lock_path: str = QUEUE_LEADER_LOCK_PATH,
+                 poll_interval: float = QUEUE_SHARED_POLL_INTERVAL):
+        self.enabled = mode == "shared"
+        self.lock_path = lock_path
+        self.poll_interval = poll_interval
+        self.is_leader = False
+        self.leader_since = None
+        self.backlog = 0
+        self.rows_claimed = 0
+        self._lock_file = None
+        self._last_id = 0
+        self._last_depth = None
+        self._thread = None
+        self._stopped = threading.Event()
+    
+    @property
+    def role(self) -> str:
+        if not self.enabled:
+            return "local"
+        return "leader" if self.is_leader else "follower"
+    
+    def start(self) -> bool:
+        """Start coordinating; returns False when the queue is process-local"""
+        if not self.enabled:
+            return False
+        if fcntl is None:
+            logger.warning("QUEUE_MODE=shared needs POSIX file locks; falling back to a process-local queue")
+            self.enabled = False
+            return False
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="shared-queue", daemon=True)
+            self._thread.start()
+        return True
+    
+    def _try_lock(self) -> bool:
+        lock_file = open(self.lock_path, "a+")
+        try:
+            fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            lock_file.close()
+            return False
+        lock_file.seek(0)
+        lock_file.truncate()
+        lock_file.write(str(os.getpid()))
+        lock_file.flush()
+        self._lock_file = lock_file
+        return True
+    
+    def leader_pid(self):
+        """PID written by the current (or last) leader, if any"""
+        try:
+            with open(self.lock_path) as lock_file:
+                return int(lock_file.read().strip() or 0) or None
+        except (OSError, ValueError):
+            return None
+    
+    def stop(self):
+        """Stop taking rows from the store; leadership is kept until release()"""
+        self._stopped.set()
+    
+    def release(self):
+        """Give up leadership so another process takes over the queue"""
+        if self._lock_file is not None:
+            self._lock_file.close()
+            self._lock_file = None
+            self.is_leader = False
+    
+    def _run(self):
+        while not self._stopped.is_set():
+            try:
+                if not self.is_leader and self._try_lock():
+                    self.is_leader = True
+                    self.leader_since = datetime.now()
+                    logger.info(f"Process {os.getpid()} is now the registration queue leader")
+                    email_outbox.start()
+                    warmup.start()
+                self._poll()
+            except Exception as e:
+                logger.exception(f"Error in shared queue coordinator: {e}")
+            self._stopped.wait(self.poll_interval)
+    
+    def _poll(self):
+        backlog, last_id = registration_store.depth()
+        if self.is_leader:
+            # Commits are serialised by SQLite, so row ids only grow
+            rows = registration_store.unsynced(self._last_id)
+            for row in rows:
+                enqueue_stored_registration(row)
+            if rows:
+                self._last_id = rows[-1]['id']
+                self.rows_claimed += len(rows)
+        else:
+            # Writes finish in the leader; pass what reached the store on to local clients
+            watched = registration_results.watched()
+            if watched:
+                registration_results.apply_store_states(registration_store.sync_states(watched))
+            if self._last_depth is not None:
+                # Followers infer the leader's drain rate for Retry-After from the shared backlog
+                previous_backlog, previous_last_id = self._last_depth
+                drained = previous_backlog + (last_id - previous_last_id) - backlog
+                if drained > 0:
+                    queue_admission.record_drained(drained)
+        self._last_depth = (backlog, last_id)
+        self.backlog = backlog
+    
+    def stats(self) -> dict:
+        if not self.enabled:
+            return {"mode": "local"}
+        return {
+            "mode": "shared",
+            "role": self.role,
+            "pid": os.getpid(),
+            "leader_pid": self.leader_pid(),
+            "leader_since": self.leader_since.strftime("%Y-%m-%d %H:%M:%S") if self.leader_since else None,
+            "backlog": self.backlog,
+            "rows_claimed": self.rows_claimed
+        }
+
+shared_queue = SharedQueue()
+
+def is_final_result(result: dict) -> bool:
+    """Whether a mirror result means the row no longer needs to be synced"""
+    return bool(result.get("success")) or result.get("error") in ("Duplicate registration", "Invalid sheet_type")
+
+def collect_registration_batch() -> list:
+    """
+    Block for the next registration, then keep draining the queue until the
+    batch is full or the flush window has passed
+    """
+    batch = [registration_queue.get()]
+    deadline = time.monotonic() + QUEUE_FLUSH_WINDOW
+    while len(batch) < QUEUE_BATCH_SIZE:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            break
+        try:
+            batch.append(registration_queue.get(timeout=remaining))
+        except queue.Empty:
+            break
+    return batch
+
+def process_registration_batch(batch: list) -> list:
+    """
+    Write a batch of queued registrations with one append per worksheet and
+    hand confirmation emails to the email dispatcher
+    Returns the items that hit a transient failure and should be retried
+    """
+    held_back = []
+    for sheet_type in ("internal", "external"):
+        items = [item for item in batch if item[1] == sheet_type]
+        if not items:
+            continue
+        
+        logger.info("Processing queued registrations", extra={
+            "sheet_type": sheet_type,
+            "count": len(items),
+            "registration_ids": [registration_id for _, _, _, registration_id in items]
+        })
+        registration_results.mark_writing(
+            [(registration_id, sheet_type, data) for data, _, _, registration_id in items]
+        )
+        for wait in queue_clock.started([registration_id for _, _, _, registration_id in items]):
+            metrics.observe("registration_stage_duration_seconds", wait, stage="enqueue_wait")
+        results = save_batch_to_google_sheet(
+            [data for data, _, _, _ in items], sheet_type
+        )
+        
+        synced = {}
+        emails = []
+        finished = []
+        for item, result in zip(items, results):
+            registration_data, _, result_callback, registration_id = item
+            if result.get("retryable"):
+                # Hold the registration back instead of failing it
+                held_back.append(item)
+                metrics.inc("registrations_processed_total", type=sheet_type, outcome="held_back")
+                continue
+            metrics.inc("registrations_processed_total", type=sheet_type, outcome=RegistrationResults.status_of(result))
+            finished.append(registration_id)
+            sheets_scheduler.clear_item(registration_id)
+            if is_final_result(result):
+                synced.setdefault(RegistrationResults.status_of(result), []).append(registration_id)
+            if result.get("success"):
+                emails.append((registration_data, sheet_type))
+            
+            # Call each registration's callback with its own result
+            if result_callback:
+                try:
+                    result_callback(result)
+                except Exception as e:
+                    logger.exception("Error in result callback", extra={"registration_id": registration_id})
+        
+        processing_stats.record(queue_clock.finished(finished))
+        
+        # Record confirmation emails in the outbox as the rows are marked synced,
+        # then hand new ones to the dispatcher
+        mirrored = synced.pop("synced", [])
+        if emails:
+            for data, email_sheet_type in email_outbox.add(emails, mirrored):
+                email_dispatcher.enqueue(data, email_sheet_type)
+        elif mirrored:
+            registration_store.mark_synced(mirrored)
+        for status, registration_ids in synced.items():
+            registration_store.mark_synced(registration_ids, status=status)
+    
+    for registration_data, sheet_type, result_callback, registration_id in batch:
+        if sheet_type not in ("internal", "external"):
+            registration_store.mark_synced([registration_id], status="failed")
+            queue_clock.finished([registration_id])
+            if result_callback:
+                result_callback({"error": "Invalid sheet_type"})
+    
+    return held_back
+
+class QueueAdmission:
+    """
+    Admission control for registration_queue. The backlog is the queue's
+    unfinished task count (queued, in a lane or being written), or the
+    store's unsynced row count as last polled when the queue is shared
+    between processes. The drain rate is an exponentially decaying count
+    of finished items (time constant DRAIN_RATE_WINDOW), so both admitting
+    a registration and computing its Retry-After are O(1). The capacity is a soft limit:
+    registrations already accepted (resumed or held back) are never refused.
+    """
+    
+    DRAIN_RATE_WINDOW = 30.0
+    
+    def __init__(self, capacity: int = QUEUE_CAPACITY):
+        self.capacity = capacity
+        self._lock = threading.Lock()
+        self._decayed = 0.0
+        self._last = time.monotonic()
+        self.rejected = 0
+    
+    def backlog(self) -> int:
+        if shared_queue.enabled:
+            return shared_queue.backlog
+        return registration_queue.unfinished_tasks
+    
+    def record_drained(self, count: int):
+        """Called by the workers for every registration that left the queue for good"""
+        now = time.monotonic()
+        with self._lock:
+            self._decayed = self._decayed * math.exp(-(now - self._last) / self.DRAIN_RATE_WINDOW) + count
+            self._last = now
+    
+    def drain_rate(self) -> float:
+        """Registrations drained per second, averaged over roughly the last DRAIN_RATE_WINDOW seconds"""
+        with self._lock:
+            decayed = self._decayed * math.exp(-(time.monotonic() - self._last) / self.DRAIN_RATE_WINDOW)
+        return decayed / self.DRAIN_RATE_WINDOW
+    
+    def check(self, count: int = 1):
+        """Return None if count more registrations fit, otherwise the Retry-After in seconds"""
+        if self.capacity <= 0:
+            return None
+        excess = self.backlog() + count - self.capacity
+        if excess <= 0:
+            return None
+        self.rejected += 1
+        rate = self.drain_rate()
+        if rate <= 0:
+            return QUEUE_RETRY_AFTER_MAX
+        return min(max(math.ceil(excess / rate), QUEUE_RETRY_AFTER_MIN), QUEUE_RETRY_AFTER_MAX)
+    
+    def stats(self) -> dict:
+        return {
+            "capacity": self.capacity,
+            "backlog": self.backlog(),
+            "drain_rate_per_second": round(self.drain_rate(), 3),
+            "rejected": self.rejected
+        }
+
+queue_admission = QueueAdmission()
+
+class QueueClock:
+    """
+    Enqueue time of every registration that has not finished yet, kept in
+    enqueue order so the oldest one is always first. Registrations that are
+    held back for a retry keep their original enqueue time.
+    """
+    
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._entries = collections.OrderedDict()
+    
+    def enqueued(self, registration_id: str):
+        with self._lock:
+            self._entries.setdefault(registration_id, [time.monotonic(), None])
+    
+    def started(self, registration_ids: list) -> list:
+        """Mark registrations as picked up; returns the queue wait of those seen for the first time"""
+        now = time.monotonic()
+        waits = []
+        with self._lock:
+            for registration_id in registration_ids:
+                entry = self._entries.get(registration_id)
+                if entry is not None and entry[1] is None:
+                    entry[1] = now
+                    waits.append(now - entry[0])
+        return waits
+    
+    def finished(self, registration_ids: list) -> list:
+        """Forget finished registrations; returns their time since enqueue"""
+        now = time.monotonic()
+        durations = []
+        with self._lock:
+            for registration_id in registration_ids:
+                entry = self._entries.pop(registration_id, None)
+                if entry is not None:
+                    durations.append(now - entry[0])
+        return durations
+    
+    def oldest_age(self) -> float:
+        with self._lock:
+            if not self._entries:
+                return 0.0
+            return time.monotonic() - next(iter(self._entries.values()))[0]
+    
+    def __len__(self) -> int:
+        return len(self._entries)
+    
+    def __contains__(self, registration_id: str) -> bool:
+        with self._lock:
+            return registration_id in self._entries
+
+queue_clock = QueueClock()
+
+class ProcessingStats:
+    """
+    Throughput and end-to-end latency of mirrored registrations, from
+    fixed-size ring buffers: one slot per second for the last 15 minutes of
+    completions and the last LATENCY_SAMPLES enqueue-to-sheet durations.
+    Recording is O(1); windows and percentiles are computed when read.
+    """
+    
+    WINDOW_SECONDS = 900
+    LATENCY_SAMPLES = 2048
+    
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counts = [0] * self.WINDOW_SECONDS
+        self._stamps = [-1] * self.WINDOW_SECONDS
+        self._latencies = [0.0] * self.LATENCY_SAMPLES
+        self._latency_count = 0
+        self._first_second = None
+    
+    def record(self, durations: list):
+        """Record finished registrations and their time since enqueue"""
+        if not durations:
+            return
+        second = int(time.monotonic())
+        slot = second % self.WINDOW_SECONDS
+        with self._lock:
+            if self._first_second is None:
+                self._first_second = second
+            if self._stamps[slot] != second:
+                self._stamps[slot] = second
+                self._counts[slot] = 0
+            self._counts[slot] += len(durations)
+            for duration in durations:
+                self._latencies[self._latency_count % self.LATENCY_SAMPLES] = duration
+                self._latency_count += 1
+    
+    def throughput(self, window: int) -> float:
+        """Registrations finished per second over the last window seconds (or since the first one)"""
+        now = int(time.monotonic())
+        with self._lock:
+            if self._first_second is None:
+                return 0.0
+            total = sum(count for count, stamp in zip(self._counts, self._stamps) if now - stamp < window)
+            window = min(window, now - self._first_second + 1)
+        return total / window
+    
+    def percentiles(self) -> dict:
+        with self._lock:
+            samples = sorted(self._latencies[:min(self._latency_count, self.LATENCY_SAMPLES)])
+        if not samples:
+            return {"samples": 0, "p50": None, "p95": None, "p99": None}
+        def percentile(fraction: float) -> float:
+            return round(samples[min(int(fraction * len(samples)), len(samples) - 1)], 3)
+        
+        return {"samples": len(samples), "p50": percentile(0.50), "p95": percentile(0.95), "p99": percentile(0.99)}
+
+processing_stats = ProcessingStats()
+
+# Set once shutdown begins; new registrations are refused from then on
+shutting_down = threading.Event()
+
+def shutting_down_error() -> HTTPException:
+    return HTTPException(
+        status_code=503,
+        detail={
+            "error": "Server is shutting down",
+            "message": f"Registrations are not being accepted right now, please retry in {QUEUE_RETRY_AFTER_MIN} seconds",
+            "retry_after": QUEUE_RETRY_AFTER_MIN
+        },
+        headers={"Retry-After": str(QUEUE_RETRY_AFTER_MIN)}
+    )
+
+def queue_full_error(retry_after: int) -> HTTPException:
+    return HTTPException(
+        status_code=429,
+        detail={
+            "error": "Registration queue is full",
+            "message": f"Too many registrations are waiting to be saved, please retry in {retry_after} seconds",
+            "retry_after": retry_after
+        },
+        headers={"Retry-After": str(retry_after)}
+    )
+
+class WorkerState:
+    """Utilization bookkeeping for one pool worker"""
+    
+    def __init__(self, name: str):
+        self.name = name
+        self.thread = None
+        self.started_at = time.monotonic()
+        self.busy_seconds = 0.0
+        self.tasks_completed = 0
+        self.current_task = None
+        self._task_started = None
+    
+    def begin(self, description: str):
+        self.current_task = description
+        self._task_started = time.monotonic()
+    
+    def end(self):
+        self.busy_seconds += time.monotonic() - self._task_started
+        self.tasks_completed += 1
+        self.current_task = None
+        self._task_started = None
+    
+    def stats(self) -> dict:
+        now = time.monotonic()
+        busy = self.busy_seconds
+        if self._task_started is not None:
+            busy += now - self._task_started
+        elapsed = max(now - self.started_at, 1e-9)
+        return {
+            "name": self.name,
+            "alive": self.thread is not None and self.thread.is_alive(),
+            "current_task": self.current_task,
+            "current_task_seconds": round(now - self._task_started, 3) if self._task_started is not None else None,
+            "tasks_completed": self.tasks_completed,
+            "busy_seconds": round(busy, 3),
+            "utilization": round(min(busy / elapsed, 1.0), 4)
+        }
+
+class RegistrationWorkerPool:
+    """
+    Sheets writers fed by a dispatcher that drains registration_queue.
+    Registrations are routed into one lane per worksheet, each written by
+    its own thread, so writes to the same worksheet stay ordered and
+    duplicate-safe while the worksheets are written in parallel.
+    Confirmation emails are sent by a separate stage (EmailDispatcher).
+    """
+    
+    def __init__(self, lanes: tuple = ("internal", "external")):
+        self.size = len(lanes)
+        self._lock = threading.Lock()
+        self._lanes = {lane_key: collections.deque() for lane_key in lanes}
+        self._ready = {lane_key: threading.Condition(self._lock) for lane_key in lanes}
+        self.workers = []
+        self.dispatcher = None
+    
+    def start(self):
+        """Start the dispatcher and one writer thread per lane"""
+        for lane_key in self._lanes:
+            state = WorkerState(f"{lane_key}-writer")
+            state.thread = threading.Thread(target=self._lane_loop, args=(lane_key, state), name=state.name,
+                                            daemon=True)
+            self.workers.append(state)
+            state.thread.start()
+        self.dispatcher = threading.Thread(target=self._dispatch_loop, name="queue-dispatcher", daemon=True)
+        self.dispatcher.start()
+        logger.info(f"Started registration queue processor with {self.size} sheet writer(s)")
+    
+    def is_alive(self) -> bool:
+        return (self.dispatcher is not None and self.dispatcher.is_alive()
+                and all(state.thread.is_alive() for state in self.workers))
+    
+    def _dispatch_loop(self):
+        """Move queued registrations into their worksheet lanes"""
+        while True:
+            batch = collect_registration_batch()
+            for item in batch:
+                self._route(item)
+    
+    def _route(self, item):
+        lane_key = item[1]
+        if lane_key not in self._lanes:
+            # No worksheet to write to: fail it right away
+            self._finish([item], process_registration_batch([item]))
+            return
+        with self._lock:
+            self._lanes[lane_key].append(item)
+            self._ready[lane_key].notify()
+    
+    @staticmethod
+    def _finish(batch: list, held_back: list):
+        """Mark every finished task in the batch as done"""
+        for _ in range(len(batch) - len(held_back)):
+            registration_queue.task_done()
+        queue_admission.record_drained(len(batch) - len(held_back))
+    
+    def _lane_loop(self, lane_key: str, state: WorkerState):
+        """Write a lane's registrations in order, one batch at a time"""
+        lane = self._lanes[lane_key]
+        while True:
+            with self._lock:
+                while not lane:
+                    self._ready[lane_key].wait()
+                batch = [lane.popleft() for _ in range(min(len(lane), QUEUE_BATCH_SIZE))]
+            state.begin(f"write {len(batch)} {lane_key} registration(s)")
+            held_back = []
+            try:
+                held_back = process_registration_batch(batch)
+            except Exception as e:
+                logger.exception(f"Error in {state.name}: {e}")
+            finally:
+                self._finish(batch, held_back)
+                state.end()
+            
+            if held_back:
+                # Put held-back registrations back at the front of the lane, in order,
+                # and pause the lane before trying again
+                attempt = max(sheets_scheduler.record_item_retry(item[3]) for item in held_back)
+                with self._lock:
+                    lane.extendleft(reversed(held_back))
+                delay = sheets_scheduler.back_off(attempt - 1)
+                logger.warning("Holding back registrations after a transient failure", extra={
+                    "sheet_type": lane_key,
+                    "delay_seconds": round(delay, 2),
+                    "registration_ids": [item[3] for item in held_back]
+                })
+                time.sleep(delay)
+    
+    def stats(self) -> dict:
+        with self._lock:
+            lanes = {lane_key: len(lane) for lane_key, lane in self._lanes.items()}
+        return {
+            "size": self.size,
+            "lanes": lanes,
+            "workers": [state.stats() for state in self.workers]
+        }
+
+class AsyncEmailSender:
+    """
+    asyncio-native confirmation email delivery on a dedicated event loop.
+    Up to EMAIL_ASYNC_CONCURRENCY SMTP sessions run concurrently under a
+    semaphore, connections are reused between messages, and each message is
+    bounded by EMAIL_SEND_TIMEOUT, so thousands of sends can be in flight
+    without a thread per send. Requires the optional aiosmtplib package.
+    """
+    
+    def __init__(self, concurrency: int = EMAIL_ASYNC_CONCURRENCY, timeout: float = EMAIL_SEND_TIMEOUT,
+                 max_messages: int = SMTP_MAX_MESSAGES_PER_CONNECTION):
+        self.concurrency = max(concurrency, 1)
+        self.timeout = timeout
+        self.max_messages = max_messages
+        self.loop = None
+        self._thread = None
+        self._semaphore = None
+        self._idle = []
+        self._lock = threading.Lock()
+        self._waiting = {}
+        self._deferring = False
+        self.sending = 0
+        self.connections_created = 0
+        self.timeouts = 0
+    
+    def start(self):
+        """Start the dedicated event loop thread"""
+        ready = threading.Event()
+        
+        def run():
+            self.loop = asyncio.new_event_loop()
+            asyncio.set_event_loop(self.loop)
+            self._semaphore = asyncio.Semaphore(self.concurrency)
+            ready.set()
+            self.loop.run_forever()
+        
+        self._thread = threading.Thread(target=run, name="email-async-loop", daemon=True)
+        self._thread.start()
+        ready.wait()
+    
+    def submit(self, data: dict, sheet_type: str) -> concurrent.futures.Future:
+        """Schedule a confirmation email from any thread"""
+        return asyncio.run_coroutine_threadsafe(self.send_registration_email(data, sheet_type), self.loop)
+    
+    def defer_waiting(self) -> list:
+        """Stop starting new sends (used on shutdown); returns the (data, sheet_type) still waiting for a slot"""
+        with self._lock:
+            self._deferring = True
+            return list(self._waiting.values())
+    
+    async def _acquire(self):
+        while self._idle:
+            client = self._idle.pop()
+            if client.is_connected:
+                return client
+        client = aiosmtplib.SMTP(
+            hostname=SMTP_SERVER,
+            port=SMTP_PORT,
+            username=SMTP_USERNAME,
+            password=SMTP_PASSWORD,
+            timeout=SMTP_TIMEOUT
+        )
+        try:
+            await client.connect()
+        except (Exception, asyncio.CancelledError):
+            client.close()
+            raise
+        client.messages_sent = 0
+        self.connections_created += 1
+        return client
+    
+    async def _release(self, client, healthy: bool):
+        if healthy and client.messages_sent < self.max_messages:
+            self._idle.append(client)
+            return
+        try:
+            await client.quit()
+        except asyncio.CancelledError:
+            client.close()
+            raise
+        except Exception:
+            client.close()
+    
+    async def _send(self, to_email: str, message: bytes):
+        """Send on a reused connection, reconnecting once if the server dropped it"""
+        for attempt in range(2):
+            client = await self._acquire()
+            try:
+                await client.sendmail(SMTP_FROM_EMAIL, [to_email], message)
+            except aiosmtplib.SMTPServerDisconnected:
+                await self._release(client, healthy=False)
+                if attempt:
+                    raise
+                continue
+            except asyncio.CancelledError:
+                # Timed out mid-send: the session state is unknown, so drop it without a QUIT round trip
+                client.close()
+                raise
+            except Exception:
+                await self._release(client, healthy=False)
+                raise
+            client.messages_sent += 1
+            await self._release(client, healthy=True)
+            return
+    
+    async def send_registration_email(self, data: dict, sheet_type: str) -> dict:
+        """Render and send one confirmation email under the concurrency limit"""
+        log_registration_id.set(registration_results.registration_id_for(sheet_type, data))
+        if not SMTP_USERNAME or not SMTP_PASSWORD:
+            logger.warning("SMTP credentials not configured. Email not sent.")
+            return {"success": False, "permanent": True, "message": "SMTP not configured"}
+        
+        to_email = data['email']
+        subject, html_content, text_content = render_registration_email(data, sheet_type)
+        try:
+            message = encode_confirmation_message(to_email, subject, html_content, text_content)
+        except ValueError as e:
+            logger.error("Cannot encode confirmation email", extra={"to_email": to_email, "error": str(e)})
+            return {"success": False, "permanent": True, "message": str(e)}
+        
+        key = (sheet_type, *registration_key(data['reg_no'], data['recipt_no']))
+        with self._lock:
+            self._waiting[key] = (data, sheet_type)
+        async with self._semaphore:
+            with self._lock:
+                self._waiting.pop(key, None)
+                if self._deferring:
+                    return {"success": False, "deferred": True, "message": "Deferred to the next start"}
+                self.sending += 1
+            started = time.perf_counter()
+            try:
+                await asyncio.wait_for(self._send(to_email, message), timeout=self.timeout)
+            except asyncio.TimeoutError:
+                self.timeouts += 1
+                metrics.inc("smtp_errors_total", error_class="TimeoutError")
+                logger.error("Timed out sending confirmation email", extra={"to_email": to_email})
+                return {"success": False, "message": f"Timed out after {self.timeout}s"}
+            except Exception as e:
+                metrics.inc("smtp_errors_total", error_class=type(e).__name__)
+                logger.error("Error sending confirmation email", extra={"to_email": to_email, "error": str(e)})
+                return {"success": False, "message": f"Failed to send email: {str(e)}"}
+            finally:
+                with self._lock:
+                    self.sending -= 1
+            metrics.observe("registration_stage_duration_seconds", time.perf_counter() - started, stage="smtp_send")
+        
+        logger.info("Confirmation email sent", extra={"sample": True, "to_email": to_email})
+        return {"success": True, "message": f"Email sent to {to_email}"}
+    
+    def stats(self) -> dict:
+        return {
+            "concurrency": self.concurrency,
+            "idle_connections": len(self._idle),
+            "sending": self.sending,
+            "waiting": len(self._waiting),
+            "connections_created": self.connections_created,
+            "timeouts": self.timeouts
+        }
+
+class EmailDispatcher:
+    """
+    Separate delivery stage for confirmation emails. Successful sheet
+    commits enqueue an email here and EMAIL_WORKERS threads send them, so
+    SMTP latency never holds up the Sheets writers. With
+    EMAIL_DELIVERY_MODE=asyncio the emails are handed to AsyncEmailSender
+    instead of the worker threads.
+    """
+    
+    def __init__(self, size: int = EMAIL_WORKERS, mode: str = EMAIL_DELIVERY_MODE):
+        self.size = max(size, 1)
+        self.mode = mode
+        self.async_sender = None
+        self.email_queue = queue.Queue()
+        self._lock = threading.Lock()
+        self.workers = []
+        self.in_flight = 0
+        self.enqueued = 0
+        self.sent = 0
+        self.failed = 0
+        self.max_depth = 0
+    
+    def start(self):
+        if self.mode == "asyncio":
+            if aiosmtplib is None:
+                logger.warning("EMAIL_DELIVERY_MODE=asyncio needs aiosmtplib; falling back to threads")
+                self.mode = "thread"
+            else:
+                self.async_sender = AsyncEmailSender()
+                self.async_sender.start()
+                logger.info(f"Started asyncio email sender (concurrency {self.async_sender.concurrency})")
+                return
+        
+        for index in range(self.size):
+            state = WorkerState(f"email-{index}")
+            state.thread = threading.Thread(target=self._worker_loop, args=(state,), name=state.name, daemon=True)
+            self.workers.append(state)
+            state.thread.start()
+        logger.info(f"Started email dispatcher with {self.size} worker(s)")
+    
+    def enqueue(self, data: dict, sheet_type: str):
+        """Queue a confirmation email for a registration that reached its sheet"""
+        with self._lock:
+            self.enqueued += 1
+        
+        if self.async_sender is not None:
+            with self._lock:
+                self.in_flight += 1
+                self.max_depth = max(self.max_depth, self.in_flight)
+            future = self.async_sender.submit(data, sheet_type)
+            future.add_done_callback(lambda done: self._async_done(data, sheet_type, done))
+            return
+        
+        self.email_queue.put((data, sheet_type, time.monotonic()))
+        with self._lock:
+            self.max_depth = max(self.max_depth, self.email_queue.qsize())
+    
+    def _async_done(self, data: dict, sheet_type: str, future: concurrent.futures.Future):
+        try:
+            result = future.result()
+        except Exception as e:
+            logger.error(f"Error in asyncio email sender: {e}")
+            result = {"success": False, "message": str(e)}
+        if result.get('deferred'):
+            # Never attempted: drain_for_shutdown already returned it to pending
+            with self._lock:
+                self.in_flight -= 1
+            return
+        success = result.get('success', False)
+        email_outbox.record_result(data, sheet_type, result)
+        with self._lock:
+            self.in_flight -= 1
+            if success:
+                self.sent += 1
+            else:
+                self.failed += 1
+    
+    def _worker_loop(self, state: WorkerState):
+        while True:
+            data, sheet_type, _ = self.email_queue.get()
+            state.begin(f"email {data.get('email')}")
+            with self._lock:
+                self.in_flight += 1
+            result = {"success": False, "message": "Email not sent"}
+            try:
+                result = send_registration_email(data, sheet_type)
+            except Exception as e:
+                logger.exception(f"Error in {state.name}: {e}")
+                result = {"success": False, "message": str(e)}
+            finally:
+                success = result.get('success', False)
+                email_outbox.record_result(data, sheet_type, result)
+                with self._lock:
+                    self.in_flight -= 1
+                    if success:
+                        self.sent += 1
+                    else:
+                        self.failed += 1
+                state.end()
+                self.email_queue.task_done()
+    
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "mode": self.mode,
+                "size": self.size,
+                "async_sender": self.async_sender.stats() if self.async_sender else None,
+                "depth": self.email_queue.qsize(),
+                "max_depth": self.max_depth,
+                "in_flight": self.in_flight,
+                "enqueued": self.enqueued,
+                "sent": self.sent,
+                "failed": self.failed,
+                "workers": [state.stats() for state in self.workers]
+            }
+
+# Email delivery stage and Sheets worker pool (started with the app)
+email_dispatcher = EmailDispatcher()
+worker_pool = RegistrationWorkerPool()
+
+def start_background_workers():
+    """Start the email dispatcher, the Sheets worker pool and the duplicate index re-sync (once)"""
+    if worker_pool.dispatcher is not None:
+        return
+    email_dispatcher.start()
+    worker_pool.start()
+    threading.Thread(target=sync_duplicate_index_periodically, name="duplicate-index-sync", daemon=True).start()
+    threading.Thread(target=retry_unsynced_periodically, name="unsynced-retry", daemon=True).start()
+
+class Warmup:
+    """
+    Google Sheets warm-up run in the background once the app starts:
+    authorize the client, open both worksheets and load the duplicate
+    index. Registrations are accepted meanwhile (they are committed to the
+    store and written once Sheets is reachable); GET /ready reports when
+    every step has finished. A failed run is retried every
+    WARMUP_RETRY_INTERVAL seconds.
+    """
+    
+    STEPS = ("credentials", "worksheets", "duplicate_index")
+    
+    def __init__(self, retry_interval: float = WARMUP_RETRY_INTERVAL):
+        self.retry_interval = retry_interval
+        self._lock = threading.Lock()
+        self._steps = {}
+        self._thread = None
+        self.attempts = 0
+        self.ready_at = None
+    
+    @property
+    def ready(self) -> bool:
+        return self.ready_at is not None
+    
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="warmup", daemon=True)
+            self._thread.start()
+    
+    def _run(self):
+        started = time.perf_counter()
+        while not self._attempt():
+            time.sleep(self.retry_interval)
+        self.ready_at = datetime.now()
+        logger.info(f"Google Sheets warm-up finished in {time.perf_counter() - started:.3f}s")
+    
+    def _attempt(self) -> bool:
+        """Run every step in order, stopping at the first that fails"""
+        self.attempts += 1
+        with self._lock:
+            self._steps.clear()
+        client = None
+        
+        def credentials():
+            nonlocal client
+            client = get_google_credentials()
+            return None if client else "Could not authorize the Google Sheets client"
+        
+        def worksheets():
+            missing = [sheet_type for sheet_type in ("internal", "external")
+                       if open_worksheet(client, sheet_type) is None]
+            return f"Could not open worksheet(s): {', '.join(missing)}" if missing else None
+        
+        def index():
+            duplicate_index.sync_all()
+            missing = [sheet_type for sheet_type in ("internal", "external")
+                       if sheet_type not in duplicate_index.last_synced]
+            return f"Could not load duplicate index for: {', '.join(missing)}" if missing else None
+        
+        for name, step in zip(self.STEPS, (credentials, worksheets, index)):
+            step_started = time.perf_counter()
+            try:
+                error = step()
+            except Exception as e:
+                error = str(e)
+            with self._lock:
+                self._steps[name] = {
+                    "status": "failed" if error else "ok",
+                    "seconds": round(time.perf_counter() - step_started, 3),
+                    "error": error
+                }
+            if error:
+                logger.warning(f"Google Sheets warm-up step '{name}' failed: {error}")
+                return False
+        return True
+    
+    def stats(self) -> dict:
+        with self._lock:
+            steps = {name: self._steps.get(name, {"status": "pending"}) for name in self.STEPS}
+        return {
+            "ready": self.ready,
+            "ready_at": self.ready_at.strftime("%Y-%m-%d %H:%M:%S") if self.ready_at else None,
+            "attempts": self.attempts,
+            "steps": steps
+        }
+
+warmup = Warmup()
+
+def wait_for_tasks(task_queue: queue.Queue, deadline: float) -> int:
+    """Wait until every task put on task_queue is done or the monotonic deadline passes; returns the unfinished count"""
+    with task_queue.all_tasks_done:
+        while task_queue.unfinished_tasks:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            task_queue.all_tasks_done.wait(remaining)
+        return task_queue.unfinished_tasks
+
+def drain_for_shutdown(timeout: float = SHUTDOWN_DRAIN_TIMEOUT) -> dict:
+    """
+    Give queued registrations, then confirmation emails, up to timeout
+    seconds to finish. Registrations that miss the deadline are already
+    committed to the store and are mirrored after the next start; emails
+    that were never attempted (still in the in-memory queue, or waiting for
+    an asyncio send slot) go back to pending in the outbox.
+    Returns how many of each were drained and deferred.
+    """
+    started = time.monotonic()
+    deadline = started + timeout
+    registrations = registration_queue.unfinished_tasks
+    emails_done = email_dispatcher.sent + email_dispatcher.failed
+    
+    registrations_left = wait_for_tasks(registration_queue, deadline)
+    async_sender = email_dispatcher.async_sender
+    if async_sender is not None:
+        while email_dispatcher.in_flight and time.monotonic() < deadline:
+            time.sleep(0.05)
+        # Sends still waiting for a semaphore slot were never attempted
+        unsent = async_sender.defer_waiting()
+    else:
+        wait_for_tasks(email_dispatcher.email_queue, deadline)
+        unsent = []
+    
+    while True:
+        try:
+            data, sheet_type, _ = email_dispatcher.email_queue.get_nowait()
+        except queue.Empty:
+            break
+        unsent.append((data, sheet_type))
+        email_dispatcher.email_queue.task_done()
+    if unsent:
+        email_outbox.release(unsent)
+    
+    return {
+        "registrations_drained": max(registrations - registrations_left, 0),
+        "registrations_deferred": registrations_left,
+        "emails_drained": email_dispatcher.sent + email_dispatcher.failed - emails_done,
+        "emails_deferred": len(unsent),
+        # Mid-send at the deadline: dead-lettered on the next start, as they may have gone out
+        "emails_interrupted": async_sender.sending if async_sender is not None else email_dispatcher.in_flight,
+        "seconds": round(time.monotonic() - started, 3)
+    }
+
+@contextlib.asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Start the background workers on startup and drain them on shutdown"""
+    await startup_event()
+    try:
+        yield
+    finally:
+        await shutdown_event()
+
+# Create FastAPI app
+app = FastAPI(
+    title="Battle of Binaries 1.0 Registration API",
+    description="Asynchronous API for handling internal and external student registrations",
+    version="1.0.0",
+    lifespan=lifespan
+)
+
+# Configure CORS based on environment
+allowed_origins_env = os.getenv('ALLOWED_ORIGINS', '*')
+if allowed_origins_env == '*':
+    allowed_origins = ["*"]
+else:
+    # Split comma-separated origins
+    allowed_origins = [origin.strip() for origin in allowed_origins_env.split(',')]
+
+# Add CORS middleware
 app.add_middleware(
     CORSMiddleware,
     allow_origins=allowed_origins,
@@ -673,34 +3924,167 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-@app.post("/register/internal")
-async def register_internal(registration: InternalRegistration, background_tasks: BackgroundTasks):
+class IdempotencyCache:
     """
-    Register internal student
-    Data: name, reg_no, division, year_of_study, email, recipt_no
+    First responses of the registration endpoints, keyed by endpoint and
+    Idempotency-Key, kept for IDEMPOTENCY_TTL seconds with LRU eviction
+    beyond IDEMPOTENCY_MAX_ENTRIES. Each entry stores a hash of the request
+    body so a key reused for a different registration is rejected. A retry
+    that arrives while the first request is still running waits for it.
+    Only touched from the event loop, so it needs no lock.
     """
+    
+    def __init__(self, max_entries: int = IDEMPOTENCY_MAX_ENTRIES, ttl: float = IDEMPOTENCY_TTL):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = collections.OrderedDict()
+        self.replays = 0
+        self.evictions = 0
+    
+    @staticmethod
+    def fingerprint(payload: dict) -> str:
+        return hashlib.sha256(json.dumps(payload, sort_keys=True).encode()).hexdigest()
+    
+    def get(self, scope: str, key: str):
+        entry = self._entries.get((scope, key))
+        if entry is None:
+            return None
+        if time.monotonic() >= entry["expires"]:
+            del self._entries[(scope, key)]
+            return None
+        self._entries.move_to_end((scope, key))
+        return entry
+    
+    def begin(self, scope: str, key: str, fingerprint: str) -> dict:
+        entry = {
+            "fingerprint": fingerprint,
+            "response": None,
+            "done": asyncio.get_running_loop().create_future(),
+            "expires": time.monotonic() + self.ttl
+        }
+        self._entries[(scope, key)] = entry
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+        return entry
+    
+    def finish(self, scope: str, key: str, entry: dict, response):
+        """Store (status_code, body), or drop the entry when response is None so the key can be retried"""
+        if response is None:
+            if self._entries.get((scope, key)) is entry:
+                del self._entries[(scope, key)]
+        else:
+            entry["response"] = response
+        if not entry["done"].done():
+            entry["done"].set_result(None)
+    
+    def stats(self) -> dict:
+        return {
+            "entries": len(self._entries),
+            "max_entries": self.max_entries,
+            "ttl_seconds": self.ttl,
+            "replays": self.replays,
+            "evictions": self.evictions
+        }
+
+idempotency_cache = IdempotencyCache()
+
+async def run_idempotent(scope: str, idempotency_key: Optional[str], payload: dict, handler):
+    """
+    Run a registration handler at most once per Idempotency-Key and replay
+    its first response to retries. Server errors (5xx) and 429s are not cached.
+    """
+    if not idempotency_key:
+        return await handler()
+    if len(idempotency_key) > IDEMPOTENCY_KEY_MAX_LENGTH:
+        raise HTTPException(
+            status_code=400,
+            detail={
+                "error": "Invalid Idempotency-Key",
+                "message": f"Idempotency-Key must be at most {IDEMPOTENCY_KEY_MAX_LENGTH} characters"
+            }
+        )
+    
+    fingerprint = IdempotencyCache.fingerprint(payload)
+    while True:
+        entry = idempotency_cache.get(scope, idempotency_key)
+        if entry is None:
+            break
+        if entry["fingerprint"] != fingerprint:
+            raise HTTPException(
+                status_code=422,
+                detail={
+                    "error": "Idempotency-Key reused",
+                    "message": "This Idempotency-Key was already used for a different registration"
+                }
+            )
+        if entry["response"] is not None:
+            idempotency_cache.replays += 1
+            metrics.inc("registrations_received_total", type=scope, outcome="replayed")
+            status_code, body = entry["response"]
+            return JSONResponse(status_code=status_code, content=body, headers={"Idempotent-Replayed": "true"})
+        # The first request is still running
+        await asyncio.shield(entry["done"])
+    
+    entry = idempotency_cache.begin(scope, idempotency_key, fingerprint)
+    response = None
+    try:
+        result = await handler()
+        response = (200, result)
+        return result
+    except HTTPException as e:
+        # Server errors and queue-full rejections are worth retrying with the same key
+        if e.status_code < 500 and e.status_code != 429:
+            response = (e.status_code, {"detail": e.detail})
+        raise
+    finally:
+        idempotency_cache.finish(scope, idempotency_key, entry, response)
+
+# registrations_received_total outcome for each HTTP error status
+RECEIVED_OUTCOMES = {409: "duplicate", 429: "queue_full", 503: "shutting_down"}
+
+async def save_internal_registration(registration: InternalRegistration):
+    """Reject duplicates, then commit and queue an internal registration; returns the response body"""
     try:
-        print(f"Received internal registration request: {registration.name}")
-        
         # Convert to dict
         reg_data = registration.dict()
         
-        # Create a future-like object to store result
-        result_container = {"result": None, "done": False}
-        result_event = asyncio.Event()
+        # Reject known duplicates right away, without a store round trip or queue slot
+        if (registration_keys.contains("internal", reg_data)
+                or duplicate_index.contains("internal", reg_data['reg_no'], reg_data['recipt_no'])):
+            raise HTTPException(status_code=409, detail=duplicate_result(reg_data))
+        
+        if shutting_down.is_set():
+            raise shutting_down_error()
+        retry_after = queue_admission.check()
+        if retry_after is not None:
+            raise queue_full_error(retry_after)
+        
+        # Commit to the local store, then queue for mirroring to Google Sheets
+        result = await asyncio.get_event_loop().run_in_executor(
+            None, save_to_google_sheet, reg_data, "internal"
+        )
         
-        def callback(result):
-            result_container["result"] = result
-            result_container["done"] = True
+        if not result.get("success"):
+            raise HTTPException(
+                status_code=409 if result.get("error") == "Duplicate registration" else 400,
+                detail=result
+            )
         
-        # Add to queue for processing
-        registration_queue.put((reg_data, "internal", callback))
+        metrics.inc("registrations_received_total", type="internal", outcome="accepted")
+        logger.info("Registration accepted", extra={
+            "sample": True,
+            "registration_id": result["registration_id"],
+            "sheet_type": "internal",
+            "reg_no": registration.reg_no
+        })
         
-        # Return immediate response - registration is queued
+        # Return immediate response - registration is committed locally
         return {
             "success": True,
-            "message": "Internal registration queued successfully",
-            "status": "processing",
+            "message": "Internal registration saved successfully",
+            "status": "saved",
+            "registration_id": result["registration_id"],
             "data": {
                 "name": registration.name,
                 "reg_no": registration.reg_no,
@@ -709,9 +4093,12 @@ async def register_internal(registration: InternalRegistration, background_tasks
             }
         }
     
+    except HTTPException as e:
+        metrics.inc("registrations_received_total", type="internal", outcome=RECEIVED_OUTCOMES.get(e.status_code, "error"))
+        raise
     except Exception as e:
-        print(f"Error in internal registration endpoint: {e}")
-        traceback.print_exc()
+        metrics.inc("registrations_received_total", type="internal", outcome="error")
+        logger.exception("Error in internal registration endpoint", extra={"reg_no": registration.reg_no})
         raise HTTPException(
             status_code=500,
             detail={
@@ -720,33 +4107,61 @@ async def register_internal(registration: InternalRegistration, background_tasks
             }
         )
 
-@app.post("/register/external")
-async def register_external(registration: ExternalRegistration, background_tasks: BackgroundTasks):
+@app.post("/register/internal")
+async def register_internal(registration: InternalRegistration, background_tasks: BackgroundTasks,
+                            idempotency_key: Optional[str] = Header(None)):
     """
-    Register external student
-    Data: name, reg_no, dept_name, year_of_study, college_name, email, recipt_no
+    Register internal student
+    Data: name, reg_no, division, year_of_study, email, recipt_no
+    Send an Idempotency-Key header to make retries safe: a repeated key
+    gets the first response back without registering again
     """
+    return await run_idempotent(
+        "internal", idempotency_key, registration.dict(), lambda: save_internal_registration(registration)
+    )
+
+async def save_external_registration(registration: ExternalRegistration):
+    """Reject duplicates, then commit and queue an external registration; returns the response body"""
     try:
-        print(f"Received external registration request: {registration.name}")
-        
         # Convert to dict
         reg_data = registration.dict()
         
-        # Create a future-like object to store result
-        result_container = {"result": None, "done": False}
+        # Reject known duplicates right away, without a store round trip or queue slot
+        if (registration_keys.contains("external", reg_data)
+                or duplicate_index.contains("external", reg_data['reg_no'], reg_data['recipt_no'])):
+            raise HTTPException(status_code=409, detail=duplicate_result(reg_data))
+        
+        if shutting_down.is_set():
+            raise shutting_down_error()
+        retry_after = queue_admission.check()
+        if retry_after is not None:
+            raise queue_full_error(retry_after)
         
-        def callback(result):
-            result_container["result"] = result
-            result_container["done"] = True
+        # Commit to the local store, then queue for mirroring to Google Sheets
+        result = await asyncio.get_event_loop().run_in_executor(
+            None, save_to_google_sheet, reg_data, "external"
+        )
+        
+        if not result.get("success"):
+            raise HTTPException(
+                status_code=409 if result.get("error") == "Duplicate registration" else 400,
+                detail=result
+            )
         
-        # Add to queue for processing
-        registration_queue.put((reg_data, "external", callback))
+        metrics.inc("registrations_received_total", type="external", outcome="accepted")
+        logger.info("Registration accepted", extra={
+            "sample": True,
+            "registration_id": result["registration_id"],
+            "sheet_type": "external",
+            "reg_no": registration.reg_no
+        })
         
-        # Return immediate response - registration is queued
+        # Return immediate response - registration is committed locally
         return {
             "success": True,
-            "message": "External registration queued successfully",
-            "status": "processing",
+            "message": "External registration saved successfully",
+            "status": "saved",
+            "registration_id": result["registration_id"],
             "data": {
                 "name": registration.name,
                 "reg_no": registration.reg_no,
@@ -756,9 +4171,12 @@ async def register_external(registration: ExternalRegistration, background_tasks
             }
         }
     
+    except HTTPException as e:
+        metrics.inc("registrations_received_total", type="external", outcome=RECEIVED_OUTCOMES.get(e.status_code, "error"))
+        raise
     except Exception as e:
-        print(f"Error in external registration endpoint: {e}")
-        traceback.print_exc()
+        metrics.inc("registrations_received_total", type="external", outcome="error")
+        logger.exception("Error in external registration endpoint", extra={"reg_no": registration.reg_no})
         raise HTTPException(
             status_code=500,
             detail={
@@ -767,12 +4185,427 @@ async def register_external(registration: ExternalRegistration, background_tasks
             }
         )
 
+@app.post("/register/external")
+async def register_external(registration: ExternalRegistration, background_tasks: BackgroundTasks,
+                            idempotency_key: Optional[str] = Header(None)):
+    """
+    Register external student
+    Data: name, reg_no, dept_name, year_of_study, college_name, email, recipt_no
+    Send an Idempotency-Key header to make retries safe: a repeated key
+    gets the first response back without registering again
+    """
+    return await run_idempotent(
+        "external", idempotency_key, registration.dict(), lambda: save_external_registration(registration)
+    )
+
+NDJSON_CONTENT_TYPES = ("application/x-ndjson", "application/ndjson", "application/jsonl", "application/x-jsonlines")
+BATCH_WHITESPACE = re.compile(r'[ \t\n\r]*')
+# What is left of a number, literal or escape sequence cut off by a chunk boundary
+BATCH_PARTIAL_TOKEN = re.compile(r'[\w.+\-\\]*')
+
+class BatchBodyError(ValueError):
+    """A bulk upload body that is not a JSON array / NDJSON stream of records"""
+
+def parse_ndjson_line(line: str):
+    try:
+        return json.loads(line)
+    except json.JSONDecodeError as e:
+        return BatchBodyError(f"Invalid JSON: {e.msg}")
+
+async def iter_batch_records(request: Request, ndjson: bool):
+    """
+    Yield records from a JSON array or NDJSON request body as it arrives,
+    holding at most one partial record in memory. Unparseable NDJSON lines
+    are yielded as BatchBodyError instances; a malformed array raises one.
+    """
+    decoder = codecs.getincrementaldecoder("utf-8")()
+    parser = json.JSONDecoder()
+    buffer = ""
+    # Next token of the array: "[", a record or "]" ("first"), a record
+    # ("record"), "," or "]" ("separator"), and only whitespace once closed
+    expect = "open"
+    async for chunk in request.stream():
+        buffer += decoder.decode(chunk)
+        if ndjson:
+            *lines, buffer = buffer.split("\n")
+            for line in lines:
+                if line.strip():
+                    yield parse_ndjson_line(line)
+        else:
+            position = 0
+            while True:
+                position = BATCH_WHITESPACE.match(buffer, position).end()
+                if position == len(buffer):
+                    break
+                char = buffer[position]
+                if expect == "open":
+                    if char != "[":
+                        raise BatchBodyError("Body must be a JSON array or NDJSON")
+                    expect, position = "first", position + 1
+                elif expect == "closed":
+                    raise BatchBodyError("Unexpected data after the JSON array")
+                elif expect == "separator":
+                    if char not in ",]":
+                        raise BatchBodyError(f"Expected ',' or ']' at offset {position}, got {char!r}")
+                    expect, position = "record" if char == "," else "closed", position + 1
+                elif char == "]" and expect == "first":
+                    expect, position = "closed", position + 1
+                else:
+                    try:
+                        record, end = parser.raw_decode(buffer, position)
+                    except json.JSONDecodeError as e:
+                        if e.msg.startswith("Unterminated string") or BATCH_PARTIAL_TOKEN.fullmatch(buffer, e.pos):
+                            # Incomplete record: wait for the next chunk
+                            break
+                        raise BatchBodyError(f"Invalid JSON: {e.msg}")
+                    if BATCH_PARTIAL_TOKEN.fullmatch(buffer, end):
+                        # A number at the end of the chunk may continue in the next one
+                        break
+                    yield record
+                    expect, position = "separator", end
+            buffer = buffer[position:]
+        if len(buffer) > BATCH_MAX_RECORD_BYTES:
+            raise BatchBodyError(f"Record exceeds {BATCH_MAX_RECORD_BYTES} bytes")
+    
+    buffer += decoder.decode(b"", final=True)
+    if ndjson:
+        if buffer.strip():
+            yield parse_ndjson_line(buffer)
+    elif expect not in ("open", "closed"):
+        raise BatchBodyError("Unterminated JSON array")
+
+def validate_batch_record(record) -> tuple:
+    """Validate one bulk record with its registration model; returns (data, sheet_type)"""
+    if isinstance(record, BatchBodyError):
+        raise record
+    if not isinstance(record, dict):
+        raise ValueError("Record must be a JSON object")
+    # Records say which form they are; without a type, college_name marks an external student
+    sheet_type = record.get("type")
+    if sheet_type in (None, ""):
+        sheet_type = "external" if "college_name" in record else "internal"
+    models = {"internal": InternalRegistration, "external": ExternalRegistration}
+    if not isinstance(sheet_type, str) or sheet_type not in models:
+        raise ValueError("type must be 'internal' or 'external'")
+    model = models[sheet_type]
+    fields = {key: value for key, value in record.items() if key != "type"}
+    return model(**fields).dict(), sheet_type
+
+# registrations_received_total outcome for each bulk record status
+BATCH_RECEIVED_OUTCOMES = {"saved": "accepted", "duplicate": "duplicate", "invalid": "invalid",
+                           "rejected": "queue_full", "error": "error"}
+
+def save_batch_group(group: list) -> list:
+    """
+    Save validated (index, data, sheet_type, outcome) entries in one group
+    commit; entries that already carry an outcome (invalid records) are
+    passed through. Returns one outcome per entry, in order.
+    """
+    valid = [(data, sheet_type, None) for _, data, sheet_type, outcome in group if outcome is None]
+    retry_after = queue_admission.check(len(valid)) if valid else None
+    if retry_after is not None:
+        rejection = {"error": "Registration queue is full", "retry_after": retry_after,
+                     "message": f"Too many registrations are waiting to be saved, please retry in {retry_after} seconds"}
+        results = iter([rejection] * len(valid))
+    else:
+        try:
+            results = iter(save_registrations(valid))
+        except Exception as e:
+            logger.exception("Error saving bulk registrations", extra={"count": len(valid)})
+            failure = {"error": "Internal server error", "message": str(e)}
+            results = iter([failure] * len(valid))
+    
+    outcomes = []
+    for index, data, sheet_type, outcome in group:
+        if outcome is None:
+            result = next(results)
+            outcome = {"index": index, "type": sheet_type, "reg_no": data['reg_no']}
+            if result.get("success"):
+                outcome.update(success=True, status="saved", registration_id=result["registration_id"])
+            elif "retry_after" in result:
+                outcome.update(success=False, status="rejected", error=result["error"],
+                               message=result["message"], retry_after=result["retry_after"])
+            else:
+                outcome.update(
+                    success=False,
+                    status="duplicate" if result.get("error") == "Duplicate registration" else "error",
+                    error=result.get("error"),
+                    message=result.get("message")
+                )
+        outcomes.append(outcome)
+        metrics.inc("registrations_received_total", type=outcome.get("type") or "unknown",
+                    outcome=BATCH_RECEIVED_OUTCOMES[outcome["status"]])
+    return outcomes
+
+@app.post("/register/batch")
+async def register_batch(request: Request):
+    """
+    Register many internal and/or external students in one request
+    Body: a JSON array of records, or NDJSON (one record per line) with
+    Content-Type application/x-ndjson. Each record has the fields of its
+    form plus an optional "type" ('internal' or 'external').
+    Records are validated as the body streams in and saved QUEUE_BATCH_SIZE
+    at a time; the response has one outcome per record, in order. Groups
+    that do not fit in the queue are "rejected" with a retry_after hint.
+    """
+    if shutting_down.is_set():
+        raise shutting_down_error()
+    retry_after = queue_admission.check()
+    if retry_after is not None:
+        raise queue_full_error(retry_after)
+    
+    content_type = request.headers.get("content-type", "").split(";")[0].strip().lower()
+    ndjson = content_type in NDJSON_CONTENT_TYPES
+    loop = asyncio.get_event_loop()
+    outcomes = []
+    group = []
+    index = 0
+    
+    try:
+        async for record in iter_batch_records(request, ndjson):
+            if index >= BATCH_MAX_RECORDS:
+                raise BatchBodyError(f"Batch exceeds {BATCH_MAX_RECORDS} records")
+            try:
+                data, sheet_type = validate_batch_record(record)
+                group.append((index, data, sheet_type, None))
+            except ValidationError as e:
+                group.append((index, None, None, {
+                    "index": index, "success": False, "status": "invalid", "error": "Validation failed",
+                    "details": [
+                        {"field": ".".join(str(part) for part in error["loc"]), "message": error["msg"]}
+                        for error in e.errors()
+                    ]
+                }))
+            except ValueError as e:
+                group.append((index, None, None, {
+                    "index": index, "success": False, "status": "invalid", "error": "Invalid record", "message": str(e)
+                }))
+            index += 1
+            
+            if len(group) >= QUEUE_BATCH_SIZE:
+                outcomes.extend(await loop.run_in_executor(None, save_batch_group, group))
+                group = []
+    except BatchBodyError as e:
+        # Keep what was already saved and report where the body went wrong
+        if group:
+            outcomes.extend(await loop.run_in_executor(None, save_batch_group, group))
+            group = []
+        if not outcomes:
+            raise HTTPException(status_code=400, detail={"error": "Invalid batch body", "message": str(e)})
+        outcomes.append({"index": index, "success": False, "status": "invalid", "error": "Invalid batch body",
+                         "message": str(e)})
+    
+    if group:
+        outcomes.extend(await loop.run_in_executor(None, save_batch_group, group))
+    
+    counts = collections.Counter(outcome["status"] for outcome in outcomes)
+    logger.info("Bulk registration processed", extra={"total": len(outcomes), **counts})
+    return {
+        "success": counts["saved"] == len(outcomes),
+        "summary": {
+            "total": len(outcomes),
+            **{status: counts[status] for status in ("saved", "duplicate", "invalid", "rejected", "error")}
+        },
+        "results": outcomes
+    }
+
+@app.get("/registrations/{registration_id}")
+async def get_registration(registration_id: str, wait: float = 0):
+    """
+    Look up a registration by the ID returned when it was queued
+    With wait > 0, long-poll for up to that many seconds (capped at
+    RESULT_LONG_POLL_MAX) until it is synced, a duplicate or failed
+    """
+    entry = await registration_results.wait(registration_id, min(max(wait, 0), RESULT_LONG_POLL_MAX))
+    # Followers learn about writes from the store once per poll; check it directly
+    if entry is not None and not (shared_queue.role == "follower" and entry["status"] == "queued"):
+        return entry
+    
+    # Evicted or from before a restart: fall back to the local store
+    row = await asyncio.get_event_loop().run_in_executor(None, registration_store.lookup, registration_id)
+    if row is None:
+        raise HTTPException(
+            status_code=404,
+            detail={
+                "error": "Registration not found",
+                "message": f"No registration with ID {registration_id}"
+            }
+        )
+    return {
+        "registration_id": registration_id,
+        "sheet_type": row["sheet_type"],
+        "status": (row["sync_status"] or "synced") if row["synced_at"] else "queued",
+        "result": None,
+        "updated_at": row["synced_at"] or row["created_at"]
+    }
+
+def format_sse(event: str, payload: dict) -> str:
+    """Encode one Server-Sent Events message"""
+    return f"event: {event}\ndata: {json.dumps(payload)}\n\n"
+
+@app.get("/registrations/{registration_id}/events")
+async def stream_registration_events(registration_id: str):
+    """
+    Server-Sent Events stream of a registration's stages: queued, writing,
+    synced / duplicate / failed, then email_sent / email_retrying / email_failed.
+    The current state is sent first; the stream ends once nothing more can happen.
+    """
+    subscriber, snapshot = registration_results.subscribe(registration_id)
+    if snapshot is None:
+        registration_results.unsubscribe(registration_id, subscriber)
+        # Evicted or from before a restart: report what the local store knows
+        row = await asyncio.get_event_loop().run_in_executor(None, registration_store.lookup, registration_id)
+        if row is None:
+            raise HTTPException(
+                status_code=404,
+                detail={
+                    "error": "Registration not found",
+                    "message": f"No registration with ID {registration_id}"
+                }
+            )
+        status = (row["sync_status"] or "synced") if row["synced_at"] else "queued"
+        snapshot = {"registration_id": registration_id, "sheet_type": row["sheet_type"], "status": status,
+                    "result": None, "email_status": None, "updated_at": row["synced_at"] or row["created_at"]}
+        
+        async def single_event():
+            yield format_sse(status, snapshot)
+        
+        return StreamingResponse(single_event(), media_type="text/event-stream",
+                                 headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+    
+    async def events():
+        try:
+            yield format_sse(snapshot["status"], snapshot)
+            if RegistrationResults.is_closed(snapshot):
+                return
+            while True:
+                payload = await subscriber.get()
+                if payload is None:
+                    yield ": keepalive\n\n"
+                    continue
+                yield format_sse(payload["event"], payload)
+                if RegistrationResults.is_closed(payload):
+                    return
+        finally:
+            registration_results.unsubscribe(registration_id, subscriber)
+    
+    return StreamingResponse(events(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+@app.get("/metrics")
+async def get_metrics():
+    """Prometheus text-format metrics"""
+    outbox = email_outbox.stats()
+    gauges = [
+        ("registration_queue_depth", "Registrations waiting in the queue", registration_queue.qsize()),
+        ("registration_backlog", "Registrations accepted but not yet mirrored to Google Sheets", queue_admission.backlog()),
+        ("registration_oldest_item_age_seconds", "Age of the oldest unfinished registration", queue_clock.oldest_age()),
+        ("email_queue_depth", "Confirmation emails waiting for a sender", email_dispatcher.email_queue.qsize()),
+        ("email_in_flight", "Confirmation emails being sent", email_dispatcher.in_flight),
+        ("email_outbox_messages", "Confirmation emails in the outbox by status", [
+            ((("status", status),), outbox.get(status, 0)) for status in ("pending", "sending", "sent", "dead")
+        ]),
+        ("log_records_dropped", "Log records dropped because the log queue was full", log_handler.dropped)
+    ]
+    return Response(content=metrics.render(gauges), media_type="text/plain; version=0.0.4")
+
+@app.get("/ready")
+async def get_readiness():
+    """Readiness probe: 200 once the Google Sheets warm-up has finished, 503 until then"""
+    # Followers never touch Google Sheets, so they are ready without a warm-up
+    warmed_up = warmup.ready or shared_queue.role == "follower"
+    ready = warmed_up and worker_pool.is_alive() and not shutting_down.is_set()
+    return JSONResponse(
+        status_code=200 if ready else 503,
+        content={
+            "ready": ready,
+            "shutting_down": shutting_down.is_set(),
+            "queue_role": shared_queue.role,
+            "warmup": warmup.stats(),
+            "worker_active": worker_pool.is_alive(),
+            "timestamp": datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        }
+    )
+
 @app.get("/queue/status")
 async def get_queue_status():
     """Get current queue status"""
+    backlog = queue_admission.backlog()
+    throughput = {
+        f"{window // 60}m": round(processing_stats.throughput(window), 3) for window in (60, 300, 900)
+    }
+    # Drain estimate from the most recent rate that saw any progress
+    rate = next((rate for rate in throughput.values() if rate > 0), 0)
+    if shared_queue.role == "follower":
+        # The leader does the writing; use the drain rate observed through the store
+        rate = queue_admission.drain_rate()
     return {
         "queue_size": registration_queue.qsize(),
-        "worker_active": worker_thread.is_alive(),
+        "backlog": backlog,
+        "throughput_per_second": throughput,
+        "processing_time_seconds": processing_stats.percentiles(),
+        "oldest_item_age_seconds": round(queue_clock.oldest_age(), 3),
+        "estimated_drain_seconds": round(backlog / rate, 1) if rate else (0 if not backlog else None),
+        "workers": [
+            {key: state[key] for key in ("name", "current_task", "current_task_seconds")}
+            for state in worker_pool.stats()["workers"] + email_dispatcher.stats().get("workers", [])
+        ],
+        "admission": queue_admission.stats(),
+        "shared_queue": shared_queue.stats(),
+        "warmup": warmup.stats(),
+        "worker_active": worker_pool.is_alive(),
+        "worker_pool": worker_pool.stats(),
+        "sheets_scheduler": sheets_scheduler.stats(),
+        "google_auth": google_client.stats(),
+        "duplicate_index": duplicate_index.stats(),
+        "registration_keys": registration_keys.stats(),
+        "idempotency_cache": idempotency_cache.stats(),
+        "worksheet_cache": worksheet_cache.stats(),
+        "store": registration_store.stats(),
+        "registration_results": registration_results.stats(),
+        "email_dispatcher": email_dispatcher.stats(),
+        "email_outbox": email_outbox.stats(),
+        "smtp_pool": smtp_pool.stats(),
+        "logging": {
+            "level": LOG_LEVEL,
+            "sample_rate": log_handler.sample_rate,
+            "queued": log_handler.queue.qsize(),
+            "dropped": log_handler.dropped,
+            "sampled_out": log_handler.sampled_out
+        },
+        "timestamp": datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    }
+
+def require_admin(token: Optional[str]):
+    """Reject admin requests without the configured ADMIN_TOKEN"""
+    if ADMIN_TOKEN and token != ADMIN_TOKEN:
+        raise HTTPException(
+            status_code=401,
+            detail={
+                "error": "Unauthorized",
+                "message": "A valid X-Admin-Token header is required"
+            }
+        )
+
+@app.get("/admin/email/dead-letters")
+async def list_email_dead_letters(limit: int = 100, x_admin_token: Optional[str] = Header(None)):
+    """List confirmation emails that exhausted their retries"""
+    require_admin(x_admin_token)
+    dead_letters = await asyncio.get_event_loop().run_in_executor(None, email_outbox.dead_letters, limit)
+    return {
+        "count": len(dead_letters),
+        "dead_letters": dead_letters
+    }
+
+@app.post("/admin/email/dead-letters/resend")
+async def resend_email_dead_letters(x_admin_token: Optional[str] = Header(None)):
+    """Re-drive every dead-lettered confirmation email"""
+    require_admin(x_admin_token)
+    requeued = await asyncio.get_event_loop().run_in_executor(None, email_outbox.redrive_dead_letters)
+    return {
+        "success": True,
+        "message": f"{requeued} email(s) moved back to the outbox for delivery",
+        "requeued": requeued,
         "timestamp": datetime.now().strftime("%Y-%m-%d %H:%M:%S")
     }
 
@@ -785,6 +4618,7 @@ async def home():
         "features": [
             "Asynchronous processing",
             "No data loss with queue system",
+            "Local SQLite store with asynchronous Google Sheets mirroring",
             "Separate endpoints for internal and external students",
             "Automatic duplicate detection",
             "Thread-safe operations"
@@ -793,7 +4627,14 @@ async def home():
             "/": "GET - API information",
             "/register/internal": "POST - Register internal student",
             "/register/external": "POST - Register external student",
+            "/register/batch": "POST - Register many students (JSON array or NDJSON, mixed types)",
+            "/registrations/{registration_id}": "GET - Registration status (?wait=seconds to long-poll)",
+            "/registrations/{registration_id}/events": "GET - Server-Sent Events stream of registration status",
+            "/ready": "GET - Readiness probe (503 until the Google Sheets warm-up finishes)",
             "/queue/status": "GET - Check registration queue status",
+            "/metrics": "GET - Prometheus metrics",
+            "/admin/email/dead-letters": "GET - List confirmation emails that exhausted their retries",
+            "/admin/email/dead-letters/resend": "POST - Re-drive all dead-lettered confirmation emails",
             "/docs": "GET - Interactive API documentation",
             "/redoc": "GET - Alternative API documentation"
         },
@@ -848,13 +4689,15 @@ async def home():
         "notes": [
             "All registrations are processed asynchronously",
             "Queue system ensures no data loss",
-            "Duplicate registrations are automatically detected",
+            "Registrations are committed to a local SQLite store before the response is sent",
+            "Duplicate registrations are rejected with HTTP 409",
+            "Send an Idempotency-Key header to safely retry a registration; retries replay the first response",
+            "Each registration response includes a registration_id to track it via /registrations/{registration_id}",
             "Timestamps are automatically added",
             "Make sure service account has edit access to Google Sheets"
         ]
     }
 
-@app.on_event("startup")
 async def startup_event():
     """Startup event handler"""
     environment = os.getenv('ENVIRONMENT', 'development')
@@ -867,26 +4710,47 @@ async def startup_event():
     print(f"CORS Origins: {os.getenv('ALLOWED_ORIGINS', '*')}")
     print("=" * 60)
     print("✓ Environment variables loaded")
-    print("✓ Background worker thread started")
+    
+    start_background_workers()
+    print(f"✓ Background worker pool started ({worker_pool.size} sheet writers)")
+    
+    # Open the local store and resume mirroring anything not yet in the sheets
+    resume_unsynced_registrations()
+    if not shared_queue.enabled:
+        # Otherwise the outbox runs in the leader process only
+        email_outbox.start()
     print("✓ Queue system initialized")
-    print("✓ Google Sheets integration ready")
     
-    # Test credentials on startup
-    client = get_google_credentials()
-    if client:
-        print("✓ Google Cloud credentials validated successfully")
-    else:
-        print("❌ WARNING: Failed to validate Google credentials!")
-        print("   Please check your environment variables or credentials.json")
+    # Credentials, worksheets and the duplicate index load in the background
+    # (with a shared queue, in the leader process once it is elected)
+    if not shared_queue.enabled:
+        warmup.start()
+    print("✓ Google Sheets warm-up started in the background (see /ready)")
     
     print("=" * 60)
 
-@app.on_event("shutdown")
 async def shutdown_event():
     """Shutdown event handler"""
-    print("Waiting for queue to finish processing...")
-    registration_queue.join()
+    # Refuse new registrations and stop picking up work from the store
+    shutting_down.set()
+    shared_queue.stop()
+    email_outbox.stop()
+    
+    print(f"Draining the registration queue (up to {SHUTDOWN_DRAIN_TIMEOUT:g}s)...")
+    report = await asyncio.get_event_loop().run_in_executor(None, drain_for_shutdown)
+    logger.info("Shutdown drain finished", extra=report)
+    print(f"✓ Drained {report['registrations_drained']} registration(s) and {report['emails_drained']} email(s) "
+          f"in {report['seconds']}s")
+    if report['registrations_deferred'] or report['emails_deferred'] or report['emails_interrupted']:
+        print(f"⚠ Deferred {report['registrations_deferred']} registration(s) and {report['emails_deferred']} "
+              f"email(s) to the next start; {report['emails_interrupted']} email(s) were interrupted mid-send")
+    
+    shared_queue.release()
+    registration_store.close()
+    smtp_pool.close()
     print("Battle of Binaries 1.0 Registration API shutting down...")
+    # Flush buffered log lines
+    log_listener.stop()
 
 if __name__ == "__main__":
     port = int(os.environ.get("PORT", 8000))
@@ -0,0 +1,102 @@
+"""Shared fixtures for the registration API tests"""
+
+import time
+import uuid
+
+import pytest
+from fastapi.testclient import TestClient
+
+import main
+
+
+@pytest.fixture
+def store(tmp_path):
+    store = main.RegistrationStore(path=str(tmp_path / "registrations.db"), commit_interval=0.05)
+    assert store.open() == []
+    yield store
+    store.close()
+
+
+class Worksheet:
+    """In-memory stand-in for a gspread worksheet"""
+
+    def __init__(self, worksheet_id, title):
+        self.id = worksheet_id
+        self.title = title
+        self.rows = []
+
+    def row_values(self, row):
+        return list(self.rows[row - 1]) if len(self.rows) >= row else []
+
+    def append_row(self, row, **kwargs):
+        self.rows.append(list(row))
+
+    def append_rows(self, rows, **kwargs):
+        self.rows.extend(list(row) for row in rows)
+
+    def get_all_records(self):
+        if not self.rows:
+            return []
+        return [dict(zip(self.rows[0], row)) for row in self.rows[1:]]
+
+    def get_all_values(self):
+        return [list(row) for row in self.rows]
+
+
+class Spreadsheet:
+    """In-memory stand-in for the registrations spreadsheet"""
+
+    def __init__(self):
+        self.sheets = [Worksheet(0, "Internal"), Worksheet(1179914067, "External")]
+
+    def get_worksheet(self, index):
+        return self.sheets[index]
+
+    def worksheets(self):
+        return list(self.sheets)
+
+
+class Client:
+    """In-memory stand-in for the authorized gspread client"""
+
+    def __init__(self):
+        self.spreadsheet = Spreadsheet()
+
+    def open_by_key(self, key):
+        return self.spreadsheet
+
+
+@pytest.fixture(scope="session")
+def client(tmp_path_factory):
+    """
+    The app running against an in-memory spreadsheet and a temporary store.
+    Started once per session (shutdown is final), so tests use unique keys.
+    """
+    saved = (main.registration_store.path, main.google_client.get_client, main.sheets_scheduler)
+    sheets = Client()
+    main.registration_store.path = str(tmp_path_factory.mktemp("store") / "registrations.db")
+    main.google_client.get_client = lambda: sheets
+    main.sheets_scheduler = main.SheetsScheduler(read_per_minute=60000, write_per_minute=60000)
+    try:
+        with TestClient(main.app) as client:
+            # Wait for the warm-up, so it does not reload the duplicate index mid-test
+            deadline = time.monotonic() + 10
+            while client.get("/ready").status_code != 200 and time.monotonic() < deadline:
+                time.sleep(0.05)
+            yield client
+    finally:
+        main.registration_store.path, main.google_client.get_client, main.sheets_scheduler = saved
+
+
+@pytest.fixture
+def internal():
+    """A valid internal registration with a unique key"""
+    return {
+        "name": "Ada Lovelace",
+        "reg_no": f"21ITR{uuid.uuid4().hex[:8]}",
+        "division": "A",
+        "year_of_study": "3",
+        "email": "ada@example.com",
+        "phone_number": "9876543210",
+        "recipt_no": f"TXN{uuid.uuid4().hex[:8]}",
+    }
@@ -0,0 +1,92 @@
+"""
+Tests for queue admission control: capacity, the Retry-After hint and the
+429 responses of the registration endpoints.
+"""
+
+import pytest
+
+import main
+
+
+# QueueAdmission
+
+@pytest.fixture
+def admission(monkeypatch):
+    admission = main.QueueAdmission(capacity=10)
+    backlog = {"size": 0}
+    monkeypatch.setattr(admission, "backlog", lambda: backlog["size"])
+    admission.set_backlog = lambda size: backlog.update(size=size)
+    return admission
+
+
+def test_admission_accepts_up_to_capacity(admission):
+    admission.set_backlog(9)
+    assert admission.check() is None
+    assert admission.check(2) is not None
+    assert admission.rejected == 1
+
+
+def test_admission_unbounded_capacity(admission):
+    admission.capacity = 0
+    admission.set_backlog(10 ** 6)
+    assert admission.check(100) is None
+
+
+def test_admission_without_drain_rate_waits_the_maximum(admission):
+    admission.set_backlog(10)
+    assert admission.check() == main.QUEUE_RETRY_AFTER_MAX
+
+
+def test_admission_retry_after_follows_drain_rate(admission, monkeypatch):
+    now = main.time.monotonic()
+    monkeypatch.setattr(main.time, "monotonic", lambda: now)
+    admission.set_backlog(10)
+    # 300 drained just now: about 10 per second over the 30 s window
+    admission.record_drained(300)
+    assert admission.drain_rate() == pytest.approx(10, rel=0.01)
+    assert admission.check(1) == main.QUEUE_RETRY_AFTER_MIN
+    assert admission.check(500) == 50
+    assert admission.check(10 ** 6) == main.QUEUE_RETRY_AFTER_MAX
+
+
+def test_admission_drain_rate_decays(admission, monkeypatch):
+    now = main.time.monotonic()
+    monkeypatch.setattr(main.time, "monotonic", lambda: now)
+    admission.record_drained(300)
+    monkeypatch.setattr(main.time, "monotonic", lambda: now + admission.DRAIN_RATE_WINDOW)
+    assert admission.drain_rate() == pytest.approx(10 / main.math.e, rel=0.01)
+
+
+# Endpoints
+
+@pytest.fixture
+def full_queue(monkeypatch):
+    monkeypatch.setattr(main.queue_admission, "backlog", lambda: main.queue_admission.capacity + 10 ** 6)
+    return monkeypatch
+
+
+def test_register_rejects_with_429_when_the_queue_is_full(client, internal, full_queue):
+    response = client.post("/register/internal", json=internal)
+    assert response.status_code == 429
+    detail = response.json()["detail"]
+    assert detail["error"] == "Registration queue is full"
+    assert response.headers["Retry-After"] == str(detail["retry_after"])
+    assert main.QUEUE_RETRY_AFTER_MIN <= detail["retry_after"] <= main.QUEUE_RETRY_AFTER_MAX
+    # Nothing was saved, so the same registration is accepted once there is room
+    full_queue.undo()
+    assert client.post("/register/internal", json=internal).status_code == 200
+
+
+def test_register_batch_rejects_with_429_when_the_queue_is_full(client, internal, full_queue):
+    response = client.post("/register/batch", json=[internal])
+    assert response.status_code == 429
+    assert "Retry-After" in response.headers
+
+
+def test_rejected_requests_are_not_replayed(client, internal, full_queue):
+    headers = {"Idempotency-Key": f"key-{internal['reg_no']}"}
+    assert client.post("/register/internal", json=internal, headers=headers).status_code == 429
+    full_queue.undo()
+    response = client.post("/register/internal", json=internal, headers=headers)
+    assert response.status_code == 200
+    assert "Idempotent-Replayed" not in response.headers
@@ -0,0 +1,145 @@
+"""
+Tests for the streaming bulk upload parser and per-record validation
+behind POST /register/batch.
+"""
+
+import asyncio
+
+import pytest
+
+import main
+
+
+class FakeRequest:
+    """Stands in for a Starlette Request whose body arrives in the given chunks"""
+
+    def __init__(self, chunks):
+        self.chunks = chunks
+
+    async def stream(self):
+        for chunk in self.chunks:
+            yield chunk
+
+
+def parse(chunks, ndjson=False):
+    async def collect():
+        return [record async for record in main.iter_batch_records(FakeRequest(chunks), ndjson)]
+    return asyncio.run(collect())
+
+
+def split_every(body: bytes, size: int) -> list:
+    return [body[start:start + size] for start in range(0, len(body), size)]
+
+
+# iter_batch_records
+
+ARRAY_BODY = '[{"reg_no": "R1", "name": "Añа"}, {"reg_no": "R2", "tags": ["a", "]"]} ,{"reg_no": "R3"}]'.encode()
+
+
+def test_json_array_in_one_chunk():
+    assert [record["reg_no"] for record in parse([ARRAY_BODY])] == ["R1", "R2", "R3"]
+
+
+@pytest.mark.parametrize("size", [1, 2, 3, 7, 16])
+def test_json_array_split_at_any_chunk_boundary(size):
+    # Chunks also split multi-byte UTF-8 characters
+    assert parse(split_every(ARRAY_BODY, size)) == parse([ARRAY_BODY])
+
+
+def test_json_array_with_surrounding_whitespace_and_empty_array():
+    assert parse([b"  \n[ ", b"{}", b" ]\n"]) == [{}]
+    assert parse([b"[]"]) == []
+    assert parse([]) == []
+
+
+def test_unterminated_json_array():
+    with pytest.raises(main.BatchBodyError, match="Unterminated"):
+        parse([b'[{"reg_no": "R1"}, {"reg_no": "R2"}'])
+
+
+def test_body_that_is_not_an_array():
+    with pytest.raises(main.BatchBodyError, match="JSON array or NDJSON"):
+        parse([b'{"reg_no": "R1"}'])
+
+
+def test_oversized_json_record(monkeypatch):
+    monkeypatch.setattr(main, "BATCH_MAX_RECORD_BYTES", 32)
+    body = b'[{"reg_no": "R1"}, {"reg_no": "' + b"x" * 64 + b'"}]'
+    with pytest.raises(main.BatchBodyError, match="exceeds 32 bytes"):
+        parse(split_every(body, 8))
+
+
+def test_records_up_to_the_limit_are_accepted(monkeypatch):
+    monkeypatch.setattr(main, "BATCH_MAX_RECORD_BYTES", 32)
+    body = b"[" + b", ".join(b'{"reg_no": "R%d"}' % index for index in range(100)) + b"]"
+    assert len(parse(split_every(body, 8))) == 100
+
+
+def test_ndjson_split_across_chunks():
+    body = b'{"reg_no": "R1"}\n\n{"reg_no": "R2"}\r\n{"reg_no": "R3"}'
+    records = parse(split_every(body, 5), ndjson=True)
+    assert [record["reg_no"] for record in records] == ["R1", "R2", "R3"]
+
+
+def test_ndjson_invalid_line_is_yielded_as_error():
+    records = parse([b'{"reg_no": "R1"}\nnot json\n{"reg_no": "R2"}\n'], ndjson=True)
+    assert records[0] == {"reg_no": "R1"}
+    assert isinstance(records[1], main.BatchBodyError)
+    assert records[2] == {"reg_no": "R2"}
+
+
+def test_oversized_ndjson_line(monkeypatch):
+    monkeypatch.setattr(main, "BATCH_MAX_RECORD_BYTES", 32)
+    with pytest.raises(main.BatchBodyError, match="exceeds 32 bytes"):
+        parse(split_every(b'{"reg_no": "' + b"x" * 64 + b'"}\n', 8), ndjson=True)
+
+
+@pytest.mark.parametrize("body, message", [
+    (b'[{"a": 1} {"b": 2}]', "Expected ','"),
+    (b'[{"a": 1},, {"b": 2}]', "Invalid JSON"),
+    (b'[{"a": 1},]', "Invalid JSON"),
+    (b'[,{"a": 1}]', "Invalid JSON"),
+    (b'[1, 2] xyz', "after the JSON array"),
+    (b'[{"a": 1}]]]', "after the JSON array"),
+    (b'[{"a": }]', "Invalid JSON: Expecting value"),
+    (b'[{"a": tru }]', "Invalid JSON"),
+])
+def test_malformed_json_array(body, message):
+    for size in (1, 4, len(body)):
+        with pytest.raises(main.BatchBodyError, match=message):
+            parse(split_every(body, size))
+
+
+def test_tokens_split_at_chunk_boundary():
+    body = b'[12345, -2.5e+3, true, null, "x\\u00e9\\n", {"k": [false]}]'
+    expected = [12345, -2500.0, True, None, "x\u00e9\n", {"k": [False]}]
+    for size in range(1, len(body) + 1):
+        assert parse(split_every(body, size)) == expected
+
+
+def test_trailing_whitespace_after_array_is_allowed():
+    assert parse([b'[1]', b' \r\n\t ']) == [1]
+
+
+# validate_batch_record
+
+INTERNAL = {"name": "A", "reg_no": "R1", "division": "A", "year_of_study": "3",
+            "email": "a@example.com", "phone_number": "1", "recipt_no": "T1"}
+
+
+def test_validate_infers_type():
+    assert main.validate_batch_record(dict(INTERNAL))[1] == "internal"
+    external = dict(INTERNAL, dept_name="IT", college_name="C")
+    del external["division"]
+    assert main.validate_batch_record(external)[1] == "external"
+
+
+@pytest.mark.parametrize("sheet_type", [["x"], {}, 1, "other"])
+def test_validate_rejects_bad_type(sheet_type):
+    with pytest.raises(ValueError, match="type must be"):
+        main.validate_batch_record(dict(INTERNAL, type=sheet_type))
+
+
+def test_validate_rejects_non_objects():
+    with pytest.raises(ValueError, match="JSON object"):
+        main.validate_batch_record([1])
@@ -0,0 +1,79 @@
+"""
+Unit tests for the in-memory duplicate index, loaded from a stand-in
+worksheet instead of Google Sheets.
+"""
+
+import pytest
+
+import main
+
+
+class Worksheet:
+    """Worksheet stand-in serving get_all_records from a list of rows"""
+
+    def __init__(self, records, on_read=None):
+        self.records = records
+        self.on_read = on_read
+        self.reads = 0
+
+    def get_all_records(self):
+        self.reads += 1
+        if self.on_read is not None:
+            self.on_read()
+        return [dict(record) for record in self.records]
+
+
+def record(reg_no, recipt_no):
+    return {"Name": "A", "Registration Number": reg_no, "recipt_no": recipt_no}
+
+
+@pytest.fixture
+def index():
+    return main.DuplicateIndex()
+
+
+def test_duplicate_index_load_and_contains(index):
+    worksheet = Worksheet([record("R1", "P1"), record(" R2 ", 7)])
+    assert not index.is_loaded("internal")
+    assert index.load("internal", worksheet) == 2
+    assert index.is_loaded("internal")
+    # Keys are normalized: whitespace is stripped and numbers match their text
+    assert index.contains("internal", "R1", "P1")
+    assert index.contains("internal", "R2", "7")
+    assert not index.contains("internal", "R1", "P2")
+    # Each worksheet has its own keys
+    assert not index.contains("external", "R1", "P1")
+
+
+def test_duplicate_index_loads_on_first_lookup(index):
+    worksheet = Worksheet([record("R1", "P1")])
+    assert index.contains("internal", "R1", "P1", worksheet=worksheet)
+    assert index.contains("internal", "R1", "P1", worksheet=worksheet)
+    assert worksheet.reads == 1
+
+
+def test_duplicate_index_add(index):
+    index.load("internal", Worksheet([]))
+    index.add("internal", "R1", "P1")
+    assert index.contains("internal", " R1", "P1 ")
+    assert index.stats()["sheets"]["internal"]["keys"] == 1
+
+
+def test_duplicate_index_keeps_appends_made_during_a_reload(index):
+    worksheet = Worksheet([record("R1", "P1")])
+    # A row appended while the sheet is being downloaded is missing from the download
+    worksheet.on_read = lambda: index.add("internal", "R2", "P2")
+    assert index.load("internal", worksheet) == 2
+    assert index.contains("internal", "R2", "P2")
+
+
+def test_duplicate_index_failed_reload_stays_stale(index):
+    def fail():
+        raise ValueError("download failed")
+
+    index.mark_stale("internal")
+    with pytest.raises(ValueError):
+        index.load("internal", Worksheet([], on_read=fail))
+    assert index.is_stale("internal")
+    index.load("internal", Worksheet([]))
+    assert not index.is_stale("internal")
@@ -0,0 +1,116 @@
+"""
+Unit tests for the durable confirmation email outbox: at-most-once
+recording, retries, dead letters and releasing unsent messages.
+"""
+
+import concurrent.futures
+
+import pytest
+
+import main
+
+
+def registration(reg_no, recipt_no="P1"):
+    return {"reg_no": reg_no, "recipt_no": recipt_no, "email": f"{reg_no.lower()}@example.com"}
+
+
+@pytest.fixture
+def outbox(store):
+    return main.EmailOutbox(store, max_attempts=3)
+
+
+def outbox_row(store, sheet_type, reg_no, recipt_no="P1"):
+    rows = store._read(
+        "SELECT status, attempts FROM email_outbox WHERE sheet_type = ? AND reg_no = ? AND recipt_no = ?",
+        (sheet_type, reg_no, recipt_no)
+    )
+    return rows[0] if rows else None
+
+
+def record(outbox, data, sheet_type, result):
+    outbox.record_result(data, sheet_type, result)
+    # Writes are applied in order, so this waits for the result to be recorded
+    outbox.store.execute(lambda conn: None).result(timeout=5)
+
+
+def test_outbox_records_each_email_once(outbox, store):
+    entries = [(registration("R1"), "internal"), (registration("R2"), "internal")]
+    assert outbox.add(entries) == entries
+    # Resuming the same registrations must not send their emails again
+    assert outbox.add(entries) == []
+    # The same key on the other worksheet is a different registration
+    assert outbox.add([(registration("R1"), "external")]) == [(registration("R1"), "external")]
+    assert outbox_row(store, "internal", "R1") == ("sending", 0)
+
+
+def test_outbox_marks_registrations_synced_in_the_same_transaction(outbox, store):
+    store.insert("id-1", "internal", registration("R1"))
+    transactions = store.transactions
+    assert outbox.add([(registration("R1"), "internal")], ["id-1"]) == [(registration("R1"), "internal")]
+    assert store.transactions == transactions + 1
+    assert store.sync_states(["id-1"])["id-1"][1:] == ("synced", "sending")
+
+
+def test_outbox_sends_nothing_it_could_not_record(outbox, store, monkeypatch):
+    failed = concurrent.futures.Future()
+    failed.set_exception(main.sqlite3.OperationalError("database is locked"))
+    monkeypatch.setattr(store, "mark_synced", lambda *args, **kwargs: failed)
+    assert outbox.add([(registration("R1"), "internal")], ["id-1"]) == []
+
+
+def test_outbox_retries_then_dead_letters(outbox, store, monkeypatch):
+    data = registration("R1")
+    outbox.add([(data, "internal")])
+    record(outbox, data, "internal", {"success": False, "message": "connection refused"})
+    assert outbox_row(store, "internal", "R1") == ("pending", 1)
+    # Not due until its backoff has passed
+    assert outbox.claim_due() == []
+    monkeypatch.setattr(main.time, "time", lambda: 10 ** 10)
+    assert outbox.claim_due() == [(data, "internal")]
+    assert outbox_row(store, "internal", "R1") == ("sending", 1)
+
+    record(outbox, data, "internal", {"success": False, "message": "connection refused"})
+    outbox.claim_due()
+    record(outbox, data, "internal", {"success": False, "message": "connection refused"})
+    assert outbox_row(store, "internal", "R1") == ("dead", 3)
+    assert outbox.claim_due() == []
+    [dead_letter] = outbox.dead_letters()
+    assert dead_letter["reg_no"] == "R1"
+    assert dead_letter["sheet_type"] == "internal"
+    assert dead_letter["last_error"] == "connection refused"
+
+
+def test_outbox_dead_letters_permanent_failures_at_once(outbox, store):
+    data = registration("R1")
+    outbox.add([(data, "internal")])
+    record(outbox, data, "internal", {"success": False, "permanent": True, "message": "SMTP not configured"})
+    assert outbox_row(store, "internal", "R1") == ("dead", 1)
+
+
+def test_outbox_redrives_dead_letters(outbox, store):
+    data = registration("R1")
+    outbox.add([(data, "internal")])
+    record(outbox, data, "internal", {"success": False, "permanent": True, "message": "SMTP not configured"})
+    assert outbox.redrive_dead_letters() == 1
+    assert outbox_row(store, "internal", "R1") == ("pending", 0)
+    assert outbox.claim_due() == [(data, "internal")]
+
+
+def test_outbox_sent_messages_are_final(outbox, store):
+    data = registration("R1")
+    outbox.add([(data, "internal")])
+    record(outbox, data, "internal", {"success": True})
+    assert outbox_row(store, "internal", "R1") == ("sent", 0)
+    assert outbox.release([(data, "internal")]) == 0
+    assert outbox.recover_interrupted() == 0
+    assert outbox.stats()["sent"] == 1
+
+
+def test_outbox_release_returns_unsent_messages_to_pending(outbox, store):
+    entries = [(registration("R1"), "internal"), (registration("R2"), "internal")]
+    outbox.add(entries)
+    assert outbox.release(entries[:1]) == 1
+    assert outbox_row(store, "internal", "R1") == ("pending", 0)
+    # Messages that may have been mid-send are dead-lettered instead of resent
+    assert outbox.recover_interrupted() == 1
+    assert outbox_row(store, "internal", "R2") == ("dead", 0)
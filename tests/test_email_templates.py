@@ -0,0 +1,82 @@
+"""
+Unit tests for the precompiled confirmation email templates and the
+multipart message encoder.
+"""
+
+import email
+import email.policy
+
+import pytest
+
+import main
+
+
+INTERNAL = {
+    "name": "Ada <script>alert(1)</script> & Co",
+    "reg_no": "21ITR001",
+    "division": "A",
+    "year_of_study": "3",
+    "email": "ada@example.com",
+    "phone_number": "9876543210",
+    "recipt_no": "TXN\"001'",
+}
+
+EXTERNAL = dict(INTERNAL, dept_name="IT", college_name="ABC <College>")
+
+
+@pytest.mark.parametrize("sheet_type, data", [("internal", INTERNAL), ("external", EXTERNAL)])
+def test_template_escapes_fields_in_html(sheet_type, data):
+    rendered = main.EMAIL_TEMPLATES[sheet_type].render_html(data)
+    assert "<script>" not in rendered
+    assert "Ada &lt;script&gt;alert(1)&lt;/script&gt; &amp; Co" in rendered
+    assert "TXN&quot;001&#x27;" in rendered
+
+
+def test_template_renders_plain_text_without_markup():
+    text = main.EMAIL_TEMPLATES["external"].render_text(EXTERNAL)
+    # Plain text is not HTML, so the fields appear as they were entered
+    assert INTERNAL["name"] in text
+    assert "ABC <College>" in text
+    assert "<html" not in text.lower()
+    assert "<style" not in text.lower()
+    assert "{" not in text.replace(INTERNAL["name"], "")
+
+
+def test_template_matches_one_off_formatting():
+    # The compiled template renders exactly what formatting the source would
+    data = {field: f"value-{field}" for field in main.EMAIL_TEMPLATES["internal"].html_fields}
+    assert main.EMAIL_TEMPLATES["internal"].render_html(data) == main.INTERNAL_EMAIL_TEMPLATE.format(**data)
+
+
+def test_render_registration_email():
+    subject, html_content, text_content = main.render_registration_email(INTERNAL, "internal")
+    assert subject == main.EMAIL_TEMPLATES["internal"].subject
+    assert "&lt;script&gt;" in html_content
+    assert INTERNAL["name"] in text_content
+
+
+def test_encoded_message_has_plain_text_and_html_parts():
+    subject, html_content, text_content = main.render_registration_email(INTERNAL, "internal")
+    raw = main.encode_confirmation_message("ada@example.com", subject, html_content, text_content)
+    message = email.message_from_bytes(raw, policy=email.policy.default)
+    assert message.get_content_type() == "multipart/alternative"
+    assert message["To"] == "ada@example.com"
+    assert message["Subject"] == subject
+    plain, rich = message.iter_parts()
+    # The plain-text part comes first so clients prefer the HTML one
+    assert plain.get_content_type() == "text/plain"
+    assert rich.get_content_type() == "text/html"
+    assert plain.get_content().replace("\r\n", "\n") == text_content
+    assert rich.get_content().replace("\r\n", "\n") == html_content.replace("\r\n", "\n")
+
+
+def test_encoded_message_without_plain_text():
+    raw = main.encode_confirmation_message("ada@example.com", "Subject", "<p>Hi</p>")
+    message = email.message_from_bytes(raw, policy=email.policy.default)
+    assert [part.get_content_type() for part in message.iter_parts()] == ["text/html"]
+
+
+@pytest.mark.parametrize("to_email", ["ada@example.com\r\nBcc: eve@example.com", "adä@example.com"])
+def test_encoder_rejects_unsafe_recipients(to_email):
+    with pytest.raises(ValueError):
+        main.encode_confirmation_message(to_email, "Subject", "<p>Hi</p>")
@@ -0,0 +1,40 @@
+"""
+Endpoint tests for the registration API, run against an in-memory
+spreadsheet (see conftest.py).
+"""
+
+import main
+
+
+def test_register_internal(client, internal):
+    response = client.post("/register/internal", json=internal)
+    assert response.status_code == 200
+    body = response.json()
+    assert body["success"] is True
+    assert body["data"]["reg_no"] == internal["reg_no"]
+    assert client.get(f"/registrations/{body['registration_id']}").status_code == 200
+
+
+def test_register_duplicate_is_rejected_with_409(client, internal):
+    assert client.post("/register/internal", json=internal).status_code == 200
+    response = client.post("/register/internal", json=internal)
+    assert response.status_code == 409
+    assert response.json()["detail"]["error"] == "Duplicate registration"
+    # Keys are compared without surrounding whitespace
+    padded = dict(internal, reg_no=f" {internal['reg_no']} ", recipt_no=f"{internal['recipt_no']} ")
+    assert client.post("/register/internal", json=padded).status_code == 409
+
+
+def test_register_same_key_on_the_other_worksheet_is_accepted(client, internal):
+    assert client.post("/register/internal", json=internal).status_code == 200
+    external = dict(internal, dept_name="IT", college_name="ABC College")
+    del external["division"]
+    assert client.post("/register/external", json=external).status_code == 200
+    assert client.post("/register/external", json=external).status_code == 409
+
+
+def test_register_duplicate_of_a_row_already_in_the_sheet(client, internal):
+    # Keys already in the worksheet are found through the duplicate index
+    main.duplicate_index.add("internal", internal["reg_no"], internal["recipt_no"])
+    response = client.post("/register/internal", json=internal)
+    assert response.status_code == 409
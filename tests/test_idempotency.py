@@ -0,0 +1,112 @@
+"""
+Tests for Idempotency-Key support: the response cache and the replay
+behaviour of the registration endpoints.
+"""
+
+import asyncio
+import uuid
+
+import main
+
+
+# IdempotencyCache
+
+def test_idempotency_cache_stores_first_response():
+    async def run():
+        cache = main.IdempotencyCache(max_entries=10, ttl=60)
+        assert cache.get("internal", "key") is None
+        entry = cache.begin("internal", "key", cache.fingerprint({"reg_no": "R1"}))
+        assert cache.get("internal", "key") is entry
+        assert not entry["done"].done()
+        cache.finish("internal", "key", entry, (200, {"success": True}))
+        assert entry["done"].done()
+        replay = cache.get("internal", "key")
+        assert replay["response"] == (200, {"success": True})
+        assert replay["fingerprint"] == cache.fingerprint({"reg_no": "R1"})
+        # Scopes are separate
+        assert cache.get("external", "key") is None
+    asyncio.run(run())
+
+
+def test_idempotency_fingerprint_ignores_key_order():
+    fingerprint = main.IdempotencyCache.fingerprint
+    assert fingerprint({"a": 1, "b": 2}) == fingerprint({"b": 2, "a": 1})
+    assert fingerprint({"a": 1}) != fingerprint({"a": 2})
+
+
+def test_idempotency_failed_request_frees_the_key():
+    async def run():
+        cache = main.IdempotencyCache(max_entries=10, ttl=60)
+        entry = cache.begin("internal", "key", "fingerprint")
+        cache.finish("internal", "key", entry, None)
+        assert entry["done"].done()
+        assert cache.get("internal", "key") is None
+    asyncio.run(run())
+
+
+def test_idempotency_entries_expire(monkeypatch):
+    async def run():
+        cache = main.IdempotencyCache(max_entries=10, ttl=60)
+        now = main.time.monotonic()
+        entry = cache.begin("internal", "key", "fingerprint")
+        cache.finish("internal", "key", entry, (200, {}))
+        monkeypatch.setattr(main.time, "monotonic", lambda: now + 61)
+        assert cache.get("internal", "key") is None
+        assert cache.stats()["entries"] == 0
+    asyncio.run(run())
+
+
+def test_idempotency_evicts_least_recently_used():
+    async def run():
+        cache = main.IdempotencyCache(max_entries=2, ttl=60)
+        cache.begin("internal", "a", "fingerprint")
+        cache.begin("internal", "b", "fingerprint")
+        cache.get("internal", "a")
+        cache.begin("internal", "c", "fingerprint")
+        assert cache.get("internal", "b") is None
+        assert cache.get("internal", "a") is not None
+        assert cache.get("internal", "c") is not None
+        assert cache.evictions == 1
+    asyncio.run(run())
+
+
+# Endpoints
+
+def test_register_replays_the_first_response(client, internal):
+    headers = {"Idempotency-Key": uuid.uuid4().hex}
+    first = client.post("/register/internal", json=internal, headers=headers)
+    assert first.status_code == 200
+    assert "Idempotent-Replayed" not in first.headers
+    retry = client.post("/register/internal", json=internal, headers=headers)
+    assert retry.status_code == 200
+    assert retry.headers["Idempotent-Replayed"] == "true"
+    assert retry.json() == first.json()
+
+
+def test_register_replays_a_duplicate_rejection(client, internal):
+    assert client.post("/register/internal", json=internal).status_code == 200
+    headers = {"Idempotency-Key": uuid.uuid4().hex}
+    assert client.post("/register/internal", json=internal, headers=headers).status_code == 409
+    retry = client.post("/register/internal", json=internal, headers=headers)
+    assert retry.status_code == 409
+    assert retry.headers["Idempotent-Replayed"] == "true"
+
+
+def test_register_rejects_a_reused_key_with_422(client, internal):
+    headers = {"Idempotency-Key": uuid.uuid4().hex}
+    assert client.post("/register/internal", json=internal, headers=headers).status_code == 200
+    other = dict(internal, reg_no=f"{internal['reg_no']}-2")
+    response = client.post("/register/internal", json=other, headers=headers)
+    assert response.status_code == 422
+    assert response.json()["detail"]["error"] == "Idempotency-Key reused"
+    # Keys are scoped per endpoint
+    external = dict(other, dept_name="IT", college_name="ABC College")
+    del external["division"]
+    assert client.post("/register/external", json=external, headers=headers).status_code == 200
+
+
+def test_register_rejects_an_overlong_key(client, internal):
+    headers = {"Idempotency-Key": "k" * (main.IDEMPOTENCY_KEY_MAX_LENGTH + 1)}
+    response = client.post("/register/internal", json=internal, headers=headers)
+    assert response.status_code == 400
+    assert response.json()["detail"]["error"] == "Invalid Idempotency-Key"
@@ -0,0 +1,93 @@
+"""
+Unit tests for the Sheets quota scheduler's retry rules: transient reads
+are retried, writes only on 429 because a 5xx may have been applied.
+"""
+
+import json
+
+import gspread
+import pytest
+import requests
+
+import main
+
+
+def api_error(status):
+    response = requests.Response()
+    response.status_code = status
+    response._content = json.dumps({"error": {"code": status, "message": "error", "status": "ERROR"}}).encode()
+    return gspread.exceptions.APIError(response)
+
+
+class Flaky:
+    """Callable that raises the given errors in turn, then returns "ok" """
+
+    def __init__(self, *errors):
+        self.errors = list(errors)
+        self.calls = 0
+
+    def __call__(self):
+        self.calls += 1
+        if self.errors:
+            raise self.errors.pop(0)
+        return "ok"
+
+
+@pytest.fixture
+def scheduler():
+    scheduler = main.SheetsScheduler(read_per_minute=60000, write_per_minute=60000, max_retries=2)
+    scheduler.backoff_delay = lambda attempt: 0
+    return scheduler
+
+
+@pytest.mark.parametrize("error", [
+    api_error(429),
+    api_error(503),
+    requests.exceptions.ConnectionError("reset"),
+])
+def test_scheduler_retries_transient_reads(scheduler, error):
+    func = Flaky(error)
+    assert scheduler.call("read", func) == "ok"
+    assert func.calls == 2
+    assert scheduler.retries == 1
+
+
+def test_scheduler_retries_writes_on_429(scheduler):
+    func = Flaky(api_error(429), api_error(429))
+    assert scheduler.call("write", func) == "ok"
+    assert func.calls == 3
+
+
+@pytest.mark.parametrize("error", [
+    api_error(500),
+    api_error(503),
+    requests.exceptions.Timeout("timed out"),
+])
+def test_scheduler_does_not_retry_ambiguous_writes(scheduler, error):
+    func = Flaky(error)
+    with pytest.raises(type(error)):
+        scheduler.call("write", func)
+    assert func.calls == 1
+    assert scheduler.retries == 0
+
+
+@pytest.mark.parametrize("kind", ["read", "write"])
+def test_scheduler_does_not_retry_permanent_errors(scheduler, kind):
+    func = Flaky(api_error(403))
+    with pytest.raises(gspread.exceptions.APIError):
+        scheduler.call(kind, func)
+    assert func.calls == 1
+
+
+def test_scheduler_gives_up_after_max_retries(scheduler):
+    func = Flaky(*[api_error(503)] * 5)
+    with pytest.raises(gspread.exceptions.APIError):
+        scheduler.call("read", func)
+    assert func.calls == scheduler.max_retries + 1
+
+
+def test_scheduler_item_retries(scheduler):
+    assert scheduler.record_item_retry("id-1") == 1
+    assert scheduler.record_item_retry("id-1") == 2
+    scheduler.clear_item("id-1")
+    assert scheduler.record_item_retry("id-1") == 1
@@ -0,0 +1,160 @@
+"""
+Unit tests for the local SQLite registration store: group commits,
+duplicate keys, sync bookkeeping and migration of older databases.
+"""
+
+import concurrent.futures
+import sqlite3
+import threading
+
+import pytest
+
+import main
+
+
+def registration(reg_no, recipt_no="P1"):
+    return {"reg_no": reg_no, "recipt_no": recipt_no, "email": f"{reg_no.strip().lower()}@example.com"}
+
+
+def test_store_insert_many_shares_one_transaction(store):
+    rows = [(f"id-{index}", "internal", registration(f"R{index}")) for index in range(5)]
+    futures = store.insert_many(rows)
+    assert [future.result(timeout=5) for future in futures] == [True] * 5
+    assert store.transactions == 1
+    assert [row["registration_id"] for row in store.unsynced()] == [f"id-{index}" for index in range(5)]
+
+
+def test_store_concurrent_inserts_are_group_committed(store):
+    barrier = threading.Barrier(8)
+
+    def insert(index):
+        barrier.wait()
+        store.insert(f"id-{index}", "internal", registration(f"R{index}"))
+
+    with concurrent.futures.ThreadPoolExecutor(8) as pool:
+        list(pool.map(insert, range(8)))
+    assert store.rows_inserted == 8
+    assert store.transactions < 8
+
+
+def test_store_duplicate_in_same_group_fails_only_that_row(store):
+    futures = store.insert_many([
+        ("id-1", "internal", registration("R1")),
+        ("id-2", "internal", registration(" R1 ")),
+        ("id-3", "external", registration("R1")),
+        ("id-4", "internal", registration("R2")),
+    ])
+    assert futures[0].result(timeout=5) is True
+    with pytest.raises(main.DuplicateRegistrationError):
+        futures[1].result(timeout=5)
+    # The same key on the other worksheet is a separate registration
+    assert futures[2].result(timeout=5) is True
+    assert futures[3].result(timeout=5) is True
+    assert store.transactions == 1
+    assert store.rows_inserted == 3
+
+
+def test_store_duplicate_of_committed_row(store):
+    store.insert("id-1", "internal", registration("R1"))
+    with pytest.raises(main.DuplicateRegistrationError):
+        store.insert("id-2", "internal", registration("R1"))
+    assert sorted(store.keys()) == [("internal", "R1", "P1")]
+
+
+def test_store_mark_synced_advances_watermark(store):
+    for future in store.insert_many([(f"id-{index}", "internal", registration(f"R{index}")) for index in range(3)]):
+        future.result(timeout=5)
+    store.mark_synced(["id-0", "id-2"]).result(timeout=5)
+    assert [row["registration_id"] for row in store.unsynced()] == ["id-1"]
+    assert store.stats()["sheets"]["internal"] == {"rows": 3, "unsynced": 1, "watermark": 1}
+    store.mark_synced(["id-1"]).result(timeout=5)
+    assert store.stats()["sheets"]["internal"]["watermark"] == 3
+
+
+def test_store_mark_synced_records_why_a_row_was_not_mirrored(store):
+    store.insert("id-1", "internal", registration("R1"))
+    store.insert("id-2", "internal", registration("R2"))
+    store.mark_synced(["id-1"]).result(timeout=5)
+    store.mark_synced(["id-2"], status="duplicate").result(timeout=5)
+    assert store.lookup("id-1")["sync_status"] == "synced"
+    assert store.lookup("id-2")["sync_status"] == "duplicate"
+    assert store.unsynced() == []
+    assert store.lookup("id-3") is None
+
+
+def test_store_mark_synced_runs_then_in_the_same_transaction(store):
+    store.insert("id-1", "internal", registration("R1"))
+    transactions = store.transactions
+
+    def then(conn):
+        return conn.execute("SELECT synced_at IS NOT NULL FROM registrations").fetchone()[0]
+
+    assert store.mark_synced(["id-1"], then).result(timeout=5) == 1
+    assert store.transactions == transactions + 1
+
+
+def test_store_attempted_only_reports_rows_this_store_appended(store):
+    store.insert("id-1", "internal", registration("R1"))
+    store.insert("id-2", "internal", registration("R2"))
+    assert store.attempted("internal", [registration("R1"), registration("R2")]) == set()
+    store.mark_attempted("internal", [registration(" R1 ")])
+    entries = [registration("R1"), registration("R2"), registration("R3")]
+    assert store.attempted("internal", entries) == {("R1", "P1")}
+    assert store.attempted("external", entries) == set()
+
+
+def test_store_migrates_older_databases(tmp_path):
+    path = str(tmp_path / "registrations.db")
+    conn = sqlite3.connect(path)
+    conn.executescript("""
+        CREATE TABLE registrations (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            registration_id TEXT NOT NULL UNIQUE,
+            sheet_type TEXT NOT NULL,
+            reg_no TEXT NOT NULL,
+            recipt_no TEXT NOT NULL,
+            email TEXT NOT NULL,
+            data TEXT NOT NULL,
+            created_at TEXT NOT NULL,
+            synced_at TEXT
+        );
+        CREATE TABLE email_outbox (
+            reg_no TEXT NOT NULL,
+            recipt_no TEXT NOT NULL,
+            sheet_type TEXT NOT NULL,
+            email TEXT NOT NULL,
+            data TEXT NOT NULL,
+            status TEXT NOT NULL,
+            attempts INTEGER NOT NULL DEFAULT 0,
+            next_attempt_at REAL,
+            last_error TEXT,
+            created_at TEXT NOT NULL,
+            updated_at TEXT NOT NULL,
+            sent_at TEXT,
+            PRIMARY KEY (reg_no, recipt_no)
+        );
+        INSERT INTO registrations (registration_id, sheet_type, reg_no, recipt_no, email, data, created_at)
+            VALUES ('id-1', 'internal', 'R1', 'P1', 'r1@example.com', '{}', '2025-10-05 14:30:45');
+        INSERT INTO email_outbox (reg_no, recipt_no, sheet_type, email, data, status, created_at, updated_at)
+            VALUES ('R1', 'P1', 'internal', 'r1@example.com', '{}', 'sent', '2025-10-05 14:30:45', '2025-10-05 14:30:45');
+    """)
+    conn.close()
+
+    store = main.RegistrationStore(path=path, commit_interval=0.05)
+    store.open()
+    try:
+        assert store.lookup("id-1")["sync_status"] is None
+        assert store.sync_states(["id-1"]) == {"id-1": (None, None, "sent")}
+        # The outbox is now keyed per worksheet
+        assert store.execute(lambda conn: conn.execute(
+            "INSERT INTO email_outbox (reg_no, recipt_no, sheet_type, email, data, status, created_at, updated_at) "
+            "VALUES ('R1', 'P1', 'external', 'r1@example.com', '{}', 'pending', '', '')"
+        ).rowcount).result(timeout=5) == 1
+    finally:
+        store.close()
+
+
+def test_store_rejects_writes_when_closed(tmp_path):
+    store = main.RegistrationStore(path=str(tmp_path / "registrations.db"))
+    with pytest.raises(RuntimeError):
+        store.insert("id-1", "internal", registration("R1"))